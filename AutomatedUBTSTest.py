@@ -10,9 +10,15 @@ from constants import PIN
 import serial
 from matplotlib import pyplot as plt
 from threading import Thread
+from queue import Queue, Empty
 from BrewerControl import GRID_Elite
 from GridEliteController import EliteController
 from MccTempMonitor import MCC_Mixed_Monitor
+from brew_writer import BrewDataWriter
+from scale_reader import ScaleFrameReader
+from device_readers import DeviceReader, stop_readers, SAMPLE_QUEUE_SIZE
+from figure_renderer import decimate_frame
+from brew_analyzer import OnlineBrewAnalyzer
 
 HEADERS = "NOTES,Predicted_Temp,Effective Target Temp,dT/dx,Estimated Temp,Measured_Temp,Flow Command,Flow Traget,Target Temp,Power Command,Flow Measured,T_offset,pwr_flow_offset,V_c2,ramp_coeff,T_in,vol"
 
@@ -23,10 +29,12 @@ class RoboScale:
         self.scale_serial = serial.Serial(scale_com_port, 9600, timeout=1)
         self.pump_on = False
         self.continuous_print = False
+        self.frame_reader = ScaleFrameReader()
 
     def turn_on_continuous_print(self):
         self.scale_serial.write('CA\r\n'.encode('UTF-8'))
         sleep(0.5)
+        self.frame_reader.reset()
         self.continuous_print = True
 
     def turn_off_continuous_print(self):
@@ -49,16 +57,18 @@ class RoboScale:
     def zero(self):
         self.scale_serial.write('T\r\n'.encode('UTF-8'))
 
-    def get_state(self):
+    def read_frames(self):
+        # Every reading completed since the last call as (ts, mass, is_not_stable)
         if not self.continuous_print:
             self.turn_on_continuous_print()
 
-        all_printouts = self.read_all()
-        if '\r\n' in all_printouts:
-            all_masses = re.findall('\d*\.?\d+',all_printouts)
-            is_not_stable = '?' in all_printouts.split('\r\n')[-2]
-            if len(all_masses) > 0:
-                return float(all_masses[-1]), is_not_stable
+        return self.frame_reader.feed(self.scale_serial.read_all(), time())
+
+    def get_state(self):
+        readings = self.read_frames()
+        if readings:
+            _, mass, is_not_stable = readings[-1]
+            return mass, is_not_stable
 
         return None, False
 
@@ -89,6 +99,8 @@ class RoboScale:
 
 
 class AutomatedUBTS:
+    # Seconds without brewer output that end a brew
+    brew_idle_timeout = 10
 
     def __init__(self, com_port, fldr_path, daq):
         self.controller = EliteController(com_port)
@@ -102,18 +114,23 @@ class AutomatedUBTS:
         self.brew_count = 0
         self.local_fldr_path = fldr_path
         self.headers = [h for h in HEADERS.split(',')]
-        self.brew_data = {h:np.array([]) for h in self.headers}
+        self.brew_data = None
+
+    def start_brew_data(self):
+        # Brewer rows are streamed to disk while the brew runs
+        self.reset_brew_data()
+        self.brew_data = BrewDataWriter(self.local_fldr_path, self.headers)
 
     def reset_brew_data(self):
-        self.brew_data = {h: np.array([]) for h in self.headers}
+        if self.brew_data is not None:
+            self.brew_data.discard()
+        self.brew_data = None
 
     def save_brew_data(self, ts, temp, size, flow_rate):
-        df = pd.DataFrame(self.brew_data)
-
         save_str = self.local_fldr_path + '/' + num2str(ts, 0)
         for header, val in zip(['temp', 'size', 'flow_rate', 'cycle'], [temp, size, flow_rate, self.brew_count]):
             save_str += '_' + header + '-' + num2str(val, 0)
-        df.to_csv(save_str + '.csv', index=0)
+        self.brew_data.finalize(save_str + '.csv')
 
         return save_str
 
@@ -125,6 +142,8 @@ class AutomatedUBTS:
         ts = 0
 
         self.brewer.brew(temperature, brew_size, flow_rate)
+        # Only once the brew started, so a failed start leaves no file behind
+        self.start_brew_data()
 
         while brew_is_ongoing:
             try:
@@ -143,15 +162,12 @@ class AutomatedUBTS:
                     if not start_time:
                         start_time = ts
 
-                    self.brew_data[self.headers[0]] = np.append(self.brew_data[self.headers[0]], ts)
-
-                    for header, dat in zip(self.headers[1::], numeric_data):
-                        self.brew_data[header] = np.append(self.brew_data[header], dat)
+                    self.brew_data.append([ts] + numeric_data)
 
                 elif len(response) > 1:
                     last_read_time = ts
 
-                elif start_time and ((ts - last_read_time) > 10):
+                elif start_time and ((ts - last_read_time) > self.brew_idle_timeout):
                     brew_is_ongoing = False
             except Exception as e:
                 print(e)
@@ -164,6 +180,7 @@ class AutomatedUBTS:
             return pressure, save_str
         else:
             print('No brew')
+            self.reset_brew_data()
             return None, None
 
     def run_test_plan(self, daq_is_counter=True):
@@ -191,8 +208,9 @@ class AutomatedUBTS:
             plt.close()
             if brew_was_successful:
 
-                plot_df = pd.DataFrame(self.brew_data)
-                plot_df[['Estimated Temp', 'Measured_Temp', 'Target Temp']].plot()
+                plot_df = pd.read_csv(save_str + '.csv')
+                columns = ['Estimated Temp', 'Measured_Temp', 'Target Temp']
+                decimate_frame(plot_df, columns)[columns].plot()
                 # df[['T_out']].plot()
                 # plot and save plot
                 figure = plt.gcf()
@@ -204,76 +222,124 @@ class AutomatedUBTS:
 
 
 class AutomatedPAMS(AutomatedUBTS):
+    brew_idle_timeout = 20
+    # Brew seconds per second of sample timestamps, only not 1 for simulated devices
+    sample_time_scale = 1.
+
     def __init__(self, com_port, fldr_path, daq, scale_com, k_mini_com):
 
         super().__init__(com_port, fldr_path, daq)
         self.scale = RoboScale('COM' + k_mini_com, 'COM' + scale_com)
 
-    def brew_random(self, flow_rate, brew_size, temperature):
+    def read_brewer(self):
+        return [(time(), self.brewer.read_ln())]
+
+    def read_scale(self):
+        return [(ts, mass) for ts, mass, _ in self.scale.read_frames()]
+
+    def start_readers(self, samples):
+        # The scale is polled without blocking, the brewer blocks on its line
+        # reads, which are cancelled on stop if the brewer exposes that. Brewer
+        # lines are the saved brew rows, so they are never dropped.
+        readers = [DeviceReader('scale', self.read_scale, samples, idle=0.005),
+                   DeviceReader('brewer', self.read_brewer, samples,
+                                cancel=getattr(self.brewer, 'cancel_read', None), lossless=True)]
+        for reader in readers:
+            reader.start()
+        return readers
+
+    def brew_random(self, flow_rate, brew_size, temperature, bloom_time=None):
         header_len = len(self.headers)
         brew_is_ongoing = True
         start_time = None
         last_read_time = 0
         ts = 0
-        brew_mass_dict = {'time':np.array([]), 'mass':np.array([])}
+        # Drip and flow results as the samples arrive, and the mean of the
+        # last 10 masses for the pump decision
+        analyzer = OnlineBrewAnalyzer(bloom_time, time_scale=self.sample_time_scale)
+        temp_idx = self.headers.index('Measured_Temp') - 1
 
         self.brewer.brew(temperature, brew_size, flow_rate)
         self.scale.turn_on_continuous_print()
+        # Only once the brew started, so a failed start leaves no files behind
+        self.start_brew_data()
+        brew_mass_data = BrewDataWriter(self.local_fldr_path, ['time', 'mass'], tag='mass', index=True)
+
+        # Each device is read by its own thread, this loop only consumes samples
+        samples = Queue(maxsize=SAMPLE_QUEUE_SIZE)
+        readers = self.start_readers(samples)
+        # samples each reader dropped on a full queue, saved with the analysis
+        dropped = {}
 
         while brew_is_ongoing:
             try:
-                brew_mass, _ = self.scale.get_state()
-
-                if brew_mass:
-                    brew_mass_dict['mass'] = np.append(brew_mass_dict['mass'], brew_mass)
-                    brew_mass_dict['time'] = np.append(brew_mass_dict['time'], time())
-
-                    if brew_mass > 370:
-                        self.scale.run_pump()
-                    elif self.scale.pump_on:
-                        if len(brew_mass_dict['mass']) >=11:
-                            if (np.mean(brew_mass_dict['mass'][-10::]) < 200):
+                try:
+                    source, sample_ts, value = samples.get(timeout=0.5)
+                except Empty:
+                    source, value = None, None
+
+                if isinstance(value, Exception):
+                    raise value
+
+                elif source == 'scale':
+                    brew_mass = value
+                    if brew_mass:
+                        brew_mass_data.append((sample_ts, brew_mass))
+                        analyzer.add_mass(sample_ts, brew_mass)
+
+                        if brew_mass > 370:
+                            self.scale.run_pump()
+                        elif self.scale.pump_on:
+                            if (analyzer.mean() < 200):
                                 self.scale.stop_pump()
-                        elif (np.mean(brew_mass_dict['mass']) < 200):
-                            self.scale.stop_pump()
-
-
-                response = self.brewer.read_ln()
-                data = response.split(',')
-                ts = time()
 
-                if len(response) > 1:
-                    print(num2str(ts) + ' ' + response)
+                elif source == 'brewer':
+                    response = value
+                    data = response.split(',')
+                    ts = sample_ts
 
-                master_csv_ln_sans_letters = ','.join(data[1::])
+                    if len(response) > 1:
+                        print(num2str(ts) + ' ' + response)
 
-                if (len(data) == header_len) and (not re.search('[a-zA-Z]', master_csv_ln_sans_letters)):
-                    numeric_data = [float(x) for x in data[1::]]
-                    last_read_time = ts
-                    if not start_time:
-                        start_time = ts
+                    master_csv_ln_sans_letters = ','.join(data[1::])
 
-                    self.brew_data[self.headers[0]] = np.append(self.brew_data[self.headers[0]], ts)
+                    if (len(data) == header_len) and (not re.search('[a-zA-Z]', master_csv_ln_sans_letters)):
+                        numeric_data = [float(x) for x in data[1::]]
+                        last_read_time = ts
+                        if not start_time:
+                            start_time = ts
 
-                    for header, dat in zip(self.headers[1::], numeric_data):
-                        self.brew_data[header] = np.append(self.brew_data[header], dat)
+                        self.brew_data.append([ts] + numeric_data)
+                        analyzer.add_brewer(ts, numeric_data[temp_idx])
 
-                elif len(response) > 1:
-                    last_read_time = ts
+                    elif len(response) > 1:
+                        last_read_time = ts
 
-                elif start_time and ((ts - last_read_time) > 20):
+                if start_time and ((time() - last_read_time) > self.brew_idle_timeout):
                     brew_is_ongoing = False
             except Exception as e:
                 print(e)
+                if not stop_readers(readers, dropped):
+                    # A reader still on its port would read alongside the reset
+                    print('Ending the brew, a device reader is still running')
+                    brew_is_ongoing = False
+                    continue
                 self.brewer.reset()
                 sleep(1)
                 self.scale.drain_scale()
+                self.scale.turn_on_continuous_print()
+                samples = Queue(maxsize=SAMPLE_QUEUE_SIZE)
+                readers = self.start_readers(samples)
+
+        stop_readers(readers, dropped)
 
         if ts:
             save_str = self.save_brew_data(ts, temperature, brew_size, flow_rate)
 
-            brew_mass_df = pd.DataFrame(brew_mass_dict)
-            brew_mass_df.to_csv(save_str + '_mass.csv')
+            brew_mass_data.finalize(save_str + '_mass.csv')
+            analyzer.save(save_str + '_analysis.csv', scale_dropped=dropped.get('scale', 0),
+                          brewer_dropped=dropped.get('brewer', 0))
+            print(analyzer.results())
 
             pressure = True
             self.brew_count += 1
@@ -282,6 +348,8 @@ class AutomatedPAMS(AutomatedUBTS):
             return pressure, save_str
         else:
             print('No brew')
+            brew_mass_data.discard()
+            self.reset_brew_data()
             self.scale.turn_off_continuous_print()
             return None, None
 
@@ -356,7 +424,8 @@ class AutomatedPAMS(AutomatedUBTS):
                 self.daq.re_zero()
             daq_thread = Thread(target=self.daq.run_with_sig_kill)
             daq_thread.start()
-            brew_was_successful, save_str = self.brew_random(flow, vol, temp)
+            brew_was_successful, save_str = self.brew_random(flow, vol, temp,
+                                                             bloom_times[i] if coffee_bloom else None)
             sleep(10)
             self.daq.keep_running = False
 
@@ -386,7 +455,8 @@ class AutomatedPAMS(AutomatedUBTS):
                 # ubts_opto_fig = ubts_opto_ax.get_figure()
                 # plt.title('UBTS Opto Sensor Data')
 
-                ubts_temp_ax = self.daq.data_df[['Entrance_Needle', 'Exit_Needle', 'In_Cup']].plot()
+                columns = ['Entrance_Needle', 'Exit_Needle', 'In_Cup']
+                ubts_temp_ax = decimate_frame(self.daq.data_df, columns)[columns].plot()
                 ubts_temp_fig = ubts_temp_ax.get_figure()
                 plt.title('UBTS Temperature Data')
 
@@ -9,40 +9,217 @@ import numpy as np
 
 np.seterr(divide='ignore', invalid='ignore')
 
-import re
+import argparse
 import time
 import pandas as pd
 
 pd.options.mode.chained_assignment = None  # default='warn'
 
 import os
-import matplotlib.pyplot as plt
-from scipy import stats
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from figure_renderer import FigureRenderer
+from scale_log import read_scale_log, unwrap_clock
+from mass_filters import band_mask
+from derivative_features import derivative_features
+from step_detector import detect_step
+from lvm_reader import read_lvm
+from campaign_catalog import CampaignCatalog
+from stage_profiler import StageProfiler
+
+ROOTDIR = r"C:\Users\VIERX716\OneDrive - KDP\Documents\Coffee Bloom\DOE v4\Full"
+# Scale derivatives used to filter and detect the dispense, named as in derivative_features
+DERIVATIVE_FEATURES = ['Mass_Gradient', 'Mass_Diff', 'Mass_Delta2']
+
+# Per-stage timing of this process, each worker process has its own
+profiler = StageProfiler()
 
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # Function definition for common utilities
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-def is_float(element) -> bool:
+def find_test_pairs(rootdir, cache_dir=None):
+    # Each scale .log with the labview .lvm of the same test number, returned
+    # in test number order
+    catalog = CampaignCatalog(rootdir, cache_dir)
+    return [(number, group['log'], group['lvm']) for number, group in catalog.groups('log', 'lvm')]
+
+
+def split_jobs(jobs):
+    # (analysis, render) worker counts sharing jobs processes, half of them
+    # rendering. A single job analyzes and renders in this process.
+    if jobs <= 1:
+        return 1, 0
+    render_jobs = jobs // 2
+    return jobs - render_jobs, render_jobs
+
+
+@profiler.profile('parse')
+def read_scale(filename):
+    smooth_window = 8
+    file = os.path.basename(filename)
+    m_time, mass, bad_lines = read_scale_log(filename)
+    if bad_lines:
+        print('Skipped ' + str(len(bad_lines)) + ' unparsed lines, file ' + str(file))
+    if len(mass) == 0:
+        print('No Mass data, file' + str(file))
+
+    df_scale = pd.DataFrame({'Time': m_time, 'Mass': mass})
+    df_scale['Smooth_Mass'] = df_scale.Mass.rolling(smooth_window).mean()
+    if (df_scale.Time[1] - df_scale.Time[0]) > 10:
+        t0 = 0
+    else:
+        t0 = df_scale.Time[0]
+    m_time, bad_steps = unwrap_clock(df_scale.Time.to_numpy())
+    if bad_steps:
+        print('Kept ' + str(len(bad_steps)) + ' backwards clock steps that are not rollovers, file ' + str(file))
+    df_scale.Time = m_time - (t0 + 1)
+    df_scale = df_scale.iloc[1:, :]
+
+    # Only the derivatives used downstream, on the actual sample times
+    features = derivative_features(df_scale.Time, {'Mass': df_scale.Mass}, DERIVATIVE_FEATURES)
+    for name, values in features.items():
+        df_scale[name] = values
+    df_scale_stable = df_scale[band_mask(df_scale['Mass_Delta2'], -0.2, 0.2)]
+
+    return df_scale, df_scale_stable
+
+
+@profiler.profile('parse')
+def read_labview(filename):
+    # Time comes from the Delta_X of the labview header
+    df, header = read_lvm(filename)
+    try:
+        df_nonNAN = df[df['Untitled'].notna()]
+        t_pump = df_nonNAN.Untitled[0]
+    except:
+        t_pump = 0
+
+    return df, t_pump
+
+
+def process_test(number, log_file, lvm_file, plots_dir):
+    # analyze_test() with its stage timings, which are returned with the
+    # results since it may have run in a worker process. A test that fails is
+    # skipped, so one bad file does not stop the rest of the campaign.
+    with profiler.test(number), profiler.stage('test'):
+        try:
+            row, plot_job = analyze_test(number, log_file, lvm_file, plots_dir)
+        except Exception as err:
+            print('Failed test ' + str(number) + ': ' + repr(err))
+            row, plot_job = None, None
+    return row, plot_job, profiler.take(number)
+
+
+def analyze_test(number, log_file, lvm_file, plots_dir):
+    # Analyze one .log/.lvm pair and return its row of the stats table and the
+    # plot job for its figure, or Nones if the scale log could not be read. Only
+    # reads its inputs so tests can run in any process and any order.
+    file = os.path.basename(log_file)
+    voltage = 0
+    voltage_time = 0
+    end_mass = 0
+    initial_mass = 0
+
+    try:
+        df_scale, df_scale_stable = read_scale(log_file)
+    except:
+        print('Failed log file for file: ' + str(file))
+        return None, None
+    df, t_pump = read_labview(lvm_file)
+    if df.empty:
+        return None, None
+
+    # Collect dataframe rows with only voltages over 0.1 V
+    non_zero_voltages = df[(df.Voltage > 0.1)]
+    if non_zero_voltages.empty:
+        print('No Voltage Pulse Detected, file:'+ str(file))
+        voltage = 0
+        voltage_time = 0
+        ES_temp = 0
+        EN_temp = 0
     try:
-        float(element)
-        return True
-    except ValueError:
-        return False
+        # The time the voltage was nonzero is the difference between the first and last datapoints of the above
+        voltage_time = non_zero_voltages.Time.iloc[-1] - non_zero_voltages.Time.iloc[0]
+        df.Time = df.Time - non_zero_voltages.Time.iloc[0]
+        df = df[df.Time >= -0.5]
+    except:
+        print("Unable to get Voltage Time")
+        print(file)
+    # The voltages should be fairly consistent, so take the average voltage
+    voltage = non_zero_voltages.Voltage.mean()
+
+    try:
+        EN_temp = non_zero_voltages.Temperature.mean() + 6.4
+        ES_temp = non_zero_voltages.Temperature_0.mean() + 6.6
+    except:
+        try:
+            EN_temp = non_zero_voltages.T1.mean() + 6.4
+            ES_temp = non_zero_voltages.T2.mean() + 6.6
+        except:
+            try:
+                EN_temp = non_zero_voltages.T1.mean() + 6.4
+                ES_temp = non_zero_voltages.T2.mean() + 6.6
+            except:
+                EN_temp = 0
+                ES_temp = 0
+
+    # The dispense is the biggest jump between samples where the gradient and
+    # difference quotient of the mass are low, i.e. between two plateaus
+    stable = (band_mask(df_scale['Mass_Gradient'], -0.01, 0.01)
+              & band_mask(df_scale['Mass_Diff'], -0.01, 0.01))
+    step = detect_step(df_scale.Mass, stable)
+    if step is None:
+        begin_idx = 1
+        initial_mass = 0
+        end_mass = 0
+        confidence = 0
+    else:
+        begin_idx = df_scale.index[step['initial_index']]
+        initial_mass = step['initial_mass']
+        end_mass = step['final_mass']
+        confidence = step['confidence']
+
+    try:
+        t0_mass = df_scale_stable.Time[begin_idx]
+        df_scale_stable.Time = df_scale_stable.Time - (t0_mass)
+        df_scale_stable = df_scale_stable[df_scale_stable.Time > 0]
+    except:
+        print('Non-zeros mass time')
+
+    figure_path = os.path.join(plots_dir, 'Test' + str(number) + '.png')
+    plot_job = ('voltage_mass', figure_path,
+                {'voltage_time': df.Time.to_numpy(),
+                 'voltage': df.Voltage.to_numpy(),
+                 'mass_time': df_scale_stable.Time.to_numpy(),
+                 'mass': df_scale_stable.Mass.to_numpy(),
+                 'title': "Temp vs Brew Mass - Test " + str(number)})
+
+    # Collect pertinent data
+    row = {'Test Number': int(number),
+           'Pump Voltage (V)': voltage,
+           'Initial Cup Mass (g)': initial_mass,
+           'Final Cup Mass (g)': end_mass,
+           'Step Confidence': confidence,
+           'Voltage Time (s)': voltage_time,
+           'Pump Specified Flow Time (s)': t_pump,
+           'EN Temp (F)': EN_temp,
+           'ES Temp (F)': ES_temp
+           }
+    return row, plot_job
 
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # Main program function
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-def main():
+def main(rootdir=ROOTDIR, jobs=1):
     # Begin timing how long the script takes
     t0 = time.time()
-    rootdir = r"C:\Users\VIERX716\OneDrive - KDP\Documents\Coffee Bloom\DOE v4\Full"
+    profiler.reset()
     # Results Directory
     results_dir = os.path.join(rootdir, 'Results')
     # Plots Directory
     plots_dir = os.path.join(results_dir, 'Plots')
-    tests_dir = os.path.join(results_dir, 'Test')
 
     # Create a Results folder to save images and the files
     if not os.path.exists(results_dir):
@@ -55,251 +232,44 @@ def main():
     if not os.path.exists(plots_dir):
         os.makedirs(plots_dir)
 
-    tests = []
-    voltages = []
-    voltage_times = []
-    pump_flow_rates = []
-    final_masses = []
-    initial_masses = []
-    pump_flow_times = []
-    pump_flow_over_v = []
-    pump_t = []
-    EN_temps = []
-    ES_temps = []
-
-    df = pd.DataFrame()
-    dfs = {}
-    dfs['t0'] = df
-    # step through data directory looking for UBTS files
-    for subdir, dirs, files in os.walk(rootdir):
-        if ((subdir == rootdir)):
-
-            for i in range(len(files)):
-                mass = []
-                m_time = []
-                voltage = 0
-                pump_flow_rate = 0
-                voltage_time = 0
-                end_mass = 0
-                initial_mass = 0
-
-                file = files[i]
-                filename = rootdir + '\\' + file
-                if (file[-4:] == '.log'):
-                    if file[-7:-4].isnumeric():
-                        number = file[-7:-4]
-                    elif file[-8:-5].isnumeric():
-                        number = file[-8:-5]
-                    else:
-                        number = file[-9:-6]
-                    with open(filename) as fobj:
-                        prev_time = 0
-                        smooth_window = 8
-                        mass_data = True
-                        for line in fobj:
-                            line_data = re.split('\t|\n|,| |]', line)
-                            for j in range(len(line_data)):
-                                if is_float(line_data[j]):
-                                    try:
-                                        prev_time = float(line_data[1][-6:])
-                                    except:
-                                        mass_data = False
-                                    m_time.append(prev_time)
-                                    mass.append(float(line_data[j]))
-                    if not mass_data:
-                        print('No Mass data, file' + str(file))
-
-                    try:
-                        df_scale = pd.DataFrame({'Time': m_time, 'Mass': mass})
-                        df_scale['Smooth_Mass'] = df_scale.Mass.rolling(smooth_window).mean()
-                        if (df_scale.Time[1] - df_scale.Time[0]) > 10:
-                            t0 = 0
-                        else:
-                            t0 = df_scale.Time[0]
-                        df_scale.Time = df_scale.Time - (t0 + 1)
-                        for ii in range(len(df_scale.Time) - 1):
-                            if (df_scale.Time[ii + 1] < df_scale.Time[ii] - 50):
-                                df_scale.Time[ii + 1] = df_scale.Time[ii + 1] + 60
-                        df_scale = df_scale.iloc[1:, :]
-
-                        x = df_scale.Time.to_numpy()
-                        y = df_scale.Mass.to_numpy()
-                        y2 = df_scale.Smooth_Mass.to_numpy()
-                        dx = x[1] - x[0]
-                        dydx = np.gradient(y, dx)
-                        df_scale['Mass_Gradient'] = dydx
-                        if not x.all():
-                            np.nan_to_num(x)
-                        if not y.all():
-                            np.nan_to_num(y)
-                        if not y2.all():
-                            np.nan_to_num(y2)
-                        diff = np.diff(y) / np.diff(x)
-                        diff = np.append(diff, 0)
-                        df_scale['Mass_Diff'] = diff
-                        diff2 = np.diff(y2) / np.diff(x)
-                        diff2 = np.append(diff2, 0)
-                        df_scale['Smooth_Mass_Diff'] = diff2
-                        difference = df_scale.diff(axis=0)
-                        # Add column of df_scale where the difference between consecutive mass data is stored
-                        df_scale['Mass_Gradient_Delta'] = difference.Mass_Gradient
-                        df_scale['Mass_Diff_Delta'] = difference.Mass_Diff
-                        df_scale['Smooth_Mass_Diff_Delta'] = difference.Smooth_Mass_Diff
-                        df_scale['Mass_Delta'] = difference.Mass
-                        difference2 = df_scale.diff(axis=0)
-                        # Add column of df_scale where the difference between consecutive mass data is stored
-                        df_scale['Mass_Gradient_Delta2'] = difference2.Mass_Gradient_Delta
-                        df_scale['Mass_Diff_Delta2'] = difference2.Mass_Diff_Delta
-                        df_scale['Smooth_Mass_Diff_Delta2'] = difference2.Smooth_Mass_Diff_Delta
-                        df_scale['Mass_Delta2'] = difference2.Mass_Delta
-                        df_scale_stable = df_scale[df_scale['Mass_Delta2'].between(-0.2, 0.2)]
-                        # remove significant outliers based on change in mass
-                        # https://stackoverflow.com/questions/61815114/deleting-entire-rows-of-a-dataset-for-outliers-found-in-a-single-column
-                        dfn_scale_stable = df_scale_stable[(np.abs(stats.zscore(df_scale_stable['Mass_Delta'])) < 3)]
-                    except:
-                        print('Failed log file for file: ' + str(file))
-                        number = '0'
-                # Otherwise the file is part of the labview output
-                elif (file[-4:] == '.lvm'):
-                    df = pd.read_csv(filename, sep='\t', skiprows=23, header=0)
-                    size_df = len(df.X_Value)
-                    n_time = 1 + (df.X_Value.max() * 1000)
-                    times_NI = np.linspace(0, (1 / n_time) * size_df, size_df)
-                    df['Time'] = times_NI
-                    try:
-                        df_nonNAN = df[df['Untitled'].notna()]
-                        t_pump = df_nonNAN.Untitled[0]
-                    except:
-                        t_pump = 0
-                    if file[-9:-6].isnumeric():
-                        number_NI = file[-9:-6]
-                    elif file[-8:-5].isnumeric():
-                        number_NI = file[-8:-5]
-                    else:
-                        number_NI = file[-7:-4]
-
-                if not df.empty and (int(number) == int(number_NI)):
-                    # Collect dataframe rows with only voltages over 0.1 V
-                    non_zero_voltages = df[(df.Voltage > 0.1)]
-                    if non_zero_voltages.empty:
-                        print('No Voltage Pulse Detected, file:'+ str(file))
-                        voltage = 0
-                        voltage_time = 0
-                        ES_temp = 0
-                        EN_temp = 0
-                    try:
-                        # The time the voltage was nonzero is the difference between the first and last datapoints of the above
-                        voltage_time = non_zero_voltages.Time.iloc[-1] - non_zero_voltages.Time.iloc[0]
-                        df.Time = df.Time - non_zero_voltages.Time.iloc[0]
-                        df = df[df.Time >= -0.5]
-                    except:
-                        print("Unable to get Voltage Time")
-                        print(file)
-                    # The voltages should be fairly consistent, so take the average voltage
-                    voltage = non_zero_voltages.Voltage.mean()
-
-                    try:
-                        EN_temp = non_zero_voltages.Temperature.mean() + 6.4
-                        ES_temp = non_zero_voltages.Temperature_0.mean() + 6.6
-                    except:
-                        try:
-                            EN_temp = non_zero_voltages.T1.mean() + 6.4
-                            ES_temp = non_zero_voltages.T2.mean() + 6.6
-                        except:
-                            try:
-                                EN_temp = non_zero_voltages.T1.mean() + 6.4
-                                ES_temp = non_zero_voltages.T2.mean() + 6.6
-                            except:
-                                EN_temp = 0
-                                ES_temp = 0
-
-                    # Collect rows of dataframe where the mass and the change in mass were positive
-                    non_zero_mass = df_scale.loc[(df_scale['Mass'] >= 0) & (df_scale['Mass_Delta'] > 0)]
-                    # mass_time = non_zero_mass.Time.iloc[-1] - non_zero_mass.Time.iloc[0]
-                    # Final_Mass = non_zero_mass.Smooth_Mass.iloc[-1]
-
-                    # Filter out results where the gradient and difference between mass data are two high
-                    df_scale_f1 = df_scale[df_scale['Mass_Gradient'].between(-0.01, 0.01)]
-                    df_scale_f2 = df_scale_f1[df_scale_f1['Mass_Diff'].between(-0.01, 0.01)]
-                    df_scale_resetidx = df_scale_f2.reset_index()
-                    # Take the difference between each row in filtered df
-                    df_f2 = df_scale_f2.diff(axis=0)
-                    # Sort in descedning order to find largest jump in mass
-                    df_f2_sorted = df_f2.sort_values(by=['Mass'], ascending=False)
-
-                    try:
-                        end_idx = df_f2_sorted.index[0]
-                        idx_list = df_scale_resetidx.index[df_scale_f2.index == end_idx].tolist()
-                        end_mass = df_scale.Mass[end_idx]
-                    except:
-                        end_idx = 2
-                        end_mass = 0
-                    try:
-                        begin_idx = df_scale_resetidx['index'][idx_list[0] - 1]
-                        initial_mass = df_scale['Mass'][begin_idx]
-                    except:
-                        begin_idx = 1
-                        initial_mass = 0
-
-                    # Collect pertinent data
-                    if (int(number) not in tests):
-                        tests.append(int(number))
-                        voltages.append(voltage)
-                        voltage_times.append(voltage_time)
-                        pump_flow_rates.append(pump_flow_rate * 60)
-                        final_masses.append(end_mass)
-                        initial_masses.append(initial_mass)
-                        EN_temps.append(EN_temp)
-                        ES_temps.append(ES_temp)
-                        pump_t.append(t_pump)
-
-                    try:
-                        t0_mass = df_scale_stable.Time[begin_idx]
-                        df_scale_stable.Time = df_scale_stable.Time - (t0_mass)
-                        df_scale_stable = df_scale_stable[df_scale_stable.Time > 0]
-                    except:
-                        print('Non-zeros mass time')
-
-                    fig, ax = plt.subplots()
-                    color = 'tab:red'
-                    ax.set_xlabel('Time (s)')
-                    ax.tick_params(axis='y', labelcolor=color)
-                    ax.set_ylabel('Voltage', color=color)
-                    lns1 = ax.plot(df.Time, df.Voltage, label='Voltage', color=color)
-
-                    ax2 = ax.twinx()
-                    lns2 = ax2.plot(df_scale_stable.Time, df_scale_stable.Mass, label='Mass', color='blue')
-                    # lns3 = ax2.plot(df_scale_stable.Time, df_scale_stable.Mass,  label='Mass', color='green')
-                    # added these three lines
-                    # labs = [l.get_label() for l in lns]
-                    ax.legend(loc=1)
-                    ax2.legend(loc=4)
-                    color = 'tab:blue'
-
-                    ax2.set_ylabel('Mass (g)', color=color)  # we already handled the x-label with ax
-                    ax2.tick_params(axis='y', labelcolor=color)
-                    ax.grid()
-                    plt.title("Temp vs Brew Mass - Test " + str(number))
-                    fig.tight_layout()  # otherwise the right y-label is slightly clipped
-                    figure_path = plots_dir + '\Test' + str(number) + '.png'
-                    fig.savefig(figure_path)  # save the figure to file
-                    plt.close(fig)
-
-    d = {'Test Number': tests,
-         'Pump Voltage (V)': voltages,
-         'Initial Cup Mass (g)': initial_masses,
-         'Final Cup Mass (g)': final_masses,
-         'Voltage Time (s)': voltage_times,
-         'Pump Specified Flow Time (s)': pump_t,
-         'EN Temp (F)': EN_temps,
-         'ES Temp (F)': ES_temps
-         }
-
-    df_stats = pd.DataFrame(data=d)
-    Pump_stats = results_dir + "\\" + 'DOEv4 Stats.csv'
-    df_stats.to_csv(Pump_stats, encoding='utf-8', index=False)
+    # Tests are independent, so each pair is analyzed on its own worker and the
+    # rows come back in test number order. Figures are handed to the renderer
+    # as each test finishes. The jobs are shared between the two pools.
+    analysis_jobs, render_jobs = split_jobs(jobs)
+    renderer = FigureRenderer(render_jobs)
+    with profiler.stage('catalog'):
+        pairs = find_test_pairs(rootdir, results_dir)
+    numbers, log_files, lvm_files = zip(*pairs) if pairs else ((), (), ())
+    rows = []
+    pool = ProcessPoolExecutor(max_workers=analysis_jobs) if analysis_jobs > 1 else nullcontext()
+    with pool as executor:
+        results = (executor.map if executor else map)(process_test, numbers, log_files, lvm_files,
+                                                      [plots_dir] * len(pairs))
+        for row, plot_job, stages in results:
+            profiler.merge(stages)
+            if row is not None:
+                rows.append(row)
+                kind, figure_path, data = plot_job
+                renderer.submit(kind, figure_path, **data)
+
+    columns = ['Test Number', 'Pump Voltage (V)', 'Initial Cup Mass (g)', 'Final Cup Mass (g)',
+               'Step Confidence', 'Voltage Time (s)', 'Pump Specified Flow Time (s)', 'EN Temp (F)', 'ES Temp (F)']
+    df_stats = pd.DataFrame(rows, columns=columns)
+    Pump_stats = os.path.join(results_dir, 'DOEv4 Stats.csv')
+    with profiler.stage('write'):
+        df_stats.to_csv(Pump_stats, encoding='utf-8', index=False)
     print(df_stats)
+    with profiler.stage('plot'):
+        renderer.join()
+
+    print('Script took %0.3f s' % (time.time() - t0))
+    profiler.summary()
+    profiler.write_json(os.path.join(results_dir, 'profile.json'))
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='Postprocess DOEv4 scale and labview data')
+    parser.add_argument('rootdir', nargs='?', default=ROOTDIR, help='directory holding the .log/.lvm pairs')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='number of worker processes, shared by the analysis and the figures')
+    args = parser.parse_args()
+    main(args.rootdir, args.jobs)
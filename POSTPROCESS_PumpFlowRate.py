@@ -5,29 +5,28 @@ Created on 11/23/2021
 @author: Riccardo Vietri
 
 """
-import numpy as np
-import re
 import time
 import pandas as pd
 import os
-import matplotlib.pyplot as plt
-from scipy import stats
-# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-# Function definition for common utilities
-# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-def is_float(element) -> bool:
-    try:
-        float(element)
-        return True
-    except ValueError:
-        return False
+from figure_renderer import FigureRenderer
+from scale_log import read_scale_log, unwrap_clock
+from mass_filters import zscore_mask
+from step_detector import stable_mask, detect_step
+from lvm_reader import read_lvm
+from campaign_catalog import CampaignCatalog
+from stage_profiler import StageProfiler
+
+ROOTDIR = r"C:\Users\VIERX716\OneDrive - KDP\Documents\Coffee Bloom\DOE v4\Test"
+
+profiler = StageProfiler()
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # Main program function
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-def main():
+def main(rootdir=ROOTDIR):
     # Begin timing how long the script takes
     t0 = time.time()
-    rootdir = r"C:\Users\VIERX716\OneDrive - KDP\Documents\Coffee Bloom\DOE v4\Test"
+    profiler.reset()
     # Results Directory
     results_dir = os.path.join(rootdir, 'Results')
     # Plots Directory
@@ -43,80 +42,73 @@ def main():
     # Also create plots directory
     if not os.path.exists(plots_dir):
         os.makedirs(plots_dir)
+    # Figures are written by worker processes while the analysis continues
+    renderer = FigureRenderer()
 
 
-    # step through data directory looking for UBTS files
-    for subdir, dirs, files in os.walk(rootdir):
-        if not ((subdir == results_dir) or (subdir == plots_dir)):
-            for i in range(len(files)):
-                file = files[i]
-                filename = rootdir + '\\' + file
-                if (file[-4:] == '.log'):
-                    # if file was log file from teraterm log, create mass arrays froms cale
-                    mass = []
-                    m_time = []
-                    with open(filename) as fobj:
-                        # initialize the time of mass reading as zero
-                        prev_time = 0
-                        for line in fobj:
-                            line_data = re.split('\t|\n|,| |]', line)
-                            for j in range(len(line_data)):
-                                # The only float numbers in the log data are the masses
-                                # when mass is found in one line, collect the time and mass
-                                if (is_float(line_data[j])):
-                                    prev_time = prev_time + (float(line_data[1][-6:]) - prev_time)
-                                    m_time.append(prev_time)
-                                    mass.append(float(line_data[j]))
-                    # After reading through the log file, create a dataframe
-                    df_scale = pd.DataFrame({'Time': m_time, 'Mass': mass})
-                    z_scores = stats.zscore(df_scale)
-
-                    abs_z_scores = np.abs(z_scores)
-                    filtered_entries = (abs_z_scores < 3).all(axis=1)
-                    new_df_scale = df_scale[filtered_entries]
-                    df_scale['Smooth_Mass'] = df_scale.Mass.rolling(8).mean()
+    # analyze every scale log / labview pair of the campaign in test order
+    with profiler.stage('catalog'):
+        catalog = CampaignCatalog(rootdir, results_dir)
+    for number, group in catalog.groups('log', 'lvm'):
+        filename = group['log']
+        file = os.path.basename(filename)
+        # create mass arrays from the teraterm log of the scale
+        with profiler.stage('parse', number):
+            m_time, mass, bad_lines = read_scale_log(filename)
+            # clock seconds restart at midnight, keep the times increasing
+            m_time, bad_steps = unwrap_clock(m_time)
+        if bad_lines:
+            print('Skipped ' + str(len(bad_lines)) + ' unparsed lines, file ' + file)
+        if bad_steps:
+            print('Kept ' + str(len(bad_steps)) + ' backwards clock steps that are not rollovers, file ' + file)
+        # After reading through the log file, create a dataframe
+        df_scale = pd.DataFrame({'Time': m_time, 'Mass': mass})
+        with profiler.stage('filter', number):
+            # drop readings more than 3 standard deviations out in time or mass
+            new_df_scale = df_scale[zscore_mask(df_scale[['Time', 'Mass']], 3)]
+            df_scale['Smooth_Mass'] = df_scale.Mass.rolling(8).mean()
 
-                elif ("Test" in file) and (file[-4:] == '.lvm'):
-                    df = pd.read_csv(filename, sep='\t', skiprows=23, header=0)
-                    size_df = len(df.X_Value)
-                    times_NI = np.linspace(0, (1/3)*size_df, size_df)
-                    df['Time'] = times_NI
+        with profiler.stage('parse', number):
+            df, header = read_lvm(group['lvm'])
 
+        with profiler.stage('detect', number):
             non_zero_voltages = df[(df.Voltage > 0.1)]
             voltage_time = non_zero_voltages.Time.iloc[-1]-non_zero_voltages.Time.iloc[0]
             voltage = non_zero_voltages.Voltage.mean()
             non_zero_mass = df_scale[(df_scale.Smooth_Mass > 0.1)]
             mass_time = non_zero_mass.Time.iloc[-1] - non_zero_mass.Time.iloc[0]
             mass_change = non_zero_mass.Mass.iloc[-1] - non_zero_mass.Mass.iloc[0]
-            print("Change in Mass")
-            print(mass_change)
-            print("Time change in Mass")
-            print(mass_time)
-            print("Voltage")
-            print(voltage)
-            print("Time change in voltage")
-            print(voltage_time)
+            # the pumped mass between the settled plateaus before and after
+            step = detect_step(df_scale.Mass, stable_mask(df_scale.Time, df_scale.Mass))
+        print("Change in Mass")
+        print(mass_change)
+        if step is not None:
+            print("Plateau step (confidence)")
+            print('%0.2f g (%0.2f)' % (step['final_mass'] - step['initial_mass'], step['confidence']))
+        print("Time change in Mass")
+        print(mass_time)
+        print("Voltage")
+        print(voltage)
+        print("Time change in voltage")
+        print(voltage_time)
+
+        figure_path = os.path.join(plots_dir, 'Test' + str(number) + '.png')
+        with profiler.stage('plot', number):
+            renderer.submit('pump_flow', figure_path,
+                            voltage_time=df.Time,
+                            voltage=df.Voltage,
+                            mass_time=new_df_scale.Time,
+                            mass=new_df_scale.Mass,
+                            smooth_time=df_scale.Time,
+                            smooth_mass=df_scale.Smooth_Mass,
+                            title="Temp vs Brew Mass " + filename[-12:-4])
 
-            fig, ax = plt.subplots()
-            color = 'tab:red'
-            ax.set_xlabel('Time (s)')
-            ax.set_ylabel('Voltage', color=color)
-            ax.plot(df.Time, df.Voltage, label='Voltage', color=color)
-            ax.tick_params(axis='y', labelcolor=color)
+    with profiler.stage('plot'):
+        renderer.join()
 
-            ax2 = ax.twinx()
-            color = 'tab:blue'
-            ax2.set_ylabel('Mass', color=color)  # we already handled the x-label with ax
-            ax2.tick_params(axis='y', labelcolor=color)
-            ax2.plot(new_df_scale.Time, new_df_scale.Mass,  label='Mass', color=color)
-            ax2.plot(df_scale.Time, df_scale.Smooth_Mass,  label='Mass_smooth', color='green')
-            ax2.legend(loc=0)
-            ax2.grid()
-            plt.title("Temp vs Brew Mass " + filename[-12:-4])
-            fig.tight_layout()  # otherwise the right y-label is slightly clipped
-            figure_path = plots_dir + '\Test1.png'
-            fig.savefig(figure_path)  # save the figure to file
-            plt.close(fig)
+    print('Script took %0.3f s' % (time.time() - t0))
+    profiler.summary()
+    profiler.write_json(os.path.join(results_dir, 'profile.json'))
 
 if __name__ == "__main__":
     main()
@@ -11,6 +11,9 @@ import time
 import pandas as pd
 import os
 import matplotlib.pyplot as plt
+from campaign_catalog import CampaignCatalog
+
+ROOTDIR = r"C:\Users\VIERX716\OneDrive - KDP\Documents\Coffee Bloom\UBTS005\DRIP_DOE"
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # Function definition for common utilities
@@ -19,10 +22,9 @@ import matplotlib.pyplot as plt
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # Main program function
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-def main():
+def main(rootdir=ROOTDIR):
     # Begin timing how long the script takes
     t0 = time.time()
-    rootdir = r"C:\Users\VIERX716\OneDrive - KDP\Documents\Coffee Bloom\UBTS005\DRIP_DOE"
     # Results Directory
     results_dir = os.path.join(rootdir, 'Results')
     # Plots Directory
@@ -43,31 +45,18 @@ def main():
     if not os.path.exists(drip_dir):
         os.makedirs(drip_dir)
 
-    # step through data directory looking for UBTS files
-    for subdir, dirs, files in os.walk(rootdir):
-
-        if not ((subdir == results_dir) or (subdir == plots_dir) or (subdir == drip_dir)):
-            for i in range(len(files)):
-                file = files[i]
-                UBTS_filename = rootdir + '\\' + file
-                if (file[-11:-6] == 'Cycle') or (file[-12:-7] == 'Cycle') or (file[-13:-8] == 'Cycle'):
-                    if file[-7:-4].isnumeric():
-                        number = file[-7:-4]
-                    elif file[-6:-4].isnumeric():
-                        number = file[-6:-4]
-                    else:
-                        number = file[-5:-4]
-                # collect bloom variables used in this test using log file
-                elif (file[-7:-4] == 'log'):
-                    parameters = ['Temp:', 'Time:', 'Volume:', 'Size_Selected']
-                    # read the log with multiple delimiters
-                    with open(UBTS_filename) as fobj:
-                        print("\n")
-                        print(number)
-                        for line in fobj:
-                            line_data = re.split('\t|\n|,|[|]', line)
-                            if 'V' not in line_data[1]:
-                                print(line_data)
+    # print the bloom variables logged for every cycle, in cycle order
+    catalog = CampaignCatalog(rootdir, results_dir)
+    for number, group in catalog.groups('bloom_log'):
+        parameters = ['Temp:', 'Time:', 'Volume:', 'Size_Selected']
+        # read the log with multiple delimiters
+        with open(group['bloom_log']) as fobj:
+            print("\n")
+            print(number)
+            for line in fobj:
+                line_data = re.split('\t|\n|,|[|]', line)
+                if 'V' not in line_data[1]:
+                    print(line_data)
 
 if __name__ == "__main__":
     main()
@@ -10,78 +10,47 @@ import re
 import time
 import pandas as pd
 import os
-import matplotlib.pyplot as plt
+from figure_renderer import FigureRenderer
+from ubts_cache import load_cached
+from ubts_export import read_ubts_export, PARSER_VERSION
+from trace_store import TraceStore
+from event_detect import detect_drip
+from time_index import nearest_index
+from campaign_catalog import CampaignCatalog
+from stage_profiler import StageProfiler
+
+ROOTDIR = r"C:\Users\VIERX716\OneDrive - KDP\Documents\Coffee Bloom\UBTS005\DRIP_DOE"
+
+profiler = StageProfiler()
+# Channels of each export read again once every test has been parsed
+DRIP_CHANNELS = ['Sample Time (s)', 'Brew Mass (g)', 'T entrance needle (degF)']
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # Function definition for common utilities
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-def import_UBTS(file):
-    try:
-        # Import the text file (tab delimited)
-        data = pd.read_csv(file, sep='\t', skiprows=66)
-    except:
-        print('Empty Dataframe: ' + file)
-        data = pd.DataFrame()
-    f = open(file, "r")
-    lines = f.readlines()
-    notes = (lines[61])
-    # Rename columns based on known headers
-    data.columns = [
-        'Sample Time (s)',
-        'T entrance needle (degF)',
-        'T exit stream (degF)',
-        'T AUX (degF)',
-        'T in-cup (degF)',
-        'AUX sensor (psig)',
-        'Brew Mass (g)',
-        'Brewer Current (Arms)',
-        'ARxBrewerV (ml)',
-        'ARxBrewerT (degF)',
-        'ARxBrewerP (pressure)',
-        'ARxBrewerF (ml/sec)',
-        'EN Synced Temp (degF)',
-        'EN Synced Mass (degF)',
-        'ES Synced Temp (degF)',
-        'EN Synced Mass (degF)'
-    ]
-
-    # drop nan columns
-    data = data.dropna(axis=1)
-    if data['Sample Time (s)'].iloc[-1] == 'Sample Time (s)':
-        print('Dropping last row for file: ' + file)
-        data.drop(data.tail(1).index, inplace=True)  # drop last row
-
-    return data, notes
-
-
-def plottemps(plots_dir, filename, df):
-    fig2, ax2 = plt.subplots()
-    plt.plot(df['Brew Mass (g)'], df['T entrance needle (degF)'], label='Entrance Needle')
-    plt.plot(df['Brew Mass (g)'], df['T exit stream (degF)'], label='Exit Needle')
-    plt.plot(df['Brew Mass (g)'], df['T in-cup (degF)'], label='In-Cup')
-    ax2.legend(loc=0)
-    ax2.grid()
-    ax2.set_xlabel("Brew Mass (g)")
-    ax2.set_ylabel(r"Temp (F)")
-    plt.title("Temp vs Brew Mass " + filename[-13:-4])
-    plt.xlim([0, 180])
-    fig2.tight_layout()  # otherwise the right y-label is slightly clipped
-    figure_path = plots_dir + '\PlotTemps' + filename[-12:-4] + '.png'
-    fig2.savefig(figure_path)  # save the figure to file
-    plt.close(fig2)
+def plottemps(plots_dir, filename, df, renderer):
+    figure_path = os.path.join(plots_dir, 'PlotTemps' + os.path.basename(filename)[:-4] + '.png')
+    renderer.submit('temps_vs_mass', figure_path,
+                    mass=df['Brew Mass (g)'],
+                    entrance=df['T entrance needle (degF)'],
+                    exit=df['T exit stream (degF)'],
+                    in_cup=df['T in-cup (degF)'],
+                    title="Temp vs Brew Mass " + filename[-13:-4])
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # Main program function
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-def main():
+def main(rootdir=ROOTDIR):
     # Begin timing how long the script takes
     t0 = time.time()
-    rootdir = r"C:\Users\VIERX716\OneDrive - KDP\Documents\Coffee Bloom\UBTS005\DRIP_DOE"
+    profiler.reset()
     # Results Directory
     results_dir = os.path.join(rootdir, 'Results')
     # Plots Directory
     plots_dir = os.path.join(results_dir, 'Plots')
     drip_dir = os.path.join(plots_dir, 'Drip')
+    # Parsed exports are cached as columnar files here
+    cache_dir = os.path.join(results_dir, 'Cache')
 
     # Create a Results folder to save images and the files
     if not os.path.exists(results_dir):
@@ -97,203 +66,153 @@ def main():
     if not os.path.exists(drip_dir):
         os.makedirs(drip_dir)
 
-    path, dirs, files = next(os.walk(rootdir))
-    file_count = len(files)
-    bloom_temps = [0] * file_count
-    bloom_times = [0] * file_count
-    bloom_vols = [0] * file_count
-    tests = [0] * file_count
-    brew_code = [""] * file_count
-    drip_steam = [0] * file_count
-    drip_vols = [0] * file_count
-    pump_disp = [0] * file_count
-    max_temp = [0] * file_count
+    # Every cycle export with its bloom log, in cycle order
+    with profiler.stage('catalog'):
+        catalog = CampaignCatalog(rootdir, results_dir)
+    test_groups = catalog.groups('export')
+    test_count = len(test_groups)
+    bloom_temps = [0] * test_count
+    bloom_times = [0] * test_count
+    bloom_vols = [0] * test_count
+    tests = [0] * test_count
+    brew_code = [""] * test_count
+    drip_steam = [0] * test_count
+    drip_vols = [0] * test_count
+    pump_disp = [0] * test_count
+    max_temp = [0] * test_count
     # Amount of volume that exists before PM after rinse and purge
     rinse_avg_prefill = np.mean([8.9, 8.9, 8.8])
     print("Rinse Average Prefill: "+str(rinse_avg_prefill))
     # Amount of volume before PM after regular brew and purge
     regular_avg_prefill = np.mean([11.6, 10.3, 10.4, 10.2])
     print("Brew Average Prefill: "+str(regular_avg_prefill))
-    drip_temps = [0] * file_count
-    brew_num = [0] * file_count
-    brew_size = [0] * file_count
-    flow_rate = [0] * file_count
-    flow_rate_command = [0] * file_count
-    js = []
-    dfs = {}
-
-    # step through data directory looking for UBTS files
-    for subdir, dirs, files in os.walk(rootdir):
-
-        if not ((subdir == results_dir) or (subdir == plots_dir) or (subdir == drip_dir)):
-            for i in range(len(files)):
-                file = files[i]
-                UBTS_filename = rootdir + '\\' + file
-
-                if (file[-11:-6] == 'Cycle') or (file[-12:-7] == 'Cycle') or (file[-13:-8] == 'Cycle'):
-                    if file[-7:-4].isnumeric():
-                        number = file[-7:-4]
-                    elif file[-6:-4].isnumeric():
-                        number = file[-6:-4]
-                    else:
-                        number = file[-5:-4]
-                    # Ratchet way to compensate for the fact that sometimes we're missing cases and that's ok
-                    if tests[i - 2] != (int(number) - 1):
-                        skipped_test = True
-                        tests[i] = (int(number) - 1 * 0)
-                    else:
-                        tests[i] = (int(number))
-                    if tests[i] != 1:
-                        df, notes = import_UBTS(UBTS_filename)
-
-                        if "PULSE" in notes:
-                            brew_code[i] = ['Pulse']
-                        else:
-                            brew_code[i] = ['Europa']
-
-                        dfs['t' + str(tests[i])] = df.shift(i).add_suffix('_t' + str(tests[i]))
-
-                        plottemps(plots_dir, UBTS_filename, df)
-
-                        t = np.array(df['Sample Time (s)'])
-                        brew_mass = np.array(df['Brew Mass (g)'])
-                        brew_mass_theory = np.array(df['ARxBrewerV (ml)'])
-                        d1 = np.diff(brew_mass) / np.diff(t)
-                        d2 = np.diff(brew_mass_theory) / np.diff(t)
-                        # Take rolling average, with a window size of 3
-                        ret = np.cumsum(d1, dtype=float)
-                        ret2 = np.cumsum(d2, dtype=float)
-                        ret[3:] = ret[3:] - ret[:-3]
-                        ret2[3:] = ret2[3:] - ret2[:-3]
-                        start = [idx for idx, element in enumerate(ret) if (element >= 0.1) and (t[idx] >= 4)]
-                        start2 = [idx2 for idx2, element2 in enumerate(ret2) if (element2 >= 0.1) and (t[idx2] >= 4)]
-                        idx0 = start[0]
-                        idx2_0 = start2[0]
-                        end = [id for id, element in enumerate(ret) if (element <= 0) and (id > idx0)]
-                        idx_end = end[0]
-                        end2 = [id2 for id2, element2 in enumerate(ret2) if (element2 <= 0) and (id2 > idx2_0)]
-                        idx2_end = end2[0]
-                        drip_volume_t = brew_mass_theory[idx2_end] - brew_mass_theory[idx2_0]
-                        drip_time_t = t[idx2_end] - t[idx2_0]
-
-                        drip_volume = brew_mass[idx_end] - brew_mass[idx0]
-                        drip_time = t[idx_end] - t[idx0]
-
-                        flow_rate[i] = 60*drip_volume/drip_time
-                        flow_rate_command[i] = 60 * drip_volume_t / drip_time_t
-
-                        if tests[i]>268:
-                            fig, ax = plt.subplots()
-                            d1a = np.append(d1, 0)
-                            avg = np.append(ret, 0)
-                            ax.plot(t, d1a,
-                                     label='Derivative')
-                            ax.plot(t, avg, 'g',
-                                    label='Derivative Averaged')
-                            ax.plot(t[idx0], 0.25, 'b*',
-                                    label='Start')
-                            ax.plot(t[idx_end], 0.25, 'bd',
-                                    label='End')
-                            ax2 = ax.twinx()
-                            ax2.plot(t, brew_mass, 'r',
-                                     label='brew mass')
-                            ax.set_xlim([0, 25])
-                            ax.set_ylim([0, 0.5])
-                            ax2.set_ylim([0, 15])
-                            ax.set_ylabel('Derivative label')
-                            ax2.set_ylabel('Brew Mass label')
-                            ax.legend(loc=0)
-                            fig.show()
-                            ax.grid()
-                            plt.close(fig)
-                    else:
-                        bloom_times[i] = 20
-                        bloom_vols[i] = 15
-                        bloom_temps[i] = 80
-                # collect bloom variables used in this test using log file
-                elif file[-7:-4] == 'log' and (tests[i-1] != 1):
-                    js.append(i)
-                    parameters = ['Temp:', 'Time:', 'Volume:', 'Size_Selected']
-                    # read the log with multiple delimiters
-                    with open(UBTS_filename) as fobj:
-                        for line in fobj:
-                            line_data = re.split('\t|\n|,|[|]', line)
-                            # using list comprehension
-                            # checking if string contains list element
-                            if parameters[0] in line:
-                                line_list = re.split(':|,| |\t|\n', line)
-                                bloom_temps[i - 1] = (float(line_list[-2]))
-                            elif parameters[1] in line:
-                                line_list = re.split(':|,| |\t|\n', line)
-                                bloom_times[i - 1] = (float(line_list[-6]))
-                                bloom_vols[i - 1] = (float(line_list[-2]))
-                            elif parameters[3] in line:
-                                line_list = re.split(':|,| |\t|\n', line)
-                                brew_size[i - 1] = (float(line_list[-3]))
-                    # find the closest datapoint to the 5 seconds after the bloom time for this cycle
-                    if (tests[i-1] != 0) and (bloom_times[i-1] != 0):
-                        df = dfs['t' + str(tests[i-1])]
-                        drip_idx = abs(df['Sample Time (s)_t' + str(tests[i-1])] - (bloom_times[i-1] + 5)).idxmin()
-                        drip_begin_idx = abs(df['Sample Time (s)_t' + str(tests[i - 1])] - (bloom_times[i - 1] - 5)).idxmin()
-                        # Drip mass is found at the index ~= bloom time + 5 seconds
-                        drip_mass = df['Brew Mass (g)_t' + str(tests[i-1])][drip_idx]
-                        drip_temp = df['T entrance needle (degF)_t' + str(tests[i-1])][drip_idx]
-                        # find the average drip mass around this time
-                        avg_drip_mass = df['Brew Mass (g)_t' + str(tests[i-1])].rolling(2).mean()[drip_idx]
-                        avg_drip_temp = df['T entrance needle (degF)_t' + str(tests[i - 1])][drip_begin_idx:drip_idx].mean()
-                        '''
-                        fig, ax = plt.subplots()
-                        ax.plot(df['Sample Time (s)_t' + str(tests[i-1])], df['T entrance needle (degF)_t' + str(tests[i-1])], label='Entrance Needle')
-                        ax.plot(df['Sample Time (s)_t' + str(tests[i-1])][drip_idx], drip_temp, marker = 'o', ms = 10, label='Probe pt')
-                        ax.plot(df['Sample Time (s)_t' + str(tests[i - 1])][drip_begin_idx], avg_drip_temp, marker='o', ms=10,
-                                label='Probe pt2')
-                        ax2 = ax.twinx()
-                        ax2.plot(df['Sample Time (s)_t' + str(tests[i-1])], df['Brew Mass (g)_t' + str(tests[i-1])], color='r', label='Brew Mass')
-                        ax2.plot(df['Sample Time (s)_t' + str(tests[i - 1])][drip_idx],df['Brew Mass (g)_t' + str(tests[i-1])][drip_idx], color='g',marker='o', ms=10,
-                                label='point probe')
-                        ax.legend(loc=0)
-                        ax2.legend(loc=2)
-                        ax.set_xlabel("Sample Time (s)")
-                        ax.set_ylabel(r"Temp (F)")
-                        ax2.set_ylabel(r"Brew Mass (g)")
-                        plt.title("Temp vs Brew Mass Cycle " + str(tests[i-1]))
-                        plt.xlim([0, 30])
-                        ax2.set_ylim([0, 25])
-                        plt.show()
-                        plt.close(fig)
-                        '''
-                        # if average brew mass at this point is not consistent, enter zero for debugging
-                        if not (drip_mass < avg_drip_mass * 1.1) and (drip_mass > avg_drip_mass * 0.9):
-                            avg_drip_mass = 0
-                            print('Average Drip Mass Not within Limits, idx: ' + str(i) + " test#: " + str(tests[i-1]))
-                            print('Average Drip Mass: ' + str(avg_drip_mass))
-                            print('Local Drip Mass: ' + str(drip_mass))
-                        # collect drip volume
-                        drip_vols[i-1] = avg_drip_mass
-                        drip_temps[i-1] = avg_drip_temp
-                        max_temp[i-1] = df['T entrance needle (degF)_t' + str(tests[i - 1])][0:drip_idx].max()
-                        brew_num[i-1] = (tests[i-1]-1) % 3
-                        if (tests[i-1]-1) % 3 == 0:
-                            pump_disp[i - 1] = avg_drip_mass + rinse_avg_prefill
-                        else:
-                            pump_disp[i - 1] = avg_drip_mass + regular_avg_prefill
-                else:
-                    js.append(i)
-
-    for j in sorted(js, reverse=True):
-        del tests[j]
-        del brew_code[j]
-        del brew_size[j]
-        del drip_vols[j]
-        del drip_temps[j]
-        del max_temp[j]
-        del pump_disp[j]
-        del brew_num[j]
-        del flow_rate[j]
-        del flow_rate_command[j]
-        del bloom_temps[j]
-        del bloom_vols[j]
-        del bloom_times[j]
+    drip_temps = [0] * test_count
+    brew_num = [0] * test_count
+    brew_size = [0] * test_count
+    flow_rate = [0] * test_count
+    flow_rate_command = [0] * test_count
+    # The channels the drip probe reads, kept for every test until all the
+    # exports are parsed, keyed by test number
+    traces = TraceStore(DRIP_CHANNELS)
+    # Figures are written by worker processes while the analysis continues
+    renderer = FigureRenderer()
+
+    for i, (number, group) in enumerate(test_groups):
+        UBTS_filename = group['export']
+        file = os.path.basename(UBTS_filename)
+        tests[i] = number
+        if tests[i] != 1:
+            with profiler.stage('parse', number):
+                df, metadata = load_cached(UBTS_filename, cache_dir, read_ubts_export, PARSER_VERSION)
+            brew_code[i] = [metadata['brew_code']]
+
+            traces.add(tests[i], df)
+
+            with profiler.stage('plot', number):
+                plottemps(plots_dir, UBTS_filename, df, renderer)
+
+            t = np.array(df['Sample Time (s)'])
+            brew_mass = np.array(df['Brew Mass (g)'])
+            brew_mass_theory = np.array(df['ARxBrewerV (ml)'])
+            # Flow starts when the rate summed over 3 samples reaches 0.1 after 4 s
+            # and ends when it falls back to 0
+            with profiler.stage('detect', number):
+                idx0, idx_end, idx2_0, idx2_end = detect_drip(t, brew_mass, brew_mass_theory,
+                                                              on=0.1, off=0, t_min=4)
+            if None in (idx0, idx_end, idx2_0, idx2_end):
+                print('No pre-infusion flow detected, file: ' + file)
+            else:
+                drip_volume_t = brew_mass_theory[idx2_end] - brew_mass_theory[idx2_0]
+                drip_time_t = t[idx2_end] - t[idx2_0]
+
+                drip_volume = brew_mass[idx_end] - brew_mass[idx0]
+                drip_time = t[idx_end] - t[idx0]
+
+                flow_rate[i] = 60*drip_volume/drip_time
+                flow_rate_command[i] = 60 * drip_volume_t / drip_time_t
+
+        else:
+            bloom_times[i] = 20
+            bloom_vols[i] = 15
+            bloom_temps[i] = 80
+
+        # collect bloom variables used in this test using log file
+        if (tests[i] != 1) and ('bloom_log' in group):
+            UBTS_filename = group['bloom_log']
+            parameters = ['Temp:', 'Time:', 'Volume:', 'Size_Selected']
+            # read the log with multiple delimiters
+            with profiler.stage('parse', number), open(UBTS_filename) as fobj:
+                for line in fobj:
+                    line_data = re.split('\t|\n|,|[|]', line)
+                    # using list comprehension
+                    # checking if string contains list element
+                    if parameters[0] in line:
+                        line_list = re.split(':|,| |\t|\n', line)
+                        bloom_temps[i] = (float(line_list[-2]))
+                    elif parameters[1] in line:
+                        line_list = re.split(':|,| |\t|\n', line)
+                        bloom_times[i] = (float(line_list[-6]))
+                        bloom_vols[i] = (float(line_list[-2]))
+                    elif parameters[3] in line:
+                        line_list = re.split(':|,| |\t|\n', line)
+                        brew_size[i] = (float(line_list[-3]))
+
+    # Probe the drip of every test with a bloom log, from the traces kept while
+    # the exports were parsed
+    for i, (number, group) in enumerate(test_groups):
+        if (tests[i] == 1) or ('bloom_log' not in group):
+            continue
+        # find the closest datapoint to the 5 seconds after the bloom time for this cycle
+        has_samples = (tests[i] in traces) and (len(traces.get(tests[i], 'Sample Time (s)')) > 0)
+        if (tests[i] != 0) and (bloom_times[i] != 0) and not has_samples:
+            print('No samples to find the drip in, test: ' + str(tests[i]))
+        elif (tests[i] != 0) and (bloom_times[i] != 0):
+            sample_time = traces.get(tests[i], 'Sample Time (s)')
+            test_mass = traces.get(tests[i], 'Brew Mass (g)')
+            entrance_temp = pd.Series(traces.get(tests[i], 'T entrance needle (degF)'))
+            drip_begin_idx, drip_idx = nearest_index(sample_time, [bloom_times[i] - 5, bloom_times[i] + 5])
+            # Drip mass is found at the index ~= bloom time + 5 seconds
+            drip_mass = test_mass[drip_idx]
+            drip_temp = entrance_temp[drip_idx]
+            # find the average drip mass around this time
+            avg_drip_mass = test_mass[drip_idx - 1:drip_idx + 1].mean() if drip_idx > 0 else np.nan
+            avg_drip_temp = entrance_temp[drip_begin_idx:drip_idx].mean()
+            '''
+            fig, ax = plt.subplots()
+            ax.plot(sample_time, entrance_temp, label='Entrance Needle')
+            ax.plot(sample_time[drip_idx], drip_temp, marker = 'o', ms = 10, label='Probe pt')
+            ax.plot(sample_time[drip_begin_idx], avg_drip_temp, marker='o', ms=10,
+                    label='Probe pt2')
+            ax2 = ax.twinx()
+            ax2.plot(sample_time, test_mass, color='r', label='Brew Mass')
+            ax2.plot(sample_time[drip_idx], test_mass[drip_idx], color='g',marker='o', ms=10,
+                    label='point probe')
+            ax.legend(loc=0)
+            ax2.legend(loc=2)
+            ax.set_xlabel("Sample Time (s)")
+            ax.set_ylabel(r"Temp (F)")
+            ax2.set_ylabel(r"Brew Mass (g)")
+            plt.title("Temp vs Brew Mass Cycle " + str(tests[i]))
+            plt.xlim([0, 30])
+            ax2.set_ylim([0, 25])
+            plt.show()
+            plt.close(fig)
+            '''
+            # if average brew mass at this point is not consistent, enter zero for debugging
+            if not (drip_mass < avg_drip_mass * 1.1) and (drip_mass > avg_drip_mass * 0.9):
+                avg_drip_mass = 0
+                print('Average Drip Mass Not within Limits, idx: ' + str(i) + " test#: " + str(tests[i]))
+                print('Average Drip Mass: ' + str(avg_drip_mass))
+                print('Local Drip Mass: ' + str(drip_mass))
+            # collect drip volume
+            drip_vols[i] = avg_drip_mass
+            drip_temps[i] = avg_drip_temp
+            max_temp[i] = entrance_temp[0:drip_idx].max()
+            brew_num[i] = (tests[i]-1) % 3
+            if (tests[i]-1) % 3 == 0:
+                pump_disp[i] = avg_drip_mass + rinse_avg_prefill
+            else:
+                pump_disp[i] = avg_drip_mass + regular_avg_prefill
 
     d = {'Test Number': tests,
          'Brew Code': brew_code,
@@ -312,9 +231,16 @@ def main():
 
     df_stats = pd.DataFrame(data=d)
 
-    Brew_Stats = rootdir + "\\" + 'Results' + "\\" + 'Brew Stats.csv'
-    df_stats.to_csv(Brew_Stats, encoding='utf-8', index=False)
+    Brew_Stats = os.path.join(results_dir, 'Brew Stats.csv')
+    with profiler.stage('write'):
+        df_stats.to_csv(Brew_Stats, encoding='utf-8', index=False)
     print(df_stats.iloc[:,3:6])
+    with profiler.stage('plot'):
+        renderer.join()
+
+    print('Script took %0.3f s' % (time.time() - t0))
+    profiler.summary()
+    profiler.write_json(os.path.join(results_dir, 'profile.json'))
     # plot all UBTS Cases
 
 
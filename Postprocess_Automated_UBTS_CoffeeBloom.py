@@ -14,61 +14,49 @@ import time
 import pandas as pd
 import datetime
 import os
-import matplotlib.pyplot as plt
+from figure_renderer import FigureRenderer
+from results_manifest import Manifest
+from time_index import nearest_index
+from campaign_catalog import CampaignCatalog
+from mass_filters import smooth_deviation_mask
+from stage_profiler import StageProfiler
+
+profiler = StageProfiler()
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # Function definition for common utilities
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-def plot_mass(mass_data, plots_dir, cycle_num):
-
-    fig, ax = plt.subplots()
-    plt.plot(mass_data['time'], mass_data['mass'], label='Data')
-    ax.legend(loc=0)
-    ax.grid()
-    ax.set_xlabel("Time (s)")
-    ax.set_ylabel(r"Brew Mass (g)")
-    plt.title("Brew Mass vs Time for cycle " + str(cycle_num))
-    fig.tight_layout()  # otherwise the right y-label is slightly clipped
-    figure_path = plots_dir + '\BrewVsTime_cycle_' + str(cycle_num)+'.png'
-    fig.savefig(figure_path)  # save the figure to file
-    plt.close(fig)
-
-def plot_temp(temp_data, plots_dir, cycle_num):
-    fig, ax = plt.subplots()
-    ax.set_ylabel('Temperature (F)')
-    ax.set_xlabel('Time (s)')
-    plt.plot(temp_data['Time (s)'], temp_data['Entrance_Needle'], label='Entrance Needle')
-    plt.plot(temp_data['Time (s)'], temp_data['Exit_Needle'], label='Exit Needle')
-    plt.plot(temp_data['Time (s)'], temp_data['In_Cup'], label='In-Cup')
-    ax.legend(loc=0)
-    ax.grid()
-    plt.title("Temp vs Time for cycle " + str(cycle_num))
-    fig.tight_layout()  # otherwise the right y-label is slightly clipped
-    figure_path = plots_dir + '\TempVsTime_cycle_' + str(cycle_num) + '.png'
-    fig.savefig(figure_path)  # save the figure to file
-    plt.close(fig)
-
-def plot_temp_mass(temp_data, mass_data, plots_dir, cycle_num):
-    fig, ax1 = plt.subplots()
-    color = 'tab:red'
-    ax1.set_xlabel('Time (s)')
-    ax1.set_ylabel('Brew Mass (g)', color=color)
-    ax1.plot(mass_data['time'], mass_data['mass'], label='Mass', color = color)
-    ax1.tick_params(axis='y', labelcolor=color)
-
-    ax2 = ax1.twinx()
-    color = 'tab:blue'
-    ax2.set_ylabel('Temp', color=color)  # we already handled the x-label with ax1
-    ax2.plot(temp_data['Time (s)'],temp_data['Entrance_Needle'], label = 'Entrance Needle')
-    ax2.plot(temp_data['Time (s)'],temp_data['Exit_Needle'], label = 'Exit Needle')
-    ax2.plot(temp_data['Time (s)'],temp_data['In_Cup'], label = 'In-Cup')
-    ax2.tick_params(axis='y', labelcolor=color)
-
-    plt.title("Temp and Mass vs Time for cycle " + str(cycle_num))
-    fig.tight_layout()  # otherwise the right y-label is slightly clipped
-    figure_path = plots_dir + '\Temp+MassVsTime_cycle_' + str(cycle_num) + '.png'
-    fig.savefig(figure_path)  # save the figure to file
-    plt.close(fig)
+def cycle_figures(plots_dir, cycle_num):
+    # Figures written for a cycle that is not a rinse cycle, by plot_mass and plot_temp_mass
+    return [os.path.join(plots_dir, 'BrewVsTime_cycle_' + str(cycle_num) + '.png'),
+            os.path.join(plots_dir, 'Temp+MassVsTime_cycle_' + str(cycle_num) + '.png')]
+
+def plot_mass(mass_data, plots_dir, cycle_num, renderer):
+    figure_path = os.path.join(plots_dir, 'BrewVsTime_cycle_' + str(cycle_num) + '.png')
+    renderer.submit('mass_vs_time', figure_path,
+                    time=mass_data['time'],
+                    mass=mass_data['mass'],
+                    title="Brew Mass vs Time for cycle " + str(cycle_num))
+
+def plot_temp(temp_data, plots_dir, cycle_num, renderer):
+    figure_path = os.path.join(plots_dir, 'TempVsTime_cycle_' + str(cycle_num) + '.png')
+    renderer.submit('temp_vs_time', figure_path,
+                    time=temp_data['Time (s)'],
+                    entrance=temp_data['Entrance_Needle'],
+                    exit=temp_data['Exit_Needle'],
+                    in_cup=temp_data['In_Cup'],
+                    title="Temp vs Time for cycle " + str(cycle_num))
+
+def plot_temp_mass(temp_data, mass_data, plots_dir, cycle_num, renderer):
+    figure_path = os.path.join(plots_dir, 'Temp+MassVsTime_cycle_' + str(cycle_num) + '.png')
+    renderer.submit('temp_mass_vs_time', figure_path,
+                    mass_time=mass_data['time'],
+                    mass=mass_data['mass'],
+                    temp_time=temp_data['Time (s)'],
+                    entrance=temp_data['Entrance_Needle'],
+                    exit=temp_data['Exit_Needle'],
+                    in_cup=temp_data['In_Cup'],
+                    title="Temp and Mass vs Time for cycle " + str(cycle_num))
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # Main program function
@@ -77,13 +65,11 @@ def main(rootdir):
     # Initialize Variables
     # Number of cycles after which rinse and reset was performed
     n_cycles_rinse = 5
-    # Initialize cycle number as zero, overwritten with each masss file
-    cycle_num = 0
-    # Initialize counter for drip_volumes as zero
-    j = 0
-    t_end = 0
     # Begin timing how long the script takes
     t0 = time.time()
+    profiler.reset()
+    # Figures are written by worker processes while the analysis continues
+    renderer = FigureRenderer()
     # Results Directory
     results_dir = os.path.join(rootdir, 'Results')
     # Plots Directory
@@ -97,126 +83,152 @@ def main(rootdir):
     if not os.path.exists(plots_dir):
         os.makedirs(plots_dir)
 
-    # step through data directory looking for  files
-    for subdir, dirs, files in os.walk(rootdir):
-        # so long as the results or plots subdirectory is not being investigated, search files
-        if not ((subdir == results_dir) or (subdir == plots_dir)):
-            # Iterate through files
-            for file in files:
-                # Collect this file's name and path
-                UBTS_filename = rootdir + '\\' + file
-
-                # Collect test plan data
-                if "plan" in file[-10:-4]:
-                    test_plan = pd.read_csv(UBTS_filename)
-                    test_plan.columns = [
-                        'Test Number',
-                        'Flow Rate',
-                        'Brew Temp',
-                        'Brew Size',
-                        'Bloom Time',
-                        'Bloom Volume',
-                        'Bloom Temp'
-                    ]
-                    # initialize number of tests, drip volume, and drip temperatures for each test
-                    num_tests = len(test_plan)
-                    drip_vols = [0] * num_tests
-                    drip_temps = np.zeros((num_tests, 3))
-
-                # Collect command data
-                elif "cycle" in file[-15:-6]:
-                    cycle_data = pd.read_csv(UBTS_filename)
-                # Collect mass data
-                elif "mass" in file[-15:-4]:
-                    # Read in mass data from csv
-                    mass_data = pd.read_csv(UBTS_filename)
-                    # Collect cycle number, whether 1, 2, 3, or 4 digits
-                    if UBTS_filename[-13:-9].isnumeric():
-                        cycle_num = int(UBTS_filename[-13:-9])
-                    elif UBTS_filename[-12:-9].isnumeric():
-                        cycle_num = int(UBTS_filename[-12:-9])
-                    elif UBTS_filename[-11:-9].isnumeric():
-                        cycle_num = int(UBTS_filename[-11:-9])
-                    elif UBTS_filename[-10:-9].isnumeric():
-                        cycle_num = int(UBTS_filename[-10:-9])
-                    # Normalize mass and time to start at 0 at first data point
-                    mass_data['mass'] = mass_data['mass'] - mass_data['mass'][0]
-                    t_begin_mass = mass_data['time'][0]
-                    t_end_mass = mass_data['time'].iloc[-1]
-                    mass_data['time'] = mass_data['time'] - t_begin_mass
-                    # so long as the flow was not reset (every n runs), plot mass data
-                    if not (cycle_num % n_cycles_rinse == 0):
-                        # Collect the bloom time for this run using the test plan
-                        bloom_time = test_plan['Bloom Time'][cycle_num]
-                        # averaging window and threshold to identify outliers
-                        window = 10
-                        threshold = 5
-                        mass_data['smoothened'] = mass_data['mass'].rolling(window, center=True).mean()
-                        # collect the difference between the smoothened and actual data to identify outliers
-                        difference = np.abs(mass_data['mass'] - mass_data['smoothened'])
-                        # indices which are outliers and reverse of this, indices within threshold
-                        outlier_idx = difference > threshold
-                        within_threshold = [not elem for elem in outlier_idx]
-
-                        # remove outliers from mass data
-                        mass_data = mass_data[within_threshold]
-                        # find the closest datapoint to the 5 seconds after the bloom time for this cycle
-                        df_closest = mass_data.iloc[(mass_data['time'] - (bloom_time + 5)).abs().argsort()[:2]]
-                        drip_idx = df_closest.index.tolist()[0]
-                        # Drip mass is found at the index ~= bloom time + 5 seconds
-                        drip_mass = mass_data['mass'][drip_idx]
-                        # find the average drip mass around this time
-                        avg_drip_mass = mass_data['mass'].rolling(2).mean()[drip_idx]
-
-                        # if average brew mass at this point is not consistent, enter zero for debugging
-                        if not (drip_mass < avg_drip_mass * 1.1) and (drip_mass > avg_drip_mass * 0.9):
-                            avg_drip_mass = 0
-                        # collect drip volume
-                        drip_vols[j] = avg_drip_mass
-                        # plot series of mass vs time figures for each cycle
-                        plot_mass(mass_data, plots_dir, cycle_num)
-
-                # Collect temp data
-                elif "daq" in file[-10:-4]:
-                    print("Processing cycle " + str(cycle_num))
-                    temp_data = pd.read_csv(UBTS_filename)
-                    t_end = float(file[0:10])
-                    t_end_diff = t_end - t_end_mass
-                    mass_data['time'] = mass_data['time'] + t_end_diff
-                    # so long as the flow was not reset (every n runs), plot mass data
-                    if not (cycle_num % n_cycles_rinse == 0):
-
-                        #plot_temp(temp_data, plots_dir, cycle_num)
-                        plot_temp_mass(temp_data, mass_data, plots_dir, cycle_num)
-                        # find the closest datapoint to the 5 seconds after the bloom time for this cycle
-                        temp_closest = temp_data.iloc[(temp_data['Time (s)'] - (bloom_time + 5)).abs().argsort()[:2]]
-                        drip_temp_idx = temp_closest.index.tolist()[0]
-                        # Drip temperature is found at the index ~= bloom time + 5 seconds
-                        EN_drip_temp = temp_data.loc[drip_temp_idx-20:drip_temp_idx+20, 'Entrance_Needle'].max()
-                        ES_drip_temp = temp_data.loc[drip_temp_idx-20:drip_temp_idx+20, 'Exit_Needle'].max()
-                        IC_drip_temp = temp_data.loc[drip_temp_idx-20:drip_temp_idx+20, 'In_Cup'].max()
-
-                        # collect drip volume
-                        drip_temps[j] = [EN_drip_temp, ES_drip_temp, IC_drip_temp]
-                    # Increase the counter now that drip volumes and temps have been recorded
-                    j = j + 1
-            # Add drip columns to test plan
-            test_plan['drip'] = drip_vols
-            test_plan['Pre-fill'] = test_plan['Bloom Volume'] - test_plan['drip']
-            test_plan['Num B2B run'] = test_plan['Test Number'] % n_cycles_rinse
-            test_plan['Drip EN Temp'] = drip_temps[:, 0]
-            test_plan['Drip ES Temp'] = drip_temps[:, 1]
-            test_plan['Drip IC Temp'] = drip_temps[:, 2]
-            # As every 5th run is problematic due to rinse, remove every 5th test
-            test_plan_actual = test_plan[test_plan['Test Number'] % n_cycles_rinse != 0]
-            # Path to save results
-            Test_Output = results_dir + "\\" + 'Test Results.csv'
-            # save the test plan relevant data to a csv
-            test_plan_actual.to_csv(Test_Output, encoding='utf-8', index=False)
-            print("Postprocessing complete")
-            # record time to downsample analog signals
-            t_all = time.time()
-            print('Script took %0.3f s' % ((t_all - t0)))
+    # Results of cycles processed on earlier runs, keyed by cycle number
+    manifest = Manifest(results_dir)
+
+    # Test plan and the cycles of the campaign, in cycle order
+    with profiler.stage('catalog'):
+        catalog = CampaignCatalog(rootdir, results_dir)
+    plan_filename = catalog.shared_file('plan')
+    if plan_filename is None:
+        print('No test plan found in ' + rootdir)
+        renderer.join()
+        return
+    # a new test plan invalidates every cached cycle
+    manifest.check_shared(plan_filename)
+    with profiler.stage('parse'):
+        test_plan = pd.read_csv(plan_filename)
+    test_plan.columns = [
+        'Test Number',
+        'Flow Rate',
+        'Brew Temp',
+        'Brew Size',
+        'Bloom Time',
+        'Bloom Volume',
+        'Bloom Temp'
+    ]
+    # initialize number of tests, drip volume, and drip temperatures for each test
+    num_tests = len(test_plan)
+    drip_vols = [0] * num_tests
+    drip_temps = np.zeros((num_tests, 3))
+    # test plan row of each cycle number, cycle numbers may skip or not start at 0
+    plan_rows = {int(number): row for row, number in enumerate(test_plan['Test Number'])}
+
+    # each cycle's mass data with the daq temperatures recorded after it
+    for cycle_num, group in catalog.groups('mass', 'daq'):
+        mass_filename = group['mass']
+        UBTS_filename = group['daq']
+        file = os.path.basename(UBTS_filename)
+        row = plan_rows.get(cycle_num)
+        if row is None:
+            print('Skipping cycle ' + str(cycle_num) + ', it is not in the test plan')
+            continue
+        # Skip reading and plotting cycles whose inputs have not changed and
+        # whose figures are still there
+        figures = [] if cycle_num % n_cycles_rinse == 0 else cycle_figures(plots_dir, cycle_num)
+        if manifest.is_current(cycle_num, [mass_filename, UBTS_filename], figures):
+            print("Unchanged cycle " + str(cycle_num))
+            results = manifest.results(cycle_num)
+            drip_vols[row] = results['drip_vol']
+            drip_temps[row] = results['drip_temps']
+            continue
+        with profiler.stage('parse', cycle_num):
+            mass_data = pd.read_csv(mass_filename)
+        if mass_data.empty:
+            print('Skipping cycle ' + str(cycle_num) + ', no mass data in ' + os.path.basename(mass_filename))
+            continue
+        # Normalize mass and time to start at 0 at first data point
+        mass_data['mass'] = mass_data['mass'] - mass_data['mass'][0]
+        t_begin_mass = mass_data['time'][0]
+        t_end_mass = mass_data['time'].iloc[-1]
+        mass_data['time'] = mass_data['time'] - t_begin_mass
+        # so long as the flow was not reset (every n runs), plot mass data
+        if not (cycle_num % n_cycles_rinse == 0):
+            # Collect the bloom time for this run using the test plan
+            bloom_time = test_plan['Bloom Time'].iloc[row]
+            # averaging window and threshold to identify outliers
+            window = 10
+            threshold = 5
+            with profiler.stage('filter', cycle_num):
+                # remove outliers, samples further than threshold from the centered rolling mean
+                mass_data = mass_data[smooth_deviation_mask(mass_data['mass'], window, threshold)]
+            if mass_data.empty:
+                print('No mass data left after filtering, cycle ' + str(cycle_num))
+                drip_mass = 0
+                avg_drip_mass = 0
+            else:
+                # find the closest datapoint to the 5 seconds after the bloom time for this cycle
+                with profiler.stage('detect', cycle_num):
+                    drip_idx = mass_data.index[nearest_index(mass_data['time'].to_numpy(), bloom_time + 5)]
+                    # Drip mass is found at the index ~= bloom time + 5 seconds
+                    drip_mass = mass_data['mass'][drip_idx]
+                    # find the average drip mass around this time
+                    avg_drip_mass = mass_data['mass'].rolling(2).mean()[drip_idx]
+
+            # if average brew mass at this point is not consistent, enter zero for debugging
+            if not (drip_mass < avg_drip_mass * 1.1) and (drip_mass > avg_drip_mass * 0.9):
+                avg_drip_mass = 0
+            # collect drip volume
+            drip_vols[row] = avg_drip_mass
+            # plot series of mass vs time figures for each cycle
+            with profiler.stage('plot', cycle_num):
+                plot_mass(mass_data, plots_dir, cycle_num, renderer)
+
+        # Collect temp data
+        print("Processing cycle " + str(cycle_num))
+        with profiler.stage('parse', cycle_num):
+            temp_data = pd.read_csv(UBTS_filename)
+        t_end = float(file[0:10])
+        t_end_diff = t_end - t_end_mass
+        mass_data['time'] = mass_data['time'] + t_end_diff
+        # so long as the flow was not reset (every n runs), plot mass data
+        if not (cycle_num % n_cycles_rinse == 0):
+
+            #plot_temp(temp_data, plots_dir, cycle_num, renderer)
+            with profiler.stage('plot', cycle_num):
+                plot_temp_mass(temp_data, mass_data, plots_dir, cycle_num, renderer)
+            if temp_data.empty:
+                print('No temperature data, cycle ' + str(cycle_num))
+                EN_drip_temp = ES_drip_temp = IC_drip_temp = 0
+            else:
+                # find the closest datapoint to the 5 seconds after the bloom time for this cycle
+                with profiler.stage('detect', cycle_num):
+                    drip_temp_idx = temp_data.index[nearest_index(temp_data['Time (s)'].to_numpy(), bloom_time + 5)]
+                    # Drip temperature is found at the index ~= bloom time + 5 seconds
+                    EN_drip_temp = temp_data.loc[drip_temp_idx-20:drip_temp_idx+20, 'Entrance_Needle'].max()
+                    ES_drip_temp = temp_data.loc[drip_temp_idx-20:drip_temp_idx+20, 'Exit_Needle'].max()
+                    IC_drip_temp = temp_data.loc[drip_temp_idx-20:drip_temp_idx+20, 'In_Cup'].max()
+
+            # collect drip volume
+            drip_temps[row] = [EN_drip_temp, ES_drip_temp, IC_drip_temp]
+        # record this cycle's results against its input files
+        manifest.update(cycle_num, [mass_filename, UBTS_filename],
+                        {'drip_vol': float(drip_vols[row]),
+                         'drip_temps': [float(temp) for temp in drip_temps[row]]})
+    # Add drip columns to test plan
+    test_plan['drip'] = drip_vols
+    test_plan['Pre-fill'] = test_plan['Bloom Volume'] - test_plan['drip']
+    test_plan['Num B2B run'] = test_plan['Test Number'] % n_cycles_rinse
+    test_plan['Drip EN Temp'] = drip_temps[:, 0]
+    test_plan['Drip ES Temp'] = drip_temps[:, 1]
+    test_plan['Drip IC Temp'] = drip_temps[:, 2]
+    # As every 5th run is problematic due to rinse, remove every 5th test
+    test_plan_actual = test_plan[test_plan['Test Number'] % n_cycles_rinse != 0]
+    # Path to save results
+    Test_Output = os.path.join(results_dir, 'Test Results.csv')
+    # save the test plan relevant data to a csv
+    with profiler.stage('write'):
+        test_plan_actual.to_csv(Test_Output, encoding='utf-8', index=False)
+        manifest.save()
+    print("Postprocessing complete")
+    # wait for the remaining figures before reporting the total time
+    with profiler.stage('plot'):
+        renderer.join()
+    # record time to downsample analog signals
+    t_all = time.time()
+    print('Script took %0.3f s' % ((t_all - t0)))
+    profiler.summary()
+    profiler.write_json(os.path.join(results_dir, 'profile.json'))
 
 
 if __name__ == "__main__":
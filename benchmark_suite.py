@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark runner for the postprocessing scripts on synthetic campaigns.
+Each script's main() runs in its own process on a campaign of 10, 100 and 1000
+tests made by campaign_gen, and the wall time, peak RSS and per-file
+throughput are reported, so regressions and speedups can be measured.
+"""
+import argparse
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from campaign_gen import CAMPAIGNS
+
+# Script module -> campaign layout it reads
+SCRIPTS = {
+    'POSTPROCESS_UBTS_RV': 'ubts',
+    'POSTPROCESS_UBTS_LOG': 'ubts',
+    'POSTPROCESS_DOEv4': 'doe',
+    'POSTPROCESS_PumpFlowRate': 'doe',
+    'Postprocess_Automated_UBTS_CoffeeBloom': 'automated',
+}
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Function definition for common utilities
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def peak_rss():
+    # Peak resident memory in MB of this process and of its finished children
+    # (worker pools). Uses resource where it exists, else psutil, else None.
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        # ru_maxrss is in kB on Linux and in bytes on macOS
+        scale = 1 / 2 ** 20 if sys.platform == 'darwin' else 1 / 2 ** 10
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+        return own, children
+    try:
+        import psutil
+    except ImportError:
+        return None, None
+    memory = psutil.Process().memory_info()
+    return getattr(memory, 'peak_wset', memory.rss) / 2 ** 20, None
+
+
+def campaign_files(rootdir):
+    # Number and total size of the input files of a campaign
+    files = [os.path.join(rootdir, file) for file in next(os.walk(rootdir))[2]]
+    return len(files), sum(os.path.getsize(file) for file in files)
+
+
+def run_child(script, rootdir, result_file):
+    # Runs in the benchmark subprocess
+    module = importlib.import_module(script)
+    t0 = time.time()
+    module.main(rootdir)
+    wall = time.time() - t0
+    rss, children_rss = peak_rss()
+    with open(result_file, 'w') as fobj:
+        json.dump({'wall': wall, 'rss': rss, 'children_rss': children_rss}, fobj)
+
+
+def run_script(script, rootdir, fresh=True):
+    # Time one script on one campaign in a fresh interpreter
+    if fresh:
+        shutil.rmtree(os.path.join(rootdir, 'Results'), ignore_errors=True)
+    result_file = os.path.join(tempfile.mkdtemp(), 'result.json')
+    env = dict(os.environ, MPLBACKEND='Agg')
+    here = os.path.dirname(os.path.abspath(__file__))
+    env['PYTHONPATH'] = here + os.pathsep + env.get('PYTHONPATH', '')
+    child = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', script, rootdir, result_file],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env, cwd=here)
+    if child.returncode != 0:
+        print('%s failed:\n%s' % (script, child.stderr.decode(errors='replace')[-2000:]))
+        return None
+    with open(result_file) as fobj:
+        result = json.load(fobj)
+    shutil.rmtree(os.path.dirname(result_file))
+    return result
+
+
+def format_mb(value):
+    return '%8.0f' % value if value is not None else '     n/a'
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Main program function
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def main(sizes=(10, 100, 1000), scripts=tuple(SCRIPTS), workdir=None, warm=False, keep=False):
+    workdir = workdir or tempfile.mkdtemp(prefix='ubts_bench_')
+    rows = []
+    print('%-40s %6s %5s %9s %9s %9s %9s %8s' % ('Script', 'Tests', 'Run', 'Wall (s)', 'Files/s',
+                                                'MB/s', 'RSS (MB)', 'Workers'))
+    for n_tests in sizes:
+        campaigns = {}
+        for script in scripts:
+            kind = SCRIPTS[script]
+            if kind not in campaigns:
+                rootdir = os.path.join(workdir, '%s_%d' % (kind, n_tests))
+                t0 = time.time()
+                CAMPAIGNS[kind](rootdir, n_tests)
+                campaigns[kind] = rootdir
+                print('Generated %s campaign of %d tests in %0.1f s' % (kind, n_tests, time.time() - t0))
+            rootdir = campaigns[kind]
+            n_files, n_bytes = campaign_files(rootdir)
+
+            runs = ['cold', 'warm'] if warm else ['cold']
+            for run in runs:
+                result = run_script(script, rootdir, fresh=(run == 'cold'))
+                if result is None:
+                    continue
+                wall = result['wall']
+                row = {'script': script, 'tests': n_tests, 'run': run, 'files': n_files, 'bytes': n_bytes,
+                       'wall': wall, 'files_per_s': n_files / wall, 'mb_per_s': n_bytes / 2 ** 20 / wall,
+                       'rss': result['rss'], 'children_rss': result['children_rss']}
+                rows.append(row)
+                print('%-40s %6d %5s %9.2f %9.1f %9.1f %s %s' % (script, n_tests, run, wall, row['files_per_s'],
+                                                               row['mb_per_s'], format_mb(row['rss']),
+                                                               format_mb(row['children_rss'])))
+    if not keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return rows
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        run_child(*sys.argv[2:5])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description='Benchmark the postprocessing scripts on synthetic campaigns')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='campaign sizes in tests')
+    parser.add_argument('--scripts', nargs='+', default=list(SCRIPTS), choices=list(SCRIPTS))
+    parser.add_argument('--workdir', default=None, help='where campaigns are generated (default: a temp folder)')
+    parser.add_argument('--warm', action='store_true', help='also rerun each script with its Results folder kept')
+    parser.add_argument('--keep', action='store_true', help='keep the generated campaigns')
+    parser.add_argument('--csv', default=None, help='also write the results to this csv')
+    args = parser.parse_args()
+
+    results = main(args.sizes, args.scripts, args.workdir, args.warm, args.keep)
+    if args.csv:
+        import pandas as pd
+        pd.DataFrame(results).to_csv(args.csv, index=False)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Online drip and flow analysis of a live brew.
+Scale and brewer samples are fed in as they arrive and only O(1) state is
+kept: short window sums for the recent mass and the windowed flow rate, the last
+few samples around the drip time, and the flow start/end. The drip mass at
+bloom time + 5 s, the drip temperature, flow start/end and the pre-infusion
+flow rate are known by the time the brew finishes, and are saved next to the
+brew's _mass.csv.
+Run this file directly to check it against event_detect.detect_drip on
+traces with jittered timestamps.
+"""
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+
+class RollingSum:
+    # Sum and mean of the last window values. The sum is taken over the short
+    # window every time rather than kept running, so it has no drift: a
+    # plateau sums to exactly 0 like the offline cumsum differences.
+
+    def __init__(self, window):
+        self.values = deque(maxlen=window)
+
+    def append(self, value):
+        self.values.append(value)
+
+    @property
+    def total(self):
+        return sum(self.values)
+
+    def mean(self):
+        return self.total / len(self.values) if self.values else float('nan')
+
+    def __len__(self):
+        return len(self.values)
+
+
+class OnlineBrewAnalyzer:
+    # Flow starts once the rate summed over rate_window samples reaches on
+    # after t_min seconds and ends when it falls back to off, as in
+    # event_detect.detect_drip. The drip mass is taken at the sample nearest
+    # bloom_time + 5 s from the first scale sample and averaged with the one
+    # before it, as in the CoffeeBloom postprocessing. time_scale converts
+    # sample timestamps to brew seconds, e.g. for sped up simulated devices.
+
+    def __init__(self, bloom_time=None, mean_window=10, rate_window=3, on=0.1, off=0., t_min=4.,
+                 drip_delay=5., temp_window=2., time_scale=1.):
+        self.recent_mass = RollingSum(mean_window)
+        self.rate_sum = RollingSum(rate_window)
+        self.on = on
+        self.off = off
+        self.t_min = t_min
+        self.drip_time = None if bloom_time is None else bloom_time + drip_delay
+        self.temp_window = temp_window
+        self.time_scale = time_scale
+
+        self.t0 = None
+        self.m0 = None
+        # (time, mass) of the last three scale samples, times and masses from the first sample
+        self.last = deque(maxlen=3)
+        self.n_samples = 0
+        self.drip_mass = None
+        self.drip_avg_mass = None
+        self.drip_sample_time = None
+        self.drip_temp = None
+        self.flow_start = None
+        self.flow_end = None
+
+    def mean(self):
+        # Mean of the last mean_window raw masses
+        return self.recent_mass.mean()
+
+    def add_mass(self, ts, mass):
+        self.recent_mass.append(mass)
+        if self.t0 is None:
+            self.t0 = ts
+            self.m0 = mass
+        t = (ts - self.t0) * self.time_scale
+        m = mass - self.m0
+        self.n_samples += 1
+
+        if self.last:
+            t_prev, m_prev = self.last[-1]
+            if t > t_prev:
+                self.rate_sum.append((m - m_prev) / (t - t_prev))
+                self.update_flow(t_prev, m_prev)
+        self.last.append((t, m))
+
+        if (self.drip_time is not None) and (self.drip_mass is None) and (t >= self.drip_time):
+            self.take_drip_mass()
+
+    def update_flow(self, t, m):
+        # The windowed rate belongs to the earlier sample of the last step
+        rate = self.rate_sum.total
+        if self.flow_start is None:
+            if (rate >= self.on) and (t >= self.t_min):
+                self.flow_start = (t, m)
+        elif self.flow_end is None and rate <= self.off:
+            self.flow_end = (t, m)
+
+    def take_drip_mass(self):
+        # The sample nearest the drip time is either the last one or the one
+        # before, and its mass is averaged with the sample before it
+        samples = list(self.last)
+        k = len(samples) - 1
+        if k > 0 and abs(samples[k - 1][0] - self.drip_time) <= abs(samples[k][0] - self.drip_time):
+            k -= 1
+        self.drip_sample_time, self.drip_mass = samples[k]
+        self.drip_avg_mass = (samples[k - 1][1] + samples[k][1]) / 2 if k > 0 else self.drip_mass
+
+    def add_brewer(self, ts, temperature):
+        # Highest brewer temperature within temp_window seconds of the drip time
+        if (self.t0 is None) or (self.drip_time is None):
+            return
+        if abs((ts - self.t0) * self.time_scale - self.drip_time) <= self.temp_window:
+            if self.drip_temp is None or temperature > self.drip_temp:
+                self.drip_temp = temperature
+
+    def results(self):
+        # A flow still running when the brew finished ends at the last sample
+        flow_end = self.flow_end
+        if self.flow_start is not None and flow_end is None and self.last:
+            flow_end = self.last[-1]
+        result = {'samples': self.n_samples,
+                  'drip_time': self.drip_sample_time,
+                  'drip_mass': self.drip_mass,
+                  'drip_avg_mass': self.drip_avg_mass,
+                  'drip_consistent': None,
+                  'drip_temp': self.drip_temp,
+                  'flow_start_time': None, 'flow_start_mass': None,
+                  'flow_end_time': None, 'flow_end_mass': None,
+                  'flow_ended': self.flow_end is not None,
+                  'flow_rate': None}
+        if self.drip_mass is not None:
+            # the local mass should be within 10% of the averaged one
+            result['drip_consistent'] = 0.9 * self.drip_avg_mass <= self.drip_mass <= 1.1 * self.drip_avg_mass
+        if self.flow_start is not None:
+            result['flow_start_time'], result['flow_start_mass'] = self.flow_start
+            result['flow_end_time'], result['flow_end_mass'] = flow_end
+            flow_time = flow_end[0] - self.flow_start[0]
+            if flow_time > 0:
+                # mL/min, taking 1 g of water as 1 mL
+                result['flow_rate'] = 60 * (flow_end[1] - self.flow_start[1]) / flow_time
+        return result
+
+    def save(self, filename, **extra):
+        # extra adds columns, e.g. acquisition counts
+        pd.DataFrame([dict(self.results(), **extra)]).to_csv(filename, index=False)
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Check against the offline detection
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def check_offline(n_traces=50, n_samples=1200):
+    from event_detect import detect_drip
+
+    rng = np.random.default_rng(0)
+    matches = 0
+    for k in range(n_traces):
+        # 10 Hz scale frames with jittered timestamps and 0.1 g resolution: a
+        # plateau, a pour at 5-10 g/s and the settled brew
+        t = np.cumsum(rng.uniform(0.08, 0.12, n_samples))
+        start = rng.uniform(8, 15)
+        mass = np.round(np.clip((t - start) * rng.uniform(5, 10), 0, rng.uniform(150, 300)), 1)
+
+        analyzer = OnlineBrewAnalyzer()
+        for ts, m in zip(t, mass):
+            analyzer.add_mass(ts, m)
+        online = analyzer.results()
+
+        t_rel = t - t[0]
+        idx0, idx_end, _, _ = detect_drip(t_rel, mass - mass[0], mass - mass[0])
+        offline_start = None if idx0 is None else t_rel[idx0]
+        offline_end = None if idx_end is None else t_rel[idx_end]
+        same = ((online['flow_start_time'] == offline_start) and online['flow_ended']
+                and (online['flow_end_time'] == offline_end))
+        matches += same
+        if not same:
+            print('Trace %d: online flow %s-%s s, offline %s-%s s'
+                  % (k, online['flow_start_time'], online['flow_end_time'], offline_start, offline_end))
+    print('Online flow start/end same as detect_drip in %d of %d traces' % (matches, n_traces))
+    return matches == n_traces
+
+
+if __name__ == "__main__":
+    check_offline()
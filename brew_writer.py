@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only CSV writer for samples collected during a brew.
+Rows are batched in a short list and appended to an in-progress file
+whenever the batch is full or has waited too long, so a crash keeps what was
+read so far and memory does not grow with the brew. The file gets its final
+name (timestamp, temperature, size, flow, cycle) once the brew is over.
+"""
+import math
+import os
+from time import time
+
+
+def format_value(value):
+    # Missing readings are left empty, as DataFrame.to_csv writes NaN
+    if value is None:
+        return ''
+    value = float(value)
+    return '' if math.isnan(value) else repr(value)
+
+
+class BrewDataWriter:
+
+    def __init__(self, fldr_path, columns, tag='brew', flush_rows=256, flush_secs=2., index=False):
+        self.columns = list(columns)
+        self.flush_rows = flush_rows
+        self.flush_secs = flush_secs
+        # Write a leading row number column like DataFrame.to_csv does
+        self.index = index
+        self.batch = []
+        self.rows = 0
+        self.last_flush = time()
+
+        self.path = os.path.join(fldr_path, '%d_%s_in_progress.csv' % (1000 * time(), tag))
+        self.file = open(self.path, 'w', newline='')
+        header = ','.join(self.columns)
+        if self.index:
+            header = ',' + header
+        self.file.write(header + '\n')
+
+    def __len__(self):
+        # Rows written so far, flushed or not
+        return self.rows + len(self.batch)
+
+    def append(self, row):
+        self.batch.append(list(row))
+        if (len(self.batch) >= self.flush_rows) or ((time() - self.last_flush) >= self.flush_secs):
+            self.flush()
+
+    def flush(self):
+        if len(self.batch):
+            lines = []
+            for row in self.batch:
+                line = ','.join(map(format_value, row))
+                if self.index:
+                    line = str(self.rows) + ',' + line
+                lines.append(line + '\n')
+                self.rows += 1
+            self.file.writelines(lines)
+            self.batch = []
+        self.file.flush()
+        self.last_flush = time()
+
+    def finalize(self, filename):
+        # Flush what is left and move the file to its final name
+        self.flush()
+        self.file.close()
+        os.replace(self.path, filename)
+        self.path = filename
+        return filename
+
+    def discard(self):
+        # Drop the in-progress file, e.g. when nothing was brewed
+        if not self.file.closed:
+            self.file.close()
+            os.remove(self.path)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+One-pass catalog of the files of a test campaign.
+The campaign folder is listed once and every file name is classified with
+compiled patterns into a role (UBTS export, bloom log, scale log, labview lvm,
+brew csv, mass csv, daq csv, test plan) and a test or cycle number. Scripts
+then iterate over complete groups in number order instead of relying on
+directory order. The index is cached next to the results and rebuilt only
+when the folder's contents change.
+"""
+import bisect
+import json
+import os
+import re
+
+# Roles that belong to a single test, in the order names are tried
+ROLE_PATTERNS = [
+    ('plan', re.compile(r'plan\.csv$', re.I)),
+    ('daq', re.compile(r'^(\d+).*daq[^.]*\.csv$', re.I)),
+    ('mass', re.compile(r'cycle-(\d+)_mass\.csv$', re.I)),
+    ('brew', re.compile(r'cycle-(\d+)\.csv$', re.I)),
+    ('bloom_log', re.compile(r'Cycle\s*(\d+)\D*log\.\w+$', re.I)),
+    ('export', re.compile(r'Cycle\s*(\d+)\.\w+$', re.I)),
+    ('log', re.compile(r'\.log$', re.I)),
+    ('lvm', re.compile(r'\.lvm$', re.I)),
+]
+# Roles shared by the whole campaign
+SHARED_ROLES = ('plan',)
+# Test number of a scale log or labview file, e.g. Test012.log, Test012_1.lvm
+TEST_NUMBER = re.compile(r'Test\s*(\d+)', re.I)
+TRAILING_NUMBER = re.compile(r'(\d+)(?:_\d+)?\D{0,2}\.\w+$')
+# Leading epoch timestamp of the automated UBTS files
+TIMESTAMP = re.compile(r'^(\d+)')
+
+CATALOG_FILE = 'catalog.json'
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Function definition for common utilities
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def classify(name):
+    # (role, number) of a file name, or (None, None) for files of no interest.
+    # For daq files the number is the timestamp the file was written at.
+    for role, pattern in ROLE_PATTERNS:
+        match = pattern.search(name)
+        if match is None:
+            continue
+        if role in SHARED_ROLES:
+            return role, None
+        if match.groups():
+            return role, int(match.group(1))
+        number = TEST_NUMBER.search(name) or TRAILING_NUMBER.search(name)
+        if number is None:
+            return None, None
+        return role, int(number.group(1))
+    return None, None
+
+
+class CampaignCatalog:
+
+    def __init__(self, rootdir, cache_dir=None):
+        self.rootdir = rootdir
+        self.cache_file = os.path.join(cache_dir, CATALOG_FILE) if cache_dir else None
+        # test number -> {role: file name}
+        self.tests = {}
+        # shared role -> [file name, ...]
+        self.shared = {}
+        # files that matched a role but could not be placed in a test
+        self.unmatched = []
+        if not self.load():
+            self.scan()
+            self.save()
+
+    def signature(self):
+        # The folder's mtime changes whenever a file is added, removed or renamed
+        return os.stat(self.rootdir).st_mtime_ns
+
+    def scan(self):
+        names = sorted(entry.name for entry in os.scandir(self.rootdir) if entry.is_file())
+        daqs = []
+        for name in names:
+            role, number = classify(name)
+            if role is None:
+                continue
+            if role in SHARED_ROLES:
+                self.shared.setdefault(role, []).append(name)
+            elif role == 'daq':
+                daqs.append((number, name))
+            elif role in self.tests.get(number, {}):
+                self.unmatched.append(name)
+            else:
+                self.tests.setdefault(number, {})[role] = name
+
+        # A daq file is written at the end of its brew, so it belongs to the
+        # last cycle that started (brew csv timestamp) before it
+        starts = []
+        for number, group in self.tests.items():
+            timestamp = TIMESTAMP.match(group.get('brew') or group.get('mass') or '')
+            if timestamp:
+                starts.append((int(timestamp.group(1)), number))
+        starts.sort()
+        start_times = [start for start, _ in starts]
+        for timestamp, name in daqs:
+            k = bisect.bisect_right(start_times, timestamp) - 1
+            if k < 0 or 'daq' in self.tests[starts[k][1]]:
+                self.unmatched.append(name)
+            else:
+                self.tests[starts[k][1]]['daq'] = name
+
+    def load(self):
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return False
+        with open(self.cache_file, 'r') as fobj:
+            cache = json.load(fobj)
+        if cache.get('signature') != self.signature():
+            return False
+        self.tests = {int(number): group for number, group in cache['tests'].items()}
+        self.shared = cache['shared']
+        self.unmatched = cache['unmatched']
+        return True
+
+    def save(self):
+        if self.cache_file is None:
+            return
+        cache = {'signature': self.signature(), 'tests': self.tests,
+                 'shared': self.shared, 'unmatched': self.unmatched}
+        with open(self.cache_file, 'w') as fobj:
+            json.dump(cache, fobj)
+
+    def path(self, name):
+        return os.path.join(self.rootdir, name)
+
+    def groups(self, *roles):
+        # [(number, {role: path}), ...] in number order, for the tests that
+        # have a file for every one of roles
+        groups = []
+        for number in sorted(self.tests):
+            group = self.tests[number]
+            if all(role in group for role in roles):
+                groups.append((number, {role: self.path(name) for role, name in group.items()}))
+        return groups
+
+    def shared_file(self, role):
+        # Path of the last (in name order) campaign-wide file of role, or None
+        names = self.shared.get(role)
+        return self.path(names[-1]) if names else None
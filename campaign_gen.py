@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic test campaigns for benchmarking the postprocessing scripts.
+Writes UBTS tab exports with their 66-line preamble and bloom logs, TeraTerm
+scale logs with LabVIEW .lvm files, and automated UBTS _mass.csv / daq csv
+files with their generated test plan, in the layouts the scripts expect.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from ubts_export import PREAMBLE_LINES, NOTES_LINE, UBTS_COLUMNS
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Function definition for single files
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def mass_ramp(t, t_start, rate, final_mass):
+    # Mass that starts flowing at t_start and levels off at final_mass
+    return np.clip((t - t_start) * rate, 0, final_mass)
+
+
+def write_ubts_export(filename, n_samples=1200, brew_code='PULSE', bloom_time=15., seed=None,
+                      repeat_header_every=None):
+    # repeat_header_every writes the header row again every that many samples
+    rng = np.random.default_rng(seed)
+    with open(filename, 'w') as fobj:
+        for k in range(PREAMBLE_LINES):
+            if k == NOTES_LINE:
+                fobj.write('Notes:\t%s brew, synthetic campaign\n' % brew_code)
+            else:
+                fobj.write('Preamble field %d\tvalue %d\n' % (k, k))
+        fobj.write('\t'.join(UBTS_COLUMNS) + '\n')
+
+        t = np.arange(n_samples) * 0.1
+        drip = mass_ramp(t, bloom_time, 0.6, 12.) + rng.normal(0, 0.02, n_samples)
+        command = mass_ramp(t, bloom_time - 0.5, 0.6, 12.)
+        temps = 190 + 5 * np.sin(t / 10) + rng.normal(0, 0.2, (4, n_samples))
+        data = np.column_stack([
+            t, temps[0], temps[1], np.full(n_samples, 70.), temps[2],
+            np.full(n_samples, 1.), drip, np.full(n_samples, 2.), command,
+            np.full(n_samples, 195.), np.full(n_samples, 10.), np.gradient(command, t),
+            temps[0], drip, temps[1], drip])
+        step = repeat_header_every or n_samples
+        for start in range(0, n_samples, step):
+            if start:
+                fobj.write('\t'.join(UBTS_COLUMNS) + '\n')
+            np.savetxt(fobj, data[start:start + step], fmt='%0.3f', delimiter='\t')
+
+
+def write_ubts_log(filename, bloom_temp=85., bloom_time=15., bloom_volume=20., size=4):
+    # Bloom parameters as printed by the brewer for one cycle
+    with open(filename, 'w') as fobj:
+        fobj.write('Bloom Temp: %d\n' % bloom_temp)
+        fobj.write('Time: %d, Volume: %d\n' % (bloom_time, bloom_volume))
+        fobj.write('Size_Selected: %d oz\n' % size)
+
+
+def write_scale_log(filename, n_samples=1500, t_start=36000., dt=0.2, seed=None):
+    # TeraTerm capture of the scale with a timestamp on every line
+    rng = np.random.default_rng(seed)
+    t = t_start + np.arange(n_samples) * dt
+    mass = 100 + mass_ramp(t, t_start + 0.3 * n_samples * dt, 0.5, 50.) + rng.normal(0, 0.02, n_samples)
+    hours, rest = np.divmod(t, 3600)
+    minutes, seconds = np.divmod(rest, 60)
+    with open(filename, 'w') as fobj:
+        fobj.writelines('[2021-11-23 %02d:%02d:%06.3f]   %0.2f g\n' % row
+                        for row in zip(hours % 24, minutes, seconds, mass))
+
+
+def write_lvm(filename, n_samples=3000, delta_t=1/3, channels=('Voltage', 'Temperature', 'Temperature_0')):
+    # LabVIEW measurement file, one segment, 23 header lines before the column names
+    n_channels = len(channels)
+
+    def per_channel(value):
+        return '\t'.join([value] * n_channels)
+
+    header = ['LabVIEW Measurement\t', 'Writer_Version\t2', 'Reader_Version\t2', 'Separator\tTab',
+              'Decimal_Separator\t.', 'Multi_Headings\tNo', 'X_Columns\tOne', 'Time_Pref\tRelative',
+              'Operator\tUBTS', 'Description\tSynthetic campaign', 'Date\t2021/11/23',
+              'Time\t10:00:00.000', '***End_of_Header***', '',
+              'Channels\t%d' % n_channels,
+              'Samples\t' + per_channel(str(n_samples)),
+              'Date\t' + per_channel('2021/11/23'),
+              'Time\t' + per_channel('10:00:00.000'),
+              'Y_Unit_Label\t' + per_channel('Volts'),
+              'X_Dimension\t' + per_channel('Time'),
+              'X0\t' + per_channel('0.0000000000000000E+0'),
+              'Delta_X\t' + per_channel('%0.6f' % delta_t),
+              '***End_of_Header***',
+              'X_Value\t' + '\t'.join(channels) + '\tComment']
+
+    x = np.arange(n_samples) * delta_t
+    on = (n_samples // 3 < np.arange(n_samples)) & (np.arange(n_samples) < n_samples // 2)
+    data = np.column_stack([x, np.where(on, 5., 0.)] + [np.full(n_samples, 190.)] * (n_channels - 1))
+    with open(filename, 'w') as fobj:
+        fobj.write('\n'.join(header) + '\n')
+        np.savetxt(fobj, data, fmt='%0.6f', delimiter='\t')
+
+
+def write_mass_csv(filename, t_start, n_samples=400, bloom_time=10., seed=None):
+    # Scale trace of one automated brew, as saved next to the brew csv
+    rng = np.random.default_rng(seed)
+    t = t_start + np.arange(n_samples) * 0.25
+    mass = mass_ramp(t, t_start + bloom_time, 1.2, 350.) + rng.normal(0, 0.05, n_samples)
+    pd.DataFrame({'time': t, 'mass': mass}).to_csv(filename)
+
+
+def write_daq_csv(filename, n_samples=1000, seed=None):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_samples) * 0.1
+    temps = 185 + 5 * np.sin(t / 10) + rng.normal(0, 0.2, (3, n_samples))
+    pd.DataFrame({'Time (s)': t, 'Entrance_Needle': temps[0], 'Exit_Needle': temps[1],
+                  'In_Cup': temps[2] - 15}).to_csv(filename, index=False)
+
+
+def write_test_plan(filename, n_tests, seed=None):
+    rng = np.random.default_rng(seed)
+    test_plan = pd.DataFrame({'Type': rng.choice([5, 7, 9], n_tests),
+                              'Temp': 195 + 18 * rng.random(n_tests) - 9,
+                              'Size': rng.choice([2, 4], n_tests),
+                              'Bloom_Time': rng.choice([10, 15], n_tests),
+                              'Bloom_Volume': rng.choice(np.arange(17, 27, 2.5), n_tests),
+                              'Bloom_Temp': rng.choice([80, 85, 90], n_tests)})
+    test_plan.to_csv(filename)
+    return test_plan
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Function definition for whole campaigns
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def make_ubts_campaign(rootdir, n_tests, n_samples=1200):
+    # Cycle exports with their bloom logs (POSTPROCESS_UBTS_RV, POSTPROCESS_UBTS_LOG)
+    os.makedirs(rootdir, exist_ok=True)
+    for number in range(1, n_tests + 1):
+        bloom_time = 10. + 5 * (number % 2)
+        write_ubts_export(os.path.join(rootdir, 'Cycle%02d.txt' % number), n_samples,
+                          'PULSE' if number % 3 else 'EUROPA', bloom_time, seed=number)
+        write_ubts_log(os.path.join(rootdir, 'Cycle%02d_log.txt' % number), bloom_time=bloom_time)
+
+
+def make_doe_campaign(rootdir, n_tests, n_samples=1500):
+    # Scale logs with their labview files (POSTPROCESS_DOEv4, POSTPROCESS_PumpFlowRate)
+    os.makedirs(rootdir, exist_ok=True)
+    for number in range(1, n_tests + 1):
+        write_scale_log(os.path.join(rootdir, 'Test%03d.log' % number), n_samples, seed=number)
+        write_lvm(os.path.join(rootdir, 'Test%03d_1.lvm' % number), 2 * n_samples)
+
+
+def make_automated_campaign(rootdir, n_tests, n_samples=400):
+    # Test plan, brew, mass and daq files (Postprocess_Automated_UBTS_CoffeeBloom)
+    os.makedirs(rootdir, exist_ok=True)
+    t_plan = 1600000000
+    test_plan = write_test_plan(os.path.join(rootdir, '%d_generated_test_plan.csv' % t_plan), n_tests, seed=n_tests)
+    for cycle in range(n_tests):
+        ts = t_plan + 1000 * (cycle + 1)
+        save_str = os.path.join(rootdir, '%d_temp-%d_size-%d_flow_rate-%d_cycle-%d'
+                                % (ts, test_plan.Temp[cycle], test_plan.Size[cycle], test_plan.Type[cycle], cycle))
+        pd.DataFrame({'NOTES': [ts], 'vol': [0.]}).to_csv(save_str + '.csv', index=False)
+        write_mass_csv(save_str + '_mass.csv', ts - 100, n_samples, test_plan.Bloom_Time[cycle], seed=cycle)
+        write_daq_csv(os.path.join(rootdir, '%ddaq.csv' % (ts + 50)), 2 * n_samples, seed=cycle)
+
+
+CAMPAIGNS = {
+    'ubts': make_ubts_campaign,
+    'doe': make_doe_campaign,
+    'automated': make_automated_campaign,
+}
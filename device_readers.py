@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Background reader threads for the brew acquisition devices.
+Each device gets its own thread that reads it as fast as it answers and pushes
+timestamped samples into a queue, so a slow device never holds up another.
+"""
+from queue import Queue, Full
+from threading import Thread
+from time import sleep, time
+
+# Samples a queue holds before readers drop new ones, about a minute of both
+# devices at their full line rates
+SAMPLE_QUEUE_SIZE = 10000
+
+
+class DeviceReader(Thread):
+
+    def __init__(self, name, read, samples=None, idle=0., cancel=None, lossless=False):
+        # read() returns a list of (ts, value) samples, possibly empty.
+        # Samples are pushed to the samples queue as (name, ts, value). When
+        # it is full a lossless reader waits for room, any other drops the
+        # sample and counts it; a failing read pushes the exception as the
+        # value and stops the reader. cancel() unblocks a read() stuck on its
+        # port, e.g. a serial cancel_read, when stopping.
+        super().__init__(name=name, daemon=True)
+        self.read = read
+        self.samples = Queue(maxsize=SAMPLE_QUEUE_SIZE) if samples is None else samples
+        self.cancel = cancel
+        self.lossless = lossless
+        # Pause between reads that returned nothing, for non-blocking devices
+        self.idle = idle
+        self.keep_running = True
+        self.dropped = 0
+
+    def push(self, ts, value):
+        sample = (self.name, ts, value)
+        if not self.lossless:
+            try:
+                self.samples.put_nowait(sample)
+            except Full:
+                self.dropped += 1
+            return
+        # Only a reader that is being stopped gives up on a sample
+        while True:
+            try:
+                self.samples.put(sample, timeout=0.5)
+                return
+            except Full:
+                if not self.keep_running:
+                    self.dropped += 1
+                    return
+
+    def run(self):
+        while self.keep_running:
+            try:
+                new_samples = self.read()
+            except Exception as e:
+                # The error must reach the consumer, wait for room for it
+                try:
+                    self.samples.put((self.name, time(), e), timeout=1)
+                except Full:
+                    self.dropped += 1
+                self.keep_running = False
+                break
+
+            for ts, value in new_samples:
+                self.push(ts, value)
+            if not new_samples and self.idle:
+                sleep(self.idle)
+
+    def stop(self, timeout=2):
+        # True once the thread has ended. A thread still blocked in read()
+        # after timeout has its read cancelled, if it can be, and gets another
+        # timeout; it must not be left reading alongside whoever uses the
+        # device next.
+        self.keep_running = False
+        if self.is_alive():
+            self.join(timeout)
+        if self.is_alive() and self.cancel is not None:
+            self.cancel()
+            self.join(timeout)
+        if self.is_alive():
+            print('Reader ' + self.name + ' did not stop')
+            return False
+        return True
+
+
+def stop_readers(readers, dropped=None):
+    # Signal every reader first so they wind down together. True if all of
+    # them stopped. The samples each reader dropped are added to the dropped
+    # dict by reader name, when given.
+    for reader in readers:
+        reader.keep_running = False
+    stopped = True
+    for reader in readers:
+        stopped = reader.stop() and stopped
+        if dropped is not None:
+            dropped[reader.name] = dropped.get(reader.name, 0) + reader.dropped
+        if reader.dropped:
+            print('Reader ' + reader.name + ' dropped ' + str(reader.dropped) + ' samples, queue full')
+    return stopped
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+Simulated brewer, scale and pump for running the acquisition loop without
+hardware. The devices replay recorded brewer CSV lines and scale continuous
+print (CA) frames, or synthetic ones, at a real line rate times a speedup,
+with finite receive buffers that drop data the loop does not read in time.
+Driver modules that are not installed are replaced with placeholders, so
+neither the hardware nor its vendor drivers are needed. Run this file directly
+to measure AutomatedPAMS.brew_random at 10x-100x the real line rates.
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import shutil
+import sys
+import tempfile
+import types
+from time import sleep, time
+
+import numpy as np
+import pandas as pd
+
+BREWER_RATE = 10.
+SCALE_RATE = 10.
+# Lab PC driver and helper modules AutomatedUBTSTest imports at the top, with
+# the names it takes from them. The simulated devices stand in for all of them.
+HARDWARE_MODULES = {'mcculw': ['ul'],
+                    'serial': ['Serial'],
+                    'util': ['num2str', 'constrained_input'],
+                    'constants': ['PIN'],
+                    'BrewerControl': ['GRID_Elite'],
+                    'GridEliteController': ['EliteController'],
+                    'MccTempMonitor': ['MCC_Mixed_Monitor']}
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Function definition for the simulated streams
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def load_lines(filename):
+    # Raw recorded lines, e.g. a brewer debug capture or a scale CA capture
+    with open(filename, 'r') as fobj:
+        return [line.rstrip('\r\n') for line in fobj if line.strip()]
+
+
+def brewer_lines_from_csv(filename):
+    # Rebuild brewer lines from a saved brew csv (first column is the timestamp)
+    with open(filename, 'r') as fobj:
+        rows = fobj.read().splitlines()[1:]
+    return ['NOTES,' + row.split(',', 1)[1] for row in rows if row]
+
+
+def synthetic_brewer_lines(n_lines, n_fields=16, text_every=50):
+    # Numeric brewer lines with a debug text line every text_every lines
+    t = np.arange(n_lines) / BREWER_RATE
+    lines = []
+    for k in range(n_lines):
+        if text_every and (k % text_every == text_every - 1):
+            lines.append('Europa debug line %d' % k)
+            continue
+        values = 195 + np.sin(t[k] + np.arange(n_fields))
+        values[-1] = 0.5 * t[k]
+        lines.append('NOTES,' + ','.join('%.3f' % v for v in values))
+    return lines
+
+
+def synthetic_scale_frames(n_frames, final_mass=350.):
+    # Continuous print frames of a mass ramp that settles at final_mass
+    mass = np.minimum(0.1 + np.arange(n_frames) * final_mass / (0.8 * n_frames), final_mass)
+    frames = []
+    for k in range(n_frames):
+        flag = ' ?' if mass[k] < final_mass else ''
+        frames.append('%10.1f g%s' % (mass[k], flag))
+    return frames
+
+
+class StreamStats:
+
+    def __init__(self):
+        self.delivered = 0
+        self.dropped = 0
+        self.latency_total = 0.
+        self.latency_max = 0.
+
+    def deliver(self, latency):
+        self.delivered += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def as_dict(self):
+        latency_mean = self.latency_total / self.delivered if self.delivered else 0.
+        return {'delivered': self.delivered, 'dropped': self.dropped,
+                'latency_mean': latency_mean, 'latency_max': self.latency_max}
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Simulated devices
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+class SimBrewer:
+    # Stands in for the GRID Elite brewer. After brew() line k becomes readable
+    # k periods after the first read and read_ln blocks for it like a serial
+    # readline. Starting at the first read keeps the unscaled settle sleep of
+    # the scale's continuous print from piling lines up before the loop runs.
+
+    def __init__(self, lines, rate=BREWER_RATE, speedup=1., buffer_lines=64, timeout=1.):
+        self.lines = list(lines)
+        self.period = 1. / (rate * speedup)
+        self.buffer_lines = buffer_lines
+        self.timeout = timeout / speedup
+        self.t0 = None
+        self.brewing = False
+        self.next = 0
+        self.stats = StreamStats()
+
+    def brew(self, temperature, brew_size, flow_rate):
+        self.brewing = True
+        self.t0 = None
+        self.next = 0
+
+    def reset(self):
+        self.brewing = False
+        self.t0 = None
+
+    def print_europa_debug(self):
+        pass
+
+    def coffee_bloom_parameters(self, bloom_time, bloom_volume):
+        pass
+
+    def coffee_bloom_temp(self, bloom_temp):
+        pass
+
+    def read_ln(self):
+        if (not self.brewing) or (self.next >= len(self.lines)):
+            sleep(self.timeout)
+            return ''
+
+        now = time()
+        if self.t0 is None:
+            self.t0 = now
+        available = min(int((now - self.t0) / self.period) + 1, len(self.lines))
+        if available - self.next > self.buffer_lines:
+            # The receive buffer overflowed, the oldest lines are gone
+            self.stats.dropped += available - self.next - self.buffer_lines
+            self.next = available - self.buffer_lines
+
+        ready_time = self.t0 + self.next * self.period
+        if ready_time > now:
+            if ready_time - now > self.timeout:
+                sleep(self.timeout)
+                return ''
+            sleep(ready_time - now)
+            now = time()
+
+        self.stats.deliver(now - ready_time)
+        line = self.lines[self.next]
+        self.next += 1
+        return line
+
+
+class SimScaleSerial:
+    # Stands in for the scale serial port. After "CA" frame k is readable k
+    # periods after the first read; the last frame repeats forever like a
+    # settled scale. Starting at the first read keeps the unscaled settle
+    # sleep after "CA" from releasing a burst of sped up frames at once.
+
+    def __init__(self, frames, rate=SCALE_RATE, speedup=1., buffer_bytes=4096):
+        self.frames = [(frame + '\r\n').encode('UTF-8') for frame in frames]
+        self.period = 1. / (rate * speedup)
+        self.buffer_bytes = buffer_bytes
+        self.t0 = None
+        self.printing = False
+        self.next = 0
+        self.stats = StreamStats()
+
+    def write(self, command):
+        if command.startswith(b'CA'):
+            self.printing = True
+            self.t0 = None
+            self.next = 0
+        elif command.startswith(b'0A'):
+            self.printing = False
+            self.t0 = None
+        return len(command)
+
+    def frame(self, k):
+        return self.frames[min(k, len(self.frames) - 1)]
+
+    def read_all(self):
+        if not self.printing:
+            return b''
+
+        now = time()
+        if self.t0 is None:
+            self.t0 = now
+        available = int((now - self.t0) / self.period) + 1
+        pending = [self.frame(k) for k in range(self.next, available)]
+        size = sum(len(frame) for frame in pending)
+        while size > self.buffer_bytes:
+            size -= len(pending.pop(0))
+            self.stats.dropped += 1
+            self.next += 1
+
+        for k in range(self.next, available):
+            self.stats.deliver(now - (self.t0 + k * self.period))
+        self.next = available
+        return b''.join(pending)
+
+
+class SimPump:
+    # Stands in for the GRID Elite water pump of the RoboScale
+
+    def __init__(self):
+        self.level = 0
+        self.switches = 0
+
+    def set_water_pump(self, level):
+        if level != self.level:
+            self.switches += 1
+        self.level = level
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Harness
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+class Unavailable:
+    # Placeholder for a name of a driver module that is not installed. Only
+    # using it fails, importing AutomatedUBTSTest does not.
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attribute):
+        raise RuntimeError(self.name + ' is not installed, only simulated devices can be used')
+
+    def __call__(self, *args, **kwargs):
+        raise RuntimeError(self.name + ' is not installed, only simulated devices can be used')
+
+
+def num2str(x, num_didgets=3):
+    return '%.*f' % (num_didgets, x)
+
+
+def install_hardware_stubs():
+    # Placeholder modules for the drivers that cannot be imported here, e.g. no
+    # vendor DLLs. Installed drivers are left alone.
+    for name, attributes in HARDWARE_MODULES.items():
+        try:
+            importlib.import_module(name)
+        except (ImportError, OSError):
+            module = types.ModuleType(name)
+            for attribute in attributes:
+                setattr(module, attribute, Unavailable(name + '.' + attribute))
+            if name == 'util':
+                # the brew loop formats timestamps and file names with it
+                module.num2str = num2str
+            sys.modules[name] = module
+
+
+def sim_pams(fldr_path, brewer_lines, scale_frames, speedup):
+    # An AutomatedPAMS wired to simulated devices instead of COM ports
+    install_hardware_stubs()
+    from AutomatedUBTSTest import AutomatedPAMS, RoboScale, HEADERS
+    from scale_reader import ScaleFrameReader
+
+    scale = RoboScale.__new__(RoboScale)
+    scale.pump_controller = SimPump()
+    scale.scale_serial = SimScaleSerial(scale_frames, speedup=speedup)
+    scale.pump_on = False
+    scale.continuous_print = False
+    scale.frame_reader = ScaleFrameReader()
+
+    pams = AutomatedPAMS.__new__(AutomatedPAMS)
+    pams.brewer = SimBrewer(brewer_lines, speedup=speedup)
+    pams.scale = scale
+    pams.daq = None
+    pams.brew_count = 0
+    pams.local_fldr_path = fldr_path
+    pams.headers = [h for h in HEADERS.split(',')]
+    pams.brew_data = None
+    pams.brew_idle_timeout = AutomatedPAMS.brew_idle_timeout / speedup
+    pams.sample_time_scale = speedup
+    return pams
+
+
+def count_rows(filename):
+    with open(filename, 'r') as fobj:
+        return sum(1 for _ in fobj) - 1
+
+
+def run_harness(speedups=(10, 30, 100), brew_secs=120.):
+    brewer_lines = synthetic_brewer_lines(int(brew_secs * BREWER_RATE))
+    scale_frames = synthetic_scale_frames(int(brew_secs * SCALE_RATE))
+    n_numeric = sum(1 for line in brewer_lines if not line.startswith('Europa'))
+
+    for speedup in speedups:
+        fldr_path = tempfile.mkdtemp()
+        pams = sim_pams(fldr_path, brewer_lines, scale_frames, speedup)
+
+        t0 = time()
+        # The loop prints every brewer line, keep that cost but not the noise
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, save_str = pams.brew_random(5, 4, 195, bloom_time=10)
+        wall = time() - t0
+
+        brew_rows = count_rows(save_str + '.csv')
+        mass_rows = count_rows(save_str + '_mass.csv')
+        brewer = pams.brewer.stats.as_dict()
+        scale = pams.scale.scale_serial.stats.as_dict()
+        reader = pams.scale.frame_reader.stats()
+        analysis = pd.read_csv(save_str + '_analysis.csv').iloc[0]
+        shutil.rmtree(fldr_path)
+
+        print('Speedup %dx (%0.0f brewer lines/s, %0.0f scale frames/s), loop took %0.2f s'
+              % (speedup, BREWER_RATE * speedup, SCALE_RATE * speedup, wall))
+        print('    brewer: %d rows saved of %d, %d lines overflowed, latency max %0.1f ms mean %0.1f ms'
+              % (brew_rows, n_numeric, brewer['dropped'],
+                 1000 * brewer['latency_max'], 1000 * brewer['latency_mean']))
+        print('    scale: %d rows saved (%0.0f/s), %d dropped, latency max %0.1f ms mean %0.1f ms'
+              % (mass_rows, mass_rows / wall, scale['dropped'] + reader['dropped'],
+                 1000 * scale['latency_max'], 1000 * scale['latency_mean']))
+        print('    online analysis: drip mass %0.1f g, flow %0.1f-%0.1f s at %0.1f mL/min (sim time)'
+              % (analysis.drip_avg_mass, analysis.flow_start_time, analysis.flow_end_time, analysis.flow_rate))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the brew acquisition loop against simulated devices')
+    parser.add_argument('--speedup', type=float, nargs='+', default=[10, 30, 100],
+                        help='multiples of the real line rates to run at')
+    parser.add_argument('--brew-secs', type=float, default=120., help='length of the simulated brew in real seconds')
+    args = parser.parse_args()
+    run_harness(args.speedup, args.brew_secs)
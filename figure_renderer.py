@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Off-process figure rendering for the postprocessing scripts.
+Plot jobs are the data arrays plus the name of a plot type, sent to a pool of
+headless Agg worker processes so analysis keeps running while PNGs are written.
+Long series are decimated to the min and max of each pixel-sized bucket before
+they are sent, so spikes and steps stay visible in much smaller jobs and PNGs.
+Set FIGURE_DECIMATE_BUCKETS=0 in the environment, or pass buckets=0, to plot
+every sample. Run this file directly to benchmark the decimation.
+"""
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+# Buckets per series, comfortably more than the 640 px of a default figure
+DECIMATE_BUCKETS = 1000
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Plot types, each draws one figure from plain arrays
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def draw_temps_vs_mass(mass, entrance, exit, in_cup, title):
+    fig2, ax2 = plt.subplots()
+    ax2.plot(mass, entrance, label='Entrance Needle')
+    ax2.plot(mass, exit, label='Exit Needle')
+    ax2.plot(mass, in_cup, label='In-Cup')
+    ax2.legend(loc=0)
+    ax2.grid()
+    ax2.set_xlabel("Brew Mass (g)")
+    ax2.set_ylabel(r"Temp (F)")
+    ax2.set_title(title)
+    ax2.set_xlim([0, 180])
+    return fig2
+
+
+def draw_mass_vs_time(time, mass, title):
+    fig, ax = plt.subplots()
+    ax.plot(time, mass, label='Data')
+    ax.legend(loc=0)
+    ax.grid()
+    ax.set_xlabel("Time (s)")
+    ax.set_ylabel(r"Brew Mass (g)")
+    ax.set_title(title)
+    return fig
+
+
+def draw_temp_vs_time(time, entrance, exit, in_cup, title):
+    fig, ax = plt.subplots()
+    ax.set_ylabel('Temperature (F)')
+    ax.set_xlabel('Time (s)')
+    ax.plot(time, entrance, label='Entrance Needle')
+    ax.plot(time, exit, label='Exit Needle')
+    ax.plot(time, in_cup, label='In-Cup')
+    ax.legend(loc=0)
+    ax.grid()
+    ax.set_title(title)
+    return fig
+
+
+def draw_temp_mass_vs_time(mass_time, mass, temp_time, entrance, exit, in_cup, title):
+    fig, ax1 = plt.subplots()
+    color = 'tab:red'
+    ax1.set_xlabel('Time (s)')
+    ax1.set_ylabel('Brew Mass (g)', color=color)
+    ax1.plot(mass_time, mass, label='Mass', color=color)
+    ax1.tick_params(axis='y', labelcolor=color)
+
+    ax2 = ax1.twinx()
+    color = 'tab:blue'
+    ax2.set_ylabel('Temp', color=color)  # we already handled the x-label with ax1
+    ax2.plot(temp_time, entrance, label='Entrance Needle')
+    ax2.plot(temp_time, exit, label='Exit Needle')
+    ax2.plot(temp_time, in_cup, label='In-Cup')
+    ax2.tick_params(axis='y', labelcolor=color)
+    ax1.set_title(title)
+    return fig
+
+
+def draw_voltage_mass(voltage_time, voltage, mass_time, mass, title):
+    # DOEv4 per-test figure: pump voltage against cup mass
+    fig, ax = plt.subplots()
+    color = 'tab:red'
+    ax.set_xlabel('Time (s)')
+    ax.tick_params(axis='y', labelcolor=color)
+    ax.set_ylabel('Voltage', color=color)
+    ax.plot(voltage_time, voltage, label='Voltage', color=color)
+
+    ax2 = ax.twinx()
+    ax2.plot(mass_time, mass, label='Mass', color='blue')
+    ax.legend(loc=1)
+    ax2.legend(loc=4)
+    color = 'tab:blue'
+
+    ax2.set_ylabel('Mass (g)', color=color)  # we already handled the x-label with ax
+    ax2.tick_params(axis='y', labelcolor=color)
+    ax.grid()
+    ax.set_title(title)
+    return fig
+
+
+def draw_pump_flow(voltage_time, voltage, mass_time, mass, smooth_time, smooth_mass, title):
+    # PumpFlowRate figure: pump voltage against raw and smoothed scale mass
+    fig, ax = plt.subplots()
+    color = 'tab:red'
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('Voltage', color=color)
+    ax.plot(voltage_time, voltage, label='Voltage', color=color)
+    ax.tick_params(axis='y', labelcolor=color)
+
+    ax2 = ax.twinx()
+    color = 'tab:blue'
+    ax2.set_ylabel('Mass', color=color)  # we already handled the x-label with ax
+    ax2.tick_params(axis='y', labelcolor=color)
+    ax2.plot(mass_time, mass, label='Mass', color=color)
+    ax2.plot(smooth_time, smooth_mass, label='Mass_smooth', color='green')
+    ax2.legend(loc=0)
+    ax2.grid()
+    ax.set_title(title)
+    return fig
+
+
+PLOT_TYPES = {
+    'temps_vs_mass': draw_temps_vs_mass,
+    'mass_vs_time': draw_mass_vs_time,
+    'temp_vs_time': draw_temp_vs_time,
+    'temp_mass_vs_time': draw_temp_mass_vs_time,
+    'voltage_mass': draw_voltage_mass,
+    'pump_flow': draw_pump_flow,
+}
+
+# The series of each plot type, as (x, [y, ...]) arguments sharing a length
+PLOT_SERIES = {
+    'temps_vs_mass': [('mass', ['entrance', 'exit', 'in_cup'])],
+    'mass_vs_time': [('time', ['mass'])],
+    'temp_vs_time': [('time', ['entrance', 'exit', 'in_cup'])],
+    'temp_mass_vs_time': [('mass_time', ['mass']), ('temp_time', ['entrance', 'exit', 'in_cup'])],
+    'voltage_mass': [('voltage_time', ['voltage']), ('mass_time', ['mass'])],
+    'pump_flow': [('voltage_time', ['voltage']), ('mass_time', ['mass']), ('smooth_time', ['smooth_mass'])],
+}
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Decimation
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def minmax_index(ys, buckets=DECIMATE_BUCKETS):
+    # Indices of the samples to plot: the first and last sample plus, in each
+    # of buckets equal runs of samples, where every y is smallest and largest.
+    # Buckets go by sample order rather than x, so x need not be sorted.
+    # Returns None when the series is short enough to plot as is.
+    n = len(ys[0])
+    if not buckets or n <= 4 * buckets:
+        return None
+    size = n // buckets
+    n_full = size * buckets
+    offsets = np.arange(buckets) * size
+    keep = [np.array([0, n - 1]), np.arange(n_full, n)]
+    for y in ys:
+        block = np.asarray(y, dtype=np.float64)[:n_full].reshape(buckets, size)
+        # NaNs (e.g. the start of a rolling mean) never win a bucket
+        is_nan = np.isnan(block)
+        keep.append(offsets + np.argmin(np.where(is_nan, np.inf, block), axis=1))
+        keep.append(offsets + np.argmax(np.where(is_nan, -np.inf, block), axis=1))
+    return np.unique(np.concatenate(keep))
+
+
+def default_buckets():
+    # Buckets from the environment, 0 turns decimation off
+    return int(os.environ.get('FIGURE_DECIMATE_BUCKETS', DECIMATE_BUCKETS))
+
+
+def decimate_frame(df, columns, buckets=None):
+    # Rows of a dataframe to plot its columns against its index, e.g. with
+    # df[columns].plot() for figures drawn outside the renderer
+    buckets = default_buckets() if buckets is None else buckets
+    idx = minmax_index([df[column].to_numpy() for column in columns], buckets)
+    return df if idx is None else df.iloc[idx]
+
+
+def decimate(kind, data, buckets=DECIMATE_BUCKETS):
+    # data with every series of a plot type cut down to its min/max samples
+    for x_key, y_keys in PLOT_SERIES.get(kind, []):
+        idx = minmax_index([data[key] for key in y_keys], buckets)
+        if idx is None:
+            continue
+        for key in [x_key] + y_keys:
+            data[key] = data[key][idx]
+    return data
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Worker side
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def _init_worker():
+    # Workers never show figures, so use the headless backend
+    plt.switch_backend('Agg')
+
+
+def render(kind, figure_path, data):
+    # Draw and save one figure, returning how long it took
+    t0 = time.time()
+    fig = PLOT_TYPES[kind](**data)
+    try:
+        fig.tight_layout()  # otherwise the right y-label is slightly clipped
+        fig.savefig(figure_path)  # save the figure to file
+    finally:
+        plt.close(fig)
+    return time.time() - t0
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Main process side
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+class FigureRenderer:
+
+    def __init__(self, jobs=None, buckets=None):
+        # jobs=0 renders in the calling process, which is handy for debugging.
+        # buckets=0 turns decimation off.
+        self.jobs = os.cpu_count() if jobs is None else jobs
+        self.buckets = default_buckets() if buckets is None else buckets
+        self.executor = None
+        if self.jobs > 0:
+            self.executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker)
+        else:
+            # figures rendered here are never shown either
+            _init_worker()
+        self.futures = []
+        self.failures = []
+        self.render_time = 0
+        self.count = 0
+
+    def submit(self, kind, figure_path, **data):
+        if kind not in PLOT_TYPES:
+            raise ValueError('Unknown plot type: ' + str(kind))
+        # Ship plain arrays rather than dataframes to keep the jobs small. They
+        # are copied since jobs are pickled later, after the caller moves on.
+        data = {key: (val if isinstance(val, str) else np.array(val)) for key, val in data.items()}
+        data = decimate(kind, data, self.buckets)
+        self.count += 1
+        if self.executor is None:
+            try:
+                self.render_time += render(kind, figure_path, data)
+            except Exception as err:
+                self.failed(figure_path, err)
+        else:
+            self.futures.append((figure_path, self.executor.submit(render, kind, figure_path, data)))
+
+    def failed(self, figure_path, err):
+        # A figure that could not be written does not stop the others
+        print('Could not render ' + str(figure_path) + ': ' + repr(err))
+        self.failures.append((figure_path, err))
+
+    def join(self):
+        # Wait for every figure to be written and report the time spent
+        # rendering. Failed figures are listed in self.failures.
+        t0 = time.time()
+        try:
+            for figure_path, future in self.futures:
+                try:
+                    self.render_time += future.result()
+                except Exception as err:
+                    self.failed(figure_path, err)
+        finally:
+            # also reached on Ctrl+C, pending figures are dropped
+            self.futures = []
+            if self.executor is not None:
+                self.executor.shutdown(cancel_futures=True)
+                self.executor = None
+        print('Rendered %d figures, %0.3f s render time, waited %0.3f s at join'
+              % (self.count - len(self.failures), self.render_time, time.time() - t0))
+        if self.failures:
+            print('%d figures failed to render' % len(self.failures))
+        return self.render_time
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Benchmark
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def benchmark(n_samples=500000):
+    # One DOEv4 figure of a long labview stream, with and without decimation
+    plt.switch_backend('Agg')
+    fldr = tempfile.mkdtemp()
+    t = np.arange(n_samples) / 1000
+    voltage = np.where((t > 100) & (t < 300), 5., 0.) + np.random.normal(0, 0.05, n_samples)
+    voltage[n_samples // 3] = 9.  # a one-sample spike that must survive
+    mass = np.clip(t - 120, 0, 150) + np.random.normal(0, 0.02, n_samples)
+    for buckets in [0, DECIMATE_BUCKETS]:
+        figure_path = os.path.join(fldr, 'bench_%d.png' % buckets)
+        data = decimate('voltage_mass', {'voltage_time': t, 'voltage': voltage, 'mass_time': t, 'mass': mass,
+                                         'title': 'Benchmark'}, buckets)
+        render_time = render('voltage_mass', figure_path, data)
+        print('%s: %d points, render %0.3f s, PNG %0.0f kB, spike kept: %s'
+              % ('Decimated' if buckets else 'Full resolution', len(data['voltage']), render_time,
+                 os.path.getsize(figure_path) / 1024, data['voltage'].max() == 9.))
+        os.remove(figure_path)
+    os.rmdir(fldr)
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Reader for LabVIEW measurement (.lvm) files.
+The file header and every segment header are parsed for the separators,
+channel names, Delta_X and X0 instead of skipping a fixed number of lines, and
+each segment's data block is loaded as float32 columns. Segments are joined
+into one dataframe with a Time column in seconds built from the header timing.
+Run this file directly to benchmark it against the fixed-header read_csv path.
+"""
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+END_OF_HEADER = b'***End_of_Header***'
+# Every segment header starts with its channel count
+SEGMENT_START = b'\nChannels'
+SEPARATORS = {'Tab': b'\t', 'Comma': b','}
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Function definition for common utilities
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def parse_header(block, sep):
+    # "key<sep>value<sep>value..." lines of a header into {key: [values]}
+    fields = {}
+    for line in block.decode('utf-8', 'replace').splitlines():
+        values = [value.strip() for value in line.split(sep)]
+        values = [value for value in values if value]
+        if values:
+            fields[values[0]] = values[1:]
+    return fields
+
+
+def _first_float(fields, key, default):
+    try:
+        return float(fields[key][0].replace(',', '.'))
+    except (KeyError, IndexError, ValueError):
+        return default
+
+
+def _is_number(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+def read_segment(raw, start, end, sep, decimal):
+    # Column names and float32 data of the block raw[start:end], which begins
+    # right after a segment header
+    line_end = raw.find(b'\n', start, end)
+    line_end = end if line_end < 0 else line_end + 1
+    first_line = raw[start:line_end].decode('utf-8', 'replace').rstrip('\r\n')
+    names = first_line.split(sep.decode())
+    if names and _is_number(names[0]):
+        # No column names row, the data starts straight away
+        names = None
+    else:
+        start = line_end
+
+    block = raw[start:end]
+    if not block or block.isspace():
+        return names or [], pd.DataFrame()
+    if names is None:
+        n_fields = block[:block.find(b'\n')].rstrip(b'\r').count(sep) + 1
+        names = ['Y%d' % k for k in range(n_fields)]
+
+    # Keep the first X_Value column and the channels, never the comments.
+    # Empty fields, e.g. a channel that was only written once, read as NaN.
+    usecols = [k for k, name in enumerate(names)
+               if name and name != 'Comment' and not (name == 'X_Value' and k > 0 and 'X_Value' in names[:k])]
+    data = pd.read_csv(io.BytesIO(block), sep=sep.decode(), header=None, usecols=usecols,
+                       dtype=np.float32, decimal=decimal, skip_blank_lines=True)
+    data.columns = [names[k] for k in usecols]
+    return names, data
+
+
+def read_lvm(filename):
+    # Returns the data as a dataframe of float32 channels plus a float64 Time
+    # column in seconds from the first sample, and a header dict with the file
+    # fields and the timing of every segment
+    with open(filename, 'rb') as fobj:
+        raw = fobj.read()
+    header = {'fields': {}, 'segments': [], 'delta_x': None}
+    if not raw.startswith(b'LabVIEW Measurement'):
+        print('Not a LabVIEW measurement file: ' + str(filename))
+        return pd.DataFrame(), header
+
+    file_end = raw.find(END_OF_HEADER)
+    if file_end < 0:
+        print('No header end found in file: ' + str(filename))
+        return pd.DataFrame(), header
+    first_line = raw[:raw.find(b'\n')]
+    sep = b'\t' if b'\t' in first_line else b','
+    fields = parse_header(raw[:file_end], sep.decode())
+    sep = SEPARATORS.get((fields.get('Separator') or ['Tab'])[0], sep)
+    decimal = (fields.get('Decimal_Separator') or ['.'])[0]
+    header['fields'] = {key: values[0] if len(values) == 1 else values for key, values in fields.items()}
+
+    segments = []
+    pos = file_end + len(END_OF_HEADER)
+    while True:
+        segment_end = raw.find(END_OF_HEADER, pos)
+        if segment_end < 0:
+            break
+        segment_fields = parse_header(raw[pos:segment_end], sep.decode())
+        data_start = raw.find(b'\n', segment_end) + 1
+        if data_start == 0:
+            break
+        next_segment = raw.find(SEGMENT_START, data_start)
+        data_end = len(raw) if next_segment < 0 else next_segment + 1
+        names, data = read_segment(raw, data_start, data_end, sep, decimal)
+
+        delta_x = _first_float(segment_fields, 'Delta_X', None)
+        x0 = _first_float(segment_fields, 'X0', 0.)
+        segments.append({'channels': [name for name in names if name not in ('X_Value', 'Comment')],
+                         'samples': len(data), 'delta_x': delta_x, 'x0': x0})
+        if not data.empty:
+            data['Segment'] = len(segments) - 1
+            segments[-1]['data'] = data
+        if next_segment < 0:
+            break
+        pos = next_segment + 1
+
+    frames = []
+    t_next = None
+    for segment in segments:
+        data = segment.pop('data', None)
+        if data is None:
+            continue
+        delta_x = segment['delta_x']
+        if delta_x is None:
+            # No timing in the header, fall back on the X values if there are any
+            if 'X_Value' in data:
+                x = data['X_Value'].to_numpy(np.float64)
+                delta_x = float(np.median(np.diff(x))) if len(x) > 1 else 1.
+            else:
+                delta_x = 1.
+            segment['delta_x'] = delta_x
+        # X0 is relative or absolute depending on Time_Pref. Times are kept
+        # from the first segment's X0, and a segment that starts over (e.g.
+        # relative X0 of every segment at 0) continues after the previous one.
+        t_start = segment['x0'] - segments[0]['x0']
+        if t_next is not None and t_start < t_next:
+            t_start = t_next
+        data['Time'] = t_start + np.arange(len(data)) * delta_x
+        t_next = t_start + len(data) * delta_x
+        frames.append(data)
+
+    header['segments'] = segments
+    if segments:
+        header['delta_x'] = segments[0]['delta_x']
+    if not frames:
+        return pd.DataFrame(), header
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0], header
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Benchmark against the fixed-header read_csv path
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def _read_lvm_fixed_header(filename, delta_t=1/3):
+    # The read previously used by DOEv4 and PumpFlowRate
+    df = pd.read_csv(filename, sep='\t', skiprows=23, header=0)
+    size_df = len(df.X_Value)
+    df['Time'] = np.linspace(0, delta_t * size_df, size_df)
+    return df
+
+
+def benchmark(n_samples=1000000, n_segments=4):
+    from campaign_gen import write_lvm
+
+    fldr = tempfile.mkdtemp()
+    filename = os.path.join(fldr, 'bench.lvm')
+    write_lvm(filename, n_samples)
+
+    t0 = time.time()
+    df_old = _read_lvm_fixed_header(filename)
+    t_old = time.time() - t0
+
+    t0 = time.time()
+    df, header = read_lvm(filename)
+    t_new = time.time() - t0
+
+    print('Samples: %d, channels: %s, Delta_X %0.6f s' % (len(df), header['segments'][0]['channels'],
+                                                         header['delta_x']))
+    print('Fixed-header read_csv took %0.3f s, %0.1f MB' % (t_old, df_old.memory_usage().sum() / 2 ** 20))
+    print('LVM reader took %0.3f s (%0.1fx), %0.1f MB' % (t_new, t_old / t_new, df.memory_usage().sum() / 2 ** 20))
+
+    # The same samples written as several segments, which the fixed-header
+    # path reads as header text in the middle of the data
+    with open(filename, 'rb') as fobj:
+        lines = fobj.read().split(b'\n')
+    segment_header = lines[13:24]
+    data = lines[24:-1]
+    per_segment = len(data) // n_segments
+    with open(filename, 'wb') as fobj:
+        fobj.write(b'\n'.join(lines[:13]) + b'\n')
+        for k in range(n_segments):
+            fobj.write(b'\n'.join(segment_header + data[k * per_segment:(k + 1) * per_segment]) + b'\n')
+    t0 = time.time()
+    df, header = read_lvm(filename)
+    print('%d segments, %d samples read in %0.3f s' % (len(header['segments']), len(df), time.time() - t0))
+    os.remove(filename)
+    os.rmdir(fldr)
+
+
+if __name__ == "__main__":
+    benchmark()
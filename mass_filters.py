@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Outlier filters for scale mass traces.
+Hampel (rolling median/MAD), z-score, rolling-mean deviation and delta-band
+filters, computed with cumulative sums and sliding window views over numpy
+arrays. Each returns a boolean mask of the samples to keep, so callers index
+their data once. Run this file directly to benchmark them against the
+pandas/scipy code they replace.
+"""
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Scales the median absolute deviation to a standard deviation for normal noise
+MAD_SCALE = 1.4826
+# Rows of sliding windows materialized at once by the Hampel filter
+CHUNK_ROWS = 65536
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Function definition for common utilities
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def rolling_mean(y, window, center=False):
+    # Same as pandas rolling(window, center=center).mean(): NaN wherever the
+    # window is incomplete or holds a NaN
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    out = np.full(n, np.nan)
+    if n < window:
+        return out
+    is_nan = np.isnan(y)
+    sums = np.concatenate(([0.], np.cumsum(np.where(is_nan, 0., y))))
+    nans = np.concatenate(([0], np.cumsum(is_nan)))
+    means = (sums[window:] - sums[:-window]) / window
+    means[(nans[window:] - nans[:-window]) > 0] = np.nan
+    # The mean of y[k:k+window] is labelled at its last sample, or at its
+    # middle (rounding up) when centered
+    start = window // 2 if center else window - 1
+    out[start:start + len(means)] = means
+    return out
+
+
+def zscore_mask(y, threshold=3):
+    # Samples within threshold standard deviations of the mean, as scipy's
+    # zscore (ddof=0). For 2D input every column must pass, row by row.
+    y = np.asarray(y, dtype=np.float64)
+    z = (y - y.mean(axis=0)) / y.std(axis=0)
+    keep = np.abs(z) < threshold
+    return keep.all(axis=1) if keep.ndim == 2 else keep
+
+
+def band_mask(y, low, high):
+    # Samples with low <= y <= high, as pandas between(); NaN fails
+    y = np.asarray(y)
+    return (y >= low) & (y <= high)
+
+
+def delta_band_mask(y, low, high, order=1):
+    # Samples whose order-th difference from the previous samples lies in the
+    # band. The first order samples have no difference and fail, as with
+    # pandas diff() followed by between().
+    delta = np.full(len(y), np.nan)
+    delta[order:] = np.diff(np.asarray(y, dtype=np.float64), n=order)
+    return band_mask(delta, low, high)
+
+
+def smooth_deviation_mask(y, window=10, threshold=5, center=True):
+    # Samples within threshold of the rolling mean. Samples at the ends, where
+    # the window is incomplete, are kept.
+    deviation = np.abs(np.asarray(y, dtype=np.float64) - rolling_mean(y, window, center))
+    return ~(deviation > threshold)
+
+
+def hampel_mask(y, window=7, n_sigma=3, min_sigma=0.):
+    # Hampel filter: samples within n_sigma scaled MADs of the median of the
+    # window centered on them (window is odd, the ends repeat the edge samples).
+    # min_sigma floors the MAD so flat, quantized stretches of a scale trace
+    # do not flag every single-count step.
+    y = np.asarray(y, dtype=np.float64)
+    half = window // 2
+    padded = np.pad(y, half, mode='edge')
+    windows = sliding_window_view(padded, 2 * half + 1)
+    keep = np.empty(len(y), dtype=bool)
+    for start in range(0, len(y), CHUNK_ROWS):
+        block = windows[start:start + CHUNK_ROWS]
+        median = np.median(block, axis=1)
+        sigma = MAD_SCALE * np.median(np.abs(block - median[:, None]), axis=1)
+        np.maximum(sigma, min_sigma, out=sigma)
+        keep[start:start + len(block)] = np.abs(y[start:start + len(block)] - median) <= n_sigma * sigma
+    return keep
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Benchmark against the pandas/scipy filters
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def _timed(func, *args, repeat=3):
+    # Result and best time of repeat calls, so first-call costs do not count
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.time()
+        result = func(*args)
+        best = min(best, time.time() - t0)
+    return result, best
+
+
+def benchmark(n_samples=1000000):
+    import pandas as pd
+    from scipy import stats
+
+    # Scale trace at 10 Hz: a ramp with 0.01 g quantization and 0.1% spikes
+    t = np.arange(n_samples) * 0.1
+    mass = np.round(np.clip(t - 100, 0, 350) + np.random.normal(0, 0.02, n_samples), 2)
+    spikes = np.random.choice(n_samples, n_samples // 1000, replace=False)
+    mass[spikes] += np.random.uniform(20, 60, len(spikes)) * np.random.choice([-1, 1], len(spikes))
+    df = pd.DataFrame({'time': t, 'mass': mass})
+
+    def coffee_bloom(df):
+        # Postprocess_Automated_UBTS_CoffeeBloom
+        smoothened = df['mass'].rolling(10, center=True).mean()
+        outlier_idx = np.abs(df['mass'] - smoothened) > 5
+        within_threshold = [not elem for elem in outlier_idx]
+        return df[within_threshold]
+
+    def doe_zscore(df):
+        # POSTPROCESS_PumpFlowRate
+        return df[(np.abs(stats.zscore(df)) < 3).all(axis=1)]
+
+    def doe_band(df):
+        # POSTPROCESS_DOEv4
+        delta2 = df.mass.diff().diff()
+        return df[delta2.between(-0.2, 0.2)]
+
+    def hampel_pandas(df):
+        rolling = df['mass'].rolling(7, center=True, min_periods=1)
+        median = rolling.median()
+        mad = rolling.apply(lambda w: np.median(np.abs(w - np.median(w))), raw=True)
+        return df[np.abs(df['mass'] - median) <= 3 * MAD_SCALE * mad]
+
+    cases = [('Rolling mean deviation', coffee_bloom, lambda df: smooth_deviation_mask(df['mass'], 10, 5)),
+             ('Z-score', doe_zscore, lambda df: zscore_mask(df.to_numpy(), 3)),
+             ('Delta band', doe_band, lambda df: delta_band_mask(df['mass'], -0.2, 0.2, order=2)),
+             ('Hampel', hampel_pandas, lambda df: hampel_mask(df['mass'], 7, 3))]
+    print('Samples: %d' % n_samples)
+    for name, old, new in cases:
+        # The pandas Hampel runs a Python function per window, so only a slice
+        # of it is timed. Its windows shrink at the ends where ours repeat the
+        # edge samples, so the ends are left out of the comparison.
+        sample, edge = (df.iloc[:n_samples // 20], 3) if name == 'Hampel' else (df, 0)
+        scale = len(df) / len(sample)
+        kept_old, t_old = _timed(old, sample, repeat=1 if name == 'Hampel' else 3)
+        _, t_new = _timed(lambda: df[new(df)])
+        old_mask = sample.index.isin(kept_old.index)
+        new_mask = new(sample)
+        same = np.array_equal(old_mask[edge:len(sample) - edge], new_mask[edge:len(sample) - edge])
+        print('%-24s pandas/scipy %7.3f s, masks %7.3f s (%5.1fx), same rows kept: %s'
+              % (name, t_old * scale, t_new, t_old * scale / t_new, same))
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Manifest of processed inputs kept in a Results directory.
+Each entry records the size, mtime and content hash of the files a cycle was
+derived from together with the derived results, so unchanged cycles can be
+skipped on the next run.
+"""
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = 'manifest.json'
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Function definition for common utilities
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def file_hash(path, chunk_size=1 << 20):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as fobj:
+        for chunk in iter(lambda: fobj.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': file_hash(path)}
+
+
+def signature_matches(path, signature):
+    # Size and mtime are enough when they agree, the hash is only read when the
+    # file was touched, so copying a campaign folder does not force a rerun
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    if stat.st_size != signature['size']:
+        return False
+    if stat.st_mtime == signature['mtime']:
+        return True
+    if file_hash(path) != signature['hash']:
+        return False
+    signature['mtime'] = stat.st_mtime
+    return True
+
+
+class Manifest:
+
+    def __init__(self, results_dir):
+        self.path = os.path.join(results_dir, MANIFEST_NAME)
+        self.shared = {}
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as fobj:
+                    saved = json.load(fobj)
+                self.shared = saved['shared']
+                self.entries = saved['entries']
+            except (ValueError, KeyError):
+                print('Ignoring unreadable manifest: ' + self.path)
+
+    def check_shared(self, path):
+        # Inputs every cycle depends on (e.g. the test plan). If one changed,
+        # every cached cycle is stale.
+        name = os.path.basename(path)
+        if name in self.shared and signature_matches(path, self.shared[name]):
+            return True
+        if self.entries:
+            print('Input changed, reprocessing all cycles: ' + name)
+        self.entries = {}
+        self.shared[name] = file_signature(path)
+        return False
+
+    def is_current(self, key, paths, outputs=()):
+        # True if key was derived from exactly the files in paths, none of them
+        # changed on disk, and every file in outputs (e.g. its figures) exists
+        entry = self.entries.get(str(key))
+        if entry is None or set(entry['inputs']) != {os.path.basename(path) for path in paths}:
+            return False
+        if not all(os.path.exists(path) for path in outputs):
+            return False
+        return all(signature_matches(path, entry['inputs'][os.path.basename(path)]) for path in paths)
+
+    def results(self, key):
+        return self.entries[str(key)]['results']
+
+    def update(self, key, paths, results):
+        self.entries[str(key)] = {
+            'inputs': {os.path.basename(path): file_signature(path) for path in paths},
+            'results': results,
+        }
+
+    def save(self):
+        # Write to a temporary file first so an interrupted run keeps the old manifest
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fobj:
+            json.dump({'shared': self.shared, 'entries': self.entries}, fobj, indent=1)
+        os.replace(tmp_path, self.path)
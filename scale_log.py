@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk reader for TeraTerm scale logs.
+Parses a whole log with one compiled pattern over a memory-mapped buffer and
+returns columnar time/mass arrays plus the lines that could not be parsed.
+Also unwraps clock rollovers in the timestamps.
+Run this file directly to check and benchmark it against the per-token loop.
+"""
+import mmap
+import os
+import re
+import tempfile
+import time
+
+import numpy as np
+
+# One alternation per line: either a "[... HH:MM:SS.mmm] <mass>" reading or the
+# raw text of a line that could not be parsed. Hours are only read together with
+# minutes, so "[MM:SS.s]" stamps are minutes and seconds and seconds-only stamps
+# are still read. The mass may follow a status prefix such as "ST,GS,+   ",
+# with its sign ahead of the padding. The rest of the line is only captured
+# when it holds more digits, for the further readings on it.
+LOG_LINE = re.compile(
+    rb'^(?:\[(?:[^\]\n]*[ T])?(?:(?:(\d{1,2}):)?(\d{1,2}):)?(\d{1,2}(?:\.\d+)?)\]'
+    rb'[^\n\d+\-.]*([-+]?)[ \t]*(\d*\.?\d+)(?:[^\n\d]*|([^\n]*))'
+    rb'|([^\n]*))$',
+    re.MULTILINE)
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Function definition for common utilities
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def _to_float(column):
+    # Convert a column of byte strings to floats, empty fields read as zero
+    column = np.array(column)
+    return np.where(column == b'', b'0', column).astype(np.float64)
+
+
+def is_float(element) -> bool:
+    try:
+        float(element)
+        return True
+    except ValueError:
+        return False
+
+
+def read_scale_log(filename):
+    # Returns the clock time of each reading in seconds since midnight, the mass
+    # of each reading, and a list of (line number, text) for unparsed lines.
+    # Every number token on a reading line is a reading, at the line's time.
+    if os.path.getsize(filename) == 0:
+        return np.array([]), np.array([]), []
+
+    with open(filename, 'rb') as fobj:
+        with mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            rows = LOG_LINE.findall(buf)
+
+    hours, minutes, seconds, sign, mass, rest, text = zip(*rows)
+    mass = np.array(mass)
+    text = np.array(text)
+    is_reading = mass != b''
+
+    m_time = (_to_float(hours)[is_reading] * 3600
+              + _to_float(minutes)[is_reading] * 60
+              + _to_float(seconds)[is_reading])
+    mass = np.char.add(np.array(sign)[is_reading], mass[is_reading]).astype(np.float64)
+
+    # Lines with more than one reading are rare, they are expanded in place
+    rest = np.array(rest)[is_reading]
+    more = np.flatnonzero(rest != b'')
+    if len(more):
+        extra = [[float(token) for token in re.split(rb'[\t, \]]', rest[k]) if is_float(token)] for k in more]
+        counts = np.ones(len(mass), dtype=np.int64)
+        counts[more] += [len(values) for values in extra]
+        first = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        m_time = np.repeat(m_time, counts)
+        expanded = np.repeat(mass, counts)
+        for k, values in zip(more, extra):
+            expanded[first[k] + 1:first[k] + 1 + len(values)] = values
+        mass = expanded
+
+    # Blank lines are not failures, anything else without a reading is
+    failed_idx = np.flatnonzero(~is_reading & (np.char.strip(text) != b''))
+    bad_lines = [(int(idx) + 1, text[idx].decode('utf-8', 'replace').strip()) for idx in failed_idx]
+
+    return m_time, mass, bad_lines
+
+
+def unwrap_clock(m_time, periods=(60, 3600, 86400)):
+    # Undo clock rollovers in a series of timestamps. A backwards step is a
+    # rollover of a period when the stamp before it is within half the
+    # shortest period of the period's end and the stamp after it as close to
+    # 0, and that period is added to every later sample, so seconds, minute
+    # and midnight wraps are all handled in one cumulative pass. Any other
+    # backwards step is kept as it is; returns the unwrapped times and a list
+    # of (sample index, step) for those steps.
+    m_time = np.asarray(m_time, dtype=np.float64)
+    if m_time.size < 2:
+        return m_time.copy(), []
+
+    tolerance = min(periods) / 2
+    step = np.diff(m_time)
+    # backwards steps are rare, only they are tested against the periods
+    back = np.flatnonzero(step < 0)
+    before, after = m_time[back], m_time[back + 1]
+    back_wrap = np.zeros(len(back))
+    for period in sorted(periods):
+        # a stamp rounded up to the period itself, e.g. 23:59:60.000, still counts
+        is_wrap = ((back_wrap == 0)
+                   & (before >= period - tolerance) & (before <= period)
+                   & (after >= 0) & (after <= tolerance)
+                   & (after + period - before <= tolerance))
+        back_wrap[is_wrap] = period
+
+    kept = back[back_wrap == 0]
+    bad_steps = [(int(idx) + 1, float(step[idx])) for idx in kept]
+
+    wrap = np.zeros_like(step)
+    wrap[back] = back_wrap
+    offset = np.empty_like(m_time)
+    offset[0] = 0
+    np.cumsum(wrap, out=offset[1:])
+    return m_time + offset, bad_steps
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Benchmark against the per-token loop
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def _read_scale_log_per_token(filename):
+    # The line-by-line loop previously used by DOEv4 and PumpFlowRate
+    mass = []
+    m_time = []
+    with open(filename) as fobj:
+        prev_time = 0
+        for line in fobj:
+            line_data = re.split('\t|\n|,| |]', line)
+            for j in range(len(line_data)):
+                if is_float(line_data[j]):
+                    try:
+                        prev_time = float(line_data[1][-6:])
+                    except:
+                        pass
+                    m_time.append(prev_time)
+                    mass.append(float(line_data[j]))
+    return m_time, mass
+
+
+def write_fake_log(filename, n_lines, dt=0.1):
+    # Scale log in the TeraTerm timestamped format, one reading per line
+    t = 10 * 3600 + np.arange(n_lines) * dt
+    mass = np.cumsum(np.random.normal(0.05, 0.02, n_lines))
+    with open(filename, 'w') as fobj:
+        for ti, mi in zip(t, mass):
+            hh, rem = divmod(ti, 3600)
+            mm, ss = divmod(rem, 60)
+            fobj.write('[2021-11-23 %02d:%02d:%06.3f]   %0.2f g\n' % (hh, mm, ss, mi))
+
+
+# Representative TeraTerm lines: plain and status-prefixed readings, a line
+# with two readings, a negative reading, CRLF endings, scale messages and blanks
+CHECK_LINES = ['[2021-11-23 10:00:01.250]   12.34 g',
+               '[2021-11-23 10:00:01.350] ST,GS,+   12.36 g',
+               '[2021-11-23 10:00:01.450] US,GS,+   12.41 g\r',
+               '[2021-11-23 10:00:01.550]   12.40 g   12.38',
+               '[2021-11-23 10:00:01.650] ST,GS,-    0.02 g',
+               '[2021-11-23 10:00:01.750]  -0.05 g',
+               '[2021-11-23 10:00:59.950]  150.00 g\r',
+               '[2021-11-23 10:01:00.050] ST,GS,+  150.01 g',
+               '[2021-11-23 10:01:00.150] Scale ready',
+               '']
+
+
+def _write_lines(lines):
+    # Temporary log file of the given lines
+    filename = os.path.join(tempfile.mkdtemp(), 'check_scale.log')
+    with open(filename, 'w', newline='') as fobj:
+        fobj.write('\n'.join(lines) + '\n')
+    return filename
+
+
+def _remove(filename):
+    os.remove(filename)
+    os.rmdir(os.path.dirname(filename))
+
+
+def check_per_token():
+    # Same readings as the per-token loop on CHECK_LINES. The loop kept only the
+    # seconds of the clock and lost the sign after a status prefix, e.g.
+    # "ST,GS,-", so times are compared modulo a minute and such masses by magnitude.
+    filename = _write_lines(CHECK_LINES)
+    old_time, old_mass = _read_scale_log_per_token(filename)
+    m_time, mass, bad_lines = read_scale_log(filename)
+    _remove(filename)
+
+    same = (len(mass) == len(old_mass)
+            and np.allclose(np.mod(m_time, 60), old_time)
+            and np.all(np.isclose(mass, old_mass) | np.isclose(np.abs(mass), old_mass)))
+    print('Readings: %d (per-token loop %d), same readings: %s, unparsed lines: %d'
+          % (len(mass), len(old_mass), same, len(bad_lines)))
+
+    # Minute:second stamps and a status prefix without a date
+    filename = _write_lines(['[05:30.5]   12.50 g', '[10:00:01.250] ST,GS,+   12.34 g'])
+    m_time, mass, _ = read_scale_log(filename)
+    _remove(filename)
+    print('[05:30.5] read as %0.1f s, [10:00:01.250] ST,GS,+ as %0.2f s %0.2f g'
+          % (m_time[0], m_time[1], mass[1]))
+    return same
+
+
+def benchmark(n_lines=200000):
+    filename = os.path.join(tempfile.mkdtemp(), 'bench_scale.log')
+    write_fake_log(filename, n_lines)
+
+    t0 = time.time()
+    _read_scale_log_per_token(filename)
+    t_loop = time.time() - t0
+
+    t0 = time.time()
+    m_time, mass, bad_lines = read_scale_log(filename)
+    t_bulk = time.time() - t0
+
+    print('Lines: %d, readings: %d, failed: %d' % (n_lines, len(mass), len(bad_lines)))
+    print('Per-token loop took %0.3f s' % t_loop)
+    print('Bulk parser took %0.3f s (%0.1fx)' % (t_bulk, t_loop / t_bulk))
+    os.remove(filename)
+
+    # Seconds-only timestamps for a million samples at 10 Hz
+    wrapped = np.mod(np.arange(1000000) * 0.1, 60)
+    t0 = time.time()
+    unwrapped, bad_steps = unwrap_clock(wrapped)
+    print('Unwrapped %d timestamps in %0.1f ms, increasing: %s, other backwards steps: %d'
+          % (len(wrapped), (time.time() - t0) * 1000, bool(np.all(np.diff(unwrapped) > 0)), len(bad_steps)))
+
+
+if __name__ == "__main__":
+    check_per_token()
+    benchmark()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental reader for the RoboScale continuous print stream.
+Bytes are fed in as they come off the serial port. Only complete "\r\n"
+frames are parsed and the partial tail is carried over to the next call, so
+every reading is kept and each call only costs the bytes it was given.
+"""
+import re
+from time import time
+
+# Mass of one frame, e.g. "   123.4 g  ?" where "?" marks an unstable reading
+FRAME_MASS = re.compile(rb'(-?)\s*(\d*\.?\d+)')
+FRAME_END = b'\r\n'
+
+
+class ScaleFrameReader:
+
+    def __init__(self, max_frame=64):
+        # A carry-over longer than max_frame bytes has lost its terminator
+        self.max_frame = max_frame
+        self.carry = b''
+        self.carry_time = None
+        self.frames = 0
+        self.dropped = 0
+        self.latency_total = 0.
+        self.latency_max = 0.
+
+    def reset(self):
+        # Forget any partial frame, the counters are kept
+        self.carry = b''
+        self.carry_time = None
+
+    def feed(self, chunk, ts=None):
+        # Returns [(ts, mass, is_not_stable), ...] for every frame completed by
+        # chunk. ts is when chunk was read; a frame's latency is the time from
+        # its first byte being read to its terminator being read.
+        if ts is None:
+            ts = time()
+        if not chunk:
+            return []
+
+        data = self.carry + chunk
+        first_time = self.carry_time if self.carry else ts
+        frames = data.split(FRAME_END)
+        self.carry = frames.pop()
+        # The tail started in this chunk unless no frame was completed
+        self.carry_time = ts if frames else first_time
+
+        readings = []
+        for frame in frames:
+            if not frame.strip():
+                continue
+            match = FRAME_MASS.search(frame)
+            if match is None:
+                self.dropped += 1
+                continue
+            mass = float(match.group(2))
+            if match.group(1):
+                mass = -mass
+            readings.append((ts, mass, b'?' in frame))
+
+            latency = ts - first_time
+            self.frames += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            # Frames after the first started in this chunk
+            first_time = ts
+
+        if len(self.carry) > self.max_frame:
+            self.dropped += 1
+            self.reset()
+        return readings
+
+    def stats(self):
+        latency_mean = self.latency_total / self.frames if self.frames else 0.
+        return {'frames': self.frames, 'dropped': self.dropped,
+                'latency_mean': latency_mean, 'latency_max': self.latency_max}
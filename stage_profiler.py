@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight per-stage instrumentation for the postprocessing scripts.
+Stages (parse, filter, detect, plot, write, ...) are timed with a context
+manager or decorator, per test while a test is open. Wall time and
+call counts are always collected. The tracemalloc peak is collected too when
+memory tracing is on, since tracing slows down allocation-heavy code. Set
+STAGE_PROFILE_MEMORY=1 in the environment to turn it on. The summary is
+printed as a table and can be written as JSON.
+"""
+import contextlib
+import functools
+import json
+import os
+import time
+import tracemalloc
+
+
+class StageProfiler:
+
+    def __init__(self, trace_memory=None):
+        if trace_memory is None:
+            trace_memory = os.environ.get('STAGE_PROFILE_MEMORY', '') == '1'
+        self.trace_memory = trace_memory
+        # (stage, test) -> {'calls', 'wall', 'peak'}
+        self.records = {}
+        # [memory at entry, highest peak seen inside] of every open stage
+        self.open_stages = []
+        # test number stages are recorded under when none is given
+        self.current_test = None
+        self.t0 = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def reset(self):
+        # Start a new run, e.g. at the top of a script's main()
+        self.records = {}
+        self.current_test = None
+        self.t0 = time.perf_counter()
+
+    @contextlib.contextmanager
+    def test(self, number):
+        # Stages opened inside, including decorated functions, belong to test number
+        previous = self.current_test
+        self.current_test = number
+        try:
+            yield
+        finally:
+            self.current_test = previous
+
+    @contextlib.contextmanager
+    def stage(self, name, test=None):
+        if test is None:
+            test = self.current_test
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # Keep the enclosing stage's peak before it is reset for this one
+            if self.open_stages:
+                self.open_stages[-1][1] = max(self.open_stages[-1][1], peak)
+            tracemalloc.reset_peak()
+            self.open_stages.append([current, 0])
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - t0
+            peak = 0
+            if self.trace_memory:
+                start, inner_peak = self.open_stages.pop()
+                peak = max(tracemalloc.get_traced_memory()[1], inner_peak)
+                if self.open_stages:
+                    self.open_stages[-1][1] = max(self.open_stages[-1][1], peak)
+                peak -= start
+            self.add(name, test, 1, wall, peak)
+
+    def profile(self, name):
+        # Decorator form of stage(), recorded under the current test
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add(self, name, test, calls, wall, peak):
+        record = self.records.setdefault((name, test), {'calls': 0, 'wall': 0., 'peak': 0})
+        record['calls'] += calls
+        record['wall'] += wall
+        record['peak'] = max(record['peak'], peak)
+
+    def export(self):
+        # Records as plain rows, e.g. to send back from a worker process
+        return [dict(stage=name, test=test, **record) for (name, test), record in self.records.items()]
+
+    def take(self, test):
+        # Rows of one test, which are forgotten here so a worker process sends
+        # them back once
+        keys = [key for key in self.records if key[1] == test]
+        return [dict(stage=name, test=test, **self.records.pop((name, test))) for name, _ in keys]
+
+    def merge(self, rows):
+        for row in rows:
+            self.add(row['stage'], row['test'], row['calls'], row['wall'], row['peak'])
+
+    def by_stage(self):
+        # Totals over every test, in order of first appearance
+        stages = {}
+        for (name, _), record in self.records.items():
+            total = stages.setdefault(name, {'calls': 0, 'wall': 0., 'peak': 0, 'tests': 0})
+            total['calls'] += record['calls']
+            total['wall'] += record['wall']
+            total['peak'] = max(total['peak'], record['peak'])
+            total['tests'] += 1
+        return stages
+
+    def summary(self):
+        run_time = time.perf_counter() - self.t0
+        print('\n%-12s %8s %10s %10s %7s %10s' % ('Stage', 'Calls', 'Total (s)', 'Mean (ms)', '% run', 'Peak (MB)'))
+        for name, total in self.by_stage().items():
+            peak = '%10.1f' % (total['peak'] / 2 ** 20) if self.trace_memory else '%10s' % 'n/a'
+            print('%-12s %8d %10.3f %10.2f %7.1f %s' % (name, total['calls'], total['wall'],
+                                                      1000 * total['wall'] / total['calls'],
+                                                      100 * total['wall'] / run_time, peak))
+        print('Run took %0.3f s' % run_time)
+
+    def write_json(self, filename):
+        with open(filename, 'w') as fobj:
+            json.dump({'run_time': time.perf_counter() - self.t0, 'trace_memory': self.trace_memory,
+                       'stages': self.by_stage(), 'tests': self.export()}, fobj, indent=1)
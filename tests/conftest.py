@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+The modules under test are plain scripts in the folder above.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
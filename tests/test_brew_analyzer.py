@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Online brew analysis against the offline drip detection.
+"""
+import numpy as np
+
+from brew_analyzer import OnlineBrewAnalyzer, RollingSum, check_offline
+
+
+def test_same_flow_as_detect_drip():
+    assert check_offline(n_traces=20)
+
+
+def test_rolling_sum_does_not_drift():
+    rolling = RollingSum(3)
+    for value in np.random.default_rng(0).uniform(0, 1000, 100000):
+        rolling.append(value)
+    rolling.append(0.1)
+    rolling.append(0.2)
+    rolling.append(0.3)
+    assert rolling.total == sum([0.1, 0.2, 0.3])
+    assert len(rolling) == 3
+
+
+def test_no_flow():
+    analyzer = OnlineBrewAnalyzer()
+    for ts in np.arange(0, 60, 0.1):
+        analyzer.add_mass(ts, 5.)
+    result = analyzer.results()
+    assert result['flow_start_time'] is None
+    assert analyzer.mean() == 5.
+
+
+def test_drip_mass_as_offline_probe():
+    # CoffeeBloom takes the sample nearest bloom time + 5 s, averaged with the one before
+    from time_index import nearest_index
+
+    rng = np.random.default_rng(1)
+    t = np.cumsum(rng.uniform(0.08, 0.12, 600))
+    mass = np.round(np.clip((t - t[0] - 10) * 2, 0, 100), 1)
+    analyzer = OnlineBrewAnalyzer(bloom_time=20)
+    for ts, m in zip(t, mass):
+        analyzer.add_mass(ts, m)
+    k = nearest_index(t - t[0], 25)
+    result = analyzer.results()
+    assert result['drip_mass'] == mass[k] - mass[0]
+    assert result['drip_avg_mass'] == (mass[k - 1] + mass[k]) / 2 - mass[0]
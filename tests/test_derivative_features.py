@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Requested derivative features against the whole-frame diffs.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from derivative_features import _features_whole_frame, derivative_features, split_feature
+
+
+@pytest.fixture
+def df():
+    # Scale log timestamps: 0.2 s nominal with jitter and the odd dropped line
+    rng = np.random.default_rng(0)
+    n_samples = 5000
+    t = np.cumsum(rng.choice([0.2, 0.2, 0.2, 0.4], n_samples) + rng.normal(0, 0.01, n_samples))
+    mass = np.clip(t - 60, 0, 150) + rng.normal(0, 0.02, n_samples)
+    df = pd.DataFrame({'Time': t, 'Mass': mass})
+    df['Smooth_Mass'] = df.Mass.rolling(8).mean()
+    return df
+
+
+def test_same_as_whole_frame_diffs(df):
+    old = _features_whole_frame(df.copy())
+    features = ['Mass_Diff', 'Mass_Delta', 'Mass_Delta2', 'Mass_Diff_Delta', 'Mass_Diff_Delta2',
+                'Smooth_Mass_Diff', 'Smooth_Mass_Diff_Delta2']
+    new = derivative_features(df.Time, {'Mass': df.Mass, 'Smooth_Mass': df.Smooth_Mass}, features)
+    for name in features:
+        assert np.allclose(old[name], new[name], equal_nan=True), name
+
+
+def test_delta2_without_delta(df):
+    both = derivative_features(df.Time, {'Mass': df.Mass}, ['Mass_Delta', 'Mass_Delta2'])
+    alone = derivative_features(df.Time, {'Mass': df.Mass}, ['Mass_Delta2'])
+    assert np.allclose(both['Mass_Delta2'], alone['Mass_Delta2'], equal_nan=True)
+
+
+def test_gradient_on_uneven_times(df):
+    # The whole-frame gradient assumed a constant step, this one uses the sample times
+    gradient = derivative_features(df.Time, {'Mass': df.Mass}, ['Mass_Gradient'])['Mass_Gradient']
+    assert np.allclose(gradient, np.gradient(df.Mass.to_numpy(), df.Time.to_numpy()))
+    exact = derivative_features(df.Time, {'Mass': df.Time * 2}, ['Mass_Gradient'])['Mass_Gradient']
+    assert np.allclose(exact, 2)
+
+
+def test_feature_names():
+    assert split_feature('Mass_Gradient_Delta') == ('Mass_Gradient', 'Delta')
+    assert split_feature('Mass_Delta2') == ('Mass', 'Delta2')
+    assert split_feature('Mass') == ('Mass', None)
+    with pytest.raises(KeyError):
+        derivative_features([0., 1.], {'Mass': [0., 1.]}, ['Temp_Diff'])
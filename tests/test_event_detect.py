@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized drip detection against the list comprehension search.
+"""
+import numpy as np
+import pytest
+
+from event_detect import _detect_drip_listcomp, detect_drip, find_events
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_same_events_as_list_comprehensions(seed):
+    rng = np.random.default_rng(seed)
+    n_samples = 5000
+    t = np.arange(n_samples) * 0.1
+    start = rng.uniform(5, 20)
+    brew_mass = np.clip((t - start) * 0.5, 0, 10) + rng.normal(0, 0.001, n_samples)
+    brew_mass_theory = np.clip((t - start + 0.5) * 0.5, 0, 10)
+    assert detect_drip(t, brew_mass, brew_mass_theory) == _detect_drip_listcomp(t, brew_mass, brew_mass_theory)
+
+
+def test_no_flow():
+    t = np.arange(500) * 0.1
+    flat = np.zeros(500)
+    assert detect_drip(t, flat, flat) == (None, None, None, None)
+
+
+def test_events_before_t_min_are_ignored():
+    t = np.arange(10.)
+    signal = np.array([0, 1, 1, 0, 0, 1, 1, 1, 0, 0.])
+    starts, ends = find_events(t, signal, on=0.5, off=0, t_min=4)
+    assert list(starts) == [5]
+    assert list(ends) == [8]
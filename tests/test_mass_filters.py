@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Mask filters against the pandas/scipy filters they replaced.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from mass_filters import MAD_SCALE, delta_band_mask, hampel_mask, smooth_deviation_mask, zscore_mask
+
+
+@pytest.fixture
+def df():
+    # Scale trace at 10 Hz: a ramp with 0.01 g quantization and 1% spikes
+    rng = np.random.default_rng(0)
+    n_samples = 20000
+    t = np.arange(n_samples) * 0.1
+    mass = np.round(np.clip(t - 100, 0, 350) + rng.normal(0, 0.02, n_samples), 2)
+    spikes = rng.choice(n_samples, n_samples // 100, replace=False)
+    mass[spikes] += rng.uniform(20, 60, len(spikes)) * rng.choice([-1, 1], len(spikes))
+    return pd.DataFrame({'time': t, 'mass': mass})
+
+
+def test_smooth_deviation_mask(df):
+    # Postprocess_Automated_UBTS_CoffeeBloom
+    smoothened = df['mass'].rolling(10, center=True).mean()
+    old = ~(np.abs(df['mass'] - smoothened) > 5)
+    assert np.array_equal(old.to_numpy(), smooth_deviation_mask(df['mass'], 10, 5))
+
+
+def test_zscore_mask(df):
+    # POSTPROCESS_PumpFlowRate
+    old = (np.abs(stats.zscore(df)) < 3).all(axis=1)
+    assert np.array_equal(np.asarray(old), zscore_mask(df.to_numpy(), 3))
+
+
+def test_delta_band_mask(df):
+    # POSTPROCESS_DOEv4
+    old = df.mass.diff().diff().between(-0.2, 0.2)
+    assert np.array_equal(old.to_numpy(), delta_band_mask(df['mass'], -0.2, 0.2, order=2))
+
+
+def test_hampel_mask(df):
+    # The pandas windows shrink at the ends where ours repeat the edge
+    # samples, so the ends are left out
+    sample = df.iloc[:2000]
+    rolling = sample['mass'].rolling(7, center=True, min_periods=1)
+    median = rolling.median()
+    mad = rolling.apply(lambda w: np.median(np.abs(w - np.median(w))), raw=True)
+    old = (np.abs(sample['mass'] - median) <= 3 * MAD_SCALE * mad).to_numpy()
+    new = hampel_mask(sample['mass'], 7, 3)
+    assert np.array_equal(old[3:-3], new[3:-3])
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk scale log reader and clock unwrapping against the per-token loop.
+"""
+import numpy as np
+
+from scale_log import (CHECK_LINES, _read_scale_log_per_token, _remove, _write_lines, read_scale_log,
+                       unwrap_clock, write_fake_log)
+
+
+def test_same_readings_as_per_token_loop():
+    # The loop only kept the seconds of the clock and lost the sign after a
+    # status prefix, so times are compared modulo a minute and masses by magnitude
+    filename = _write_lines(CHECK_LINES)
+    try:
+        old_time, old_mass = _read_scale_log_per_token(filename)
+        m_time, mass, bad_lines = read_scale_log(filename)
+    finally:
+        _remove(filename)
+    assert len(mass) == len(old_mass)
+    assert np.allclose(np.mod(m_time, 60), old_time)
+    assert np.all(np.isclose(mass, old_mass) | np.isclose(np.abs(mass), old_mass))
+    assert bad_lines == [(9, '[2021-11-23 10:01:00.150] Scale ready')]
+
+
+def test_signed_readings():
+    filename = _write_lines(CHECK_LINES)
+    try:
+        _, mass, _ = read_scale_log(filename)
+    finally:
+        _remove(filename)
+    assert mass[5] == -0.02
+    assert mass[6] == -0.05
+
+
+def test_minute_second_stamps():
+    filename = _write_lines(['[05:30.5]   12.50 g', '[10:00:01.250] ST,GS,+   12.34 g'])
+    try:
+        m_time, mass, _ = read_scale_log(filename)
+    finally:
+        _remove(filename)
+    assert np.allclose(m_time, [330.5, 36001.25])
+    assert np.allclose(mass, [12.5, 12.34])
+
+
+def test_fake_log_matches_per_token_loop(tmp_path):
+    filename = str(tmp_path / 'fake.log')
+    write_fake_log(filename, 2000)
+    old_time, old_mass = _read_scale_log_per_token(filename)
+    m_time, mass, bad_lines = read_scale_log(filename)
+    assert np.allclose(mass, old_mass)
+    assert np.allclose(np.mod(m_time, 60), np.mod(old_time, 60))
+    assert bad_lines == []
+
+
+def test_empty_log(tmp_path):
+    filename = tmp_path / 'empty.log'
+    filename.write_text('')
+    m_time, mass, bad_lines = read_scale_log(str(filename))
+    assert len(m_time) == len(mass) == 0
+    assert bad_lines == []
+
+
+def test_unwrap_rollovers():
+    # seconds, with a dropped sample at the wrap, minutes and midnight
+    for stamps, expected in [([58, 59.5, 0.5, 2], [58, 59.5, 60.5, 62]),
+                             ([57, 2, 3], [57, 62, 63]),
+                             ([3599.8, 0.1], [3599.8, 3600.1]),
+                             ([86399.5, 0.2, 1], [86399.5, 86400.2, 86401]),
+                             ([86400, 0.2], [86400, 86400.2])]:
+        unwrapped, bad_steps = unwrap_clock(stamps)
+        assert np.allclose(unwrapped, expected)
+        assert bad_steps == []
+
+
+def test_unwrap_keeps_other_backwards_steps():
+    unwrapped, bad_steps = unwrap_clock([36000, 36010, 35950, 35960])
+    assert np.allclose(unwrapped, [36000, 36010, 35950, 35960])
+    assert bad_steps == [(2, -60.0)]
+    unwrapped, bad_steps = unwrap_clock([50, 40, 45])
+    assert np.allclose(unwrapped, [50, 40, 45])
+    assert bad_steps == [(1, -10.0)]
+
+
+def test_unwrap_long_seconds_clock():
+    wrapped = np.mod(np.arange(100000) * 0.1, 60)
+    unwrapped, bad_steps = unwrap_clock(wrapped)
+    assert np.allclose(unwrapped, np.arange(100000) * 0.1)
+    assert bad_steps == []
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Plateau step detection against the sort-based DOEv4 search.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from derivative_features import derivative_features
+from mass_filters import band_mask
+from step_detector import _detect_step_sorted, detect_step, plateau_levels, plateau_runs, stable_mask
+
+
+def scale_trace(n_samples, seed):
+    # A 0.01 g scale at 5 Hz: the settled cup, a 200 g pour and the settled
+    # brew, with a 2 g knock on the table every 1000 s
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_samples) * 0.2
+    pour = t[n_samples // 2] + 50
+    mass = np.clip(5 * (t - pour), 0, 200) + 2. * ((t % 1000) > 990)
+    return t, np.round(mass + rng.normal(0, 0.002, n_samples), 2)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_same_step_as_sorted_search(seed):
+    t, mass = scale_trace(20000, seed)
+    df_scale = pd.DataFrame({'Time': t, 'Mass': mass})
+    for name, values in derivative_features(t, {'Mass': mass}, ['Mass_Gradient', 'Mass_Diff']).items():
+        df_scale[name] = values
+    initial_old, final_old = _detect_step_sorted(df_scale)
+
+    stable = (band_mask(df_scale['Mass_Gradient'], -0.01, 0.01)
+              & band_mask(df_scale['Mass_Diff'], -0.01, 0.01))
+    result = detect_step(mass, stable)
+    assert (result['initial_mass'], result['final_mass']) == (initial_old, final_old)
+    assert result['confidence'] > 0.9
+
+
+def test_two_equal_pours_lower_the_confidence():
+    t, mass = scale_trace(20000, 0)
+    mass[t > t[-1] - 500] += 200
+    result = detect_step(mass, stable_mask(t, mass))
+    assert result['confidence'] < 0.1
+
+
+def test_too_few_stable_samples():
+    assert detect_step(np.arange(5.), np.zeros(5, dtype=bool)) is None
+
+
+def test_plateau_levels():
+    stable = np.array([1, 1, 0, 1, 1, 1, 0], dtype=bool)
+    mass = np.array([1., 3., 9., 5., 5., 5., 9.])
+    starts, ends = plateau_runs(stable)
+    assert list(starts) == [0, 3]
+    assert list(ends) == [2, 6]
+    levels, noise = plateau_levels(mass, starts, ends)
+    assert np.allclose(levels, [2., 5.])
+    assert np.allclose(noise, [1., 0.])
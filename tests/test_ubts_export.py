@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Segmented UBTS export reader against the object-dtype path.
+"""
+import numpy as np
+import pandas as pd
+
+from campaign_gen import write_ubts_export
+from ubts_export import UBTS_COLUMNS, _read_ubts_export_object, read_ubts_export, read_ubts_segments
+
+
+def test_same_values_as_object_dtype_read(tmp_path):
+    filename = str(tmp_path / 'Cycle01.txt')
+    write_ubts_export(filename, 2000, seed=0, repeat_header_every=500)
+    old = _read_ubts_export_object(filename)
+    segments, metadata = read_ubts_segments(filename)
+    assert metadata['segments'] == 4
+    assert [len(segment) for segment in segments] == [500] * 4
+    assert np.array_equal(old.to_numpy(), pd.concat(segments).to_numpy(), equal_nan=True)
+
+
+def test_segments_joined(tmp_path):
+    filename = str(tmp_path / 'Cycle01.txt')
+    write_ubts_export(filename, 1000, seed=0, repeat_header_every=300)
+    data, metadata = read_ubts_export(filename)
+    assert len(data) == 1000
+    assert np.all(np.diff(data['Sample Time (s)']) > 0)
+    assert metadata['brew_code'] == 'Pulse'
+
+
+def test_column_names_are_unique(tmp_path):
+    assert len(set(UBTS_COLUMNS)) == len(UBTS_COLUMNS)
+    filename = str(tmp_path / 'Cycle01.txt')
+    write_ubts_export(filename, 100, brew_code='EUROPA', seed=0)
+    data, metadata = read_ubts_export(filename)
+    assert list(data.columns) == UBTS_COLUMNS
+    assert metadata['brew_code'] == 'Europa'
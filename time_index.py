@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+Nearest-sample lookup on sorted time arrays.
+Uses a binary search, so each probe time costs O(log n) instead of a full
+scan or sort of the trace.
+"""
+import numpy as np
+
+
+def nearest_index(times, queries):
+    # Position of the sample in times (sorted ascending) closest to each query
+    # time. Ties go to the earlier sample. A scalar query returns an int, an
+    # array of queries returns an array of positions. Raises ValueError when
+    # times is empty, as there is no nearest sample.
+    times = np.asarray(times)
+    if len(times) == 0:
+        raise ValueError('nearest_index needs at least one sample time')
+    queries = np.asarray(queries, dtype=float)
+    right = np.searchsorted(times, queries)
+    right = np.clip(right, 1, len(times) - 1)
+    left = right - 1
+    use_left = np.abs(queries - times[left]) <= np.abs(times[right] - queries)
+    idx = np.where(use_left, left, right)
+    if len(times) == 1:
+        idx = np.zeros_like(idx)
+    if idx.ndim == 0:
+        return int(idx)
+    return idx
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Compact store for the per-test traces of a campaign.
+All tests share one contiguous float32 buffer (one row per channel) and an
+offset index keyed by test number, so a channel of a test is an O(1) view.
+"""
+import numpy as np
+
+
+def duplicate_names(names):
+    seen = set()
+    return [name for name in names if name in seen or seen.add(name)]
+
+
+class TraceStore:
+
+    def __init__(self, channels, capacity=1 << 16):
+        self.channels = list(channels)
+        duplicates = duplicate_names(self.channels)
+        if duplicates:
+            raise ValueError('Duplicate channel names: ' + ', '.join(duplicates))
+        self.channel_index = {name: k for k, name in enumerate(self.channels)}
+        self.buffer = np.full((len(self.channels), capacity), np.nan, dtype=np.float32)
+        # test number -> (start, stop) in the buffer
+        self.offsets = {}
+        self.size = 0
+
+    def __contains__(self, test):
+        return test in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def tests(self):
+        return sorted(self.offsets)
+
+    def _reserve(self, n):
+        # Grow by doubling so adding a test is amortized O(samples)
+        capacity = self.buffer.shape[1]
+        if self.size + n <= capacity:
+            return
+        while capacity < self.size + n:
+            capacity *= 2
+        buffer = np.full((len(self.channels), capacity), np.nan, dtype=np.float32)
+        buffer[:, :self.size] = self.buffer[:, :self.size]
+        self.buffer = buffer
+
+    def add(self, test, data):
+        # Append a test from a dataframe. Channels missing from data read as NaN
+        # and columns that are not channels of the store are ignored. A channel
+        # that appears more than once in data is ambiguous and rejected.
+        duplicates = [name for name in duplicate_names(data.columns) if name in self.channel_index]
+        if duplicates:
+            raise ValueError('Duplicate columns for test ' + str(test) + ': ' + ', '.join(duplicates))
+        n = len(data)
+        self._reserve(n)
+        start = self.size
+        for idx, name in enumerate(data.columns):
+            k = self.channel_index.get(name)
+            if k is not None:
+                self.buffer[k, start:start + n] = data.iloc[:, idx].to_numpy(dtype=np.float32)
+        self.size += n
+        self.offsets[test] = (start, self.size)
+
+    def get(self, test, channel):
+        # View of one channel of one test, no copy
+        start, stop = self.offsets[test]
+        return self.buffer[self.channel_index[channel], start:stop]
+
+    def nbytes(self):
+        return self.size * len(self.channels) * self.buffer.itemsize
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar on-disk cache for parsed UBTS exports.
+Each export is stored as one float32 .npy file per column next to a JSON
+sidecar holding the column names, the export metadata (notes, brew code,
+preamble fields) and the signature of the source file. Entries are keyed by
+the file name and a hash of its full path. Later runs memory-map the columns
+instead of re-reading the text, and a cache entry is rebuilt as soon as its
+source file, the cache format or the parser version changes. This pays off
+on long exports, where parsing the text dominates; run this file directly to
+benchmark it.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from results_manifest import file_signature, signature_matches
+
+META_NAME = 'meta.json'
+# Bumped whenever the cache layout changes
+CACHE_FORMAT = 2
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Function definition for common utilities
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def cache_path(cache_root, source):
+    # Exports of the same name in different folders get their own entries
+    path = os.path.normcase(os.path.abspath(source))
+    digest = hashlib.md5(path.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(cache_root, os.path.splitext(os.path.basename(source))[0] + '_' + digest)
+
+
+def write_meta(cache_dir, meta):
+    # Through a temporary file, so an interrupted write never leaves a half sidecar
+    meta_path = os.path.join(cache_dir, META_NAME)
+    with open(meta_path + '.tmp', 'w') as fobj:
+        json.dump(meta, fobj, indent=1)
+    os.replace(meta_path + '.tmp', meta_path)
+
+
+def read_cache(cache_dir, source, version=0):
+    # Returns (data, meta) for a valid cache entry written by this cache
+    # format and parser version, or (None, None)
+    meta_path = os.path.join(cache_dir, META_NAME)
+    if not os.path.exists(meta_path):
+        return None, None
+    try:
+        with open(meta_path) as fobj:
+            meta = json.load(fobj)
+    except ValueError:
+        return None, None
+    if meta.get('version') != [CACHE_FORMAT, version]:
+        return None, None
+    mtime = meta['source']['mtime']
+    if not signature_matches(source, meta['source']):
+        return None, None
+    if meta['source']['mtime'] != mtime:
+        # Same content with a new mtime, e.g. after a copy or a sync. Keep the
+        # new mtime so later runs do not hash the file again.
+        write_meta(cache_dir, meta)
+
+    columns = {idx: np.load(os.path.join(cache_dir, '%02d.npy' % idx), mmap_mode='r')
+               for idx in range(len(meta['columns']))}
+    # copy=False keeps each column backed by its memory map
+    data = pd.DataFrame(columns, copy=False)
+    data.columns = meta['columns']
+    return data, meta
+
+
+def write_cache(cache_dir, source, data, metadata, version=0):
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    for idx in range(data.shape[1]):
+        column = pd.to_numeric(data.iloc[:, idx], errors='coerce').to_numpy(dtype=np.float32)
+        np.save(os.path.join(cache_dir, '%02d.npy' % idx), column)
+    # The sidecar is written last, so a cache interrupted mid-write is never valid
+    write_meta(cache_dir, dict(metadata, source=file_signature(source), columns=list(data.columns),
+                               version=[CACHE_FORMAT, version]))
+
+
+def load_cached(source, cache_root, loader, version=0):
+    # Load a UBTS export through the cache. loader(source) is the text reader,
+    # returning (data, metadata), and is only called when the cache is missing
+    # or stale. version is the loader's parser version; entries written by
+    # another one are rebuilt. Returns the data and the metadata dict stored
+    # in the sidecar.
+    cache_dir = cache_path(cache_root, source)
+    data, meta = read_cache(cache_dir, source, version)
+    if data is not None:
+        return data, meta
+
+    data, metadata = loader(source)
+    if data.empty:
+        return data, metadata
+    write_cache(cache_dir, source, data, metadata, version)
+    # Read it back so a fresh parse returns the same float32 columns as a cache hit
+    return read_cache(cache_dir, source, version)
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Benchmark against parsing the text
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def benchmark(sizes=(1200, 20000, 200000)):
+    from campaign_gen import write_ubts_export
+    from ubts_export import read_ubts_export, PARSER_VERSION
+
+    fldr = tempfile.mkdtemp()
+    cache_root = os.path.join(fldr, 'Cache')
+    for n_samples in sizes:
+        filename = os.path.join(fldr, 'export_%d.txt' % n_samples)
+        write_ubts_export(filename, n_samples)
+
+        t0 = time.time()
+        read_ubts_export(filename)
+        t_text = time.time() - t0
+
+        load_cached(filename, cache_root, read_ubts_export, PARSER_VERSION)
+        t0 = time.time()
+        data, _ = load_cached(filename, cache_root, read_ubts_export, PARSER_VERSION)
+        # touch every value, a memory map alone reads nothing
+        data.to_numpy().sum()
+        t_cache = time.time() - t0
+        print('%7d samples (%6.1f MB): text %0.4f s, cache hit %0.4f s (%0.1fx)'
+              % (n_samples, os.path.getsize(filename) / 2 ** 20, t_text, t_cache, t_text / t_cache))
+    shutil.rmtree(fldr)
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Single-pass reader for UBTS tab-delimited exports.
+The 66-line preamble is read once for the notes, brew code and other metadata,
+then the numeric block is streamed from the same handle into float32 columns.
+Header rows repeated inside the numeric block are found in the same pass and
+split the block into segments, each read as pure float32 columns.
+Run this file directly to benchmark the split against the object-dtype path.
+"""
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+PREAMBLE_LINES = 66
+NOTES_LINE = 61
+# Bumped whenever the parsed data changes, so cached exports are parsed again
+PARSER_VERSION = 3
+
+# Known headers of the export columns
+UBTS_COLUMNS = [
+    'Sample Time (s)',
+    'T entrance needle (degF)',
+    'T exit stream (degF)',
+    'T AUX (degF)',
+    'T in-cup (degF)',
+    'AUX sensor (psig)',
+    'Brew Mass (g)',
+    'Brewer Current (Arms)',
+    'ARxBrewerV (ml)',
+    'ARxBrewerT (degF)',
+    'ARxBrewerP (pressure)',
+    'ARxBrewerF (ml/sec)',
+    'EN Synced Temp (degF)',
+    'EN Synced Mass (degF)',
+    'ES Synced Temp (degF)',
+    'ES Synced Mass (degF)'
+]
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Function definition for common utilities
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def parse_preamble(lines):
+    # Pull the notes, brew code and any "key<tab>value" fields out of the preamble
+    fields = {}
+    for line in lines:
+        key, _, value = line.rstrip('\r\n').partition('\t')
+        key = key.strip().rstrip(':')
+        if key and value.strip():
+            fields[key] = value.strip()
+
+    notes = lines[NOTES_LINE].rstrip('\r\n') if len(lines) > NOTES_LINE else ''
+    if "PULSE" in notes:
+        brew_code = 'Pulse'
+    else:
+        brew_code = 'Europa'
+    return {'notes': notes, 'brew_code': brew_code, 'fields': fields}
+
+
+def split_segments(block):
+    # (start, stop) byte ranges of the numeric rows of block, which starts with
+    # the header row. Every later row starting with the header's first field is
+    # a repeated header that ends one segment and starts the next.
+    header_end = block.find(b'\n') + 1
+    if header_end == 0:
+        return []
+    marker = b'\n' + block[:header_end].split(b'\t')[0] + b'\t'
+    ranges = []
+    start = header_end
+    while True:
+        repeat = block.find(marker, start - 1)
+        if repeat < 0:
+            ranges.append((start, len(block)))
+            break
+        ranges.append((start, repeat + 1))
+        line_end = block.find(b'\n', repeat + 1)
+        start = len(block) if line_end < 0 else line_end + 1
+    # Drop segments without data, e.g. a header repeated as the last row
+    return [(start, stop) for start, stop in ranges if block[start:stop].strip()]
+
+
+def read_ubts_segments(file):
+    # Returns the numeric segments of the export as a list of dataframes of
+    # float32 columns, one per run of rows between header rows, and a metadata
+    # dict. Each segment can be kept as its own trace.
+    with open(file, 'rb') as fobj:
+        preamble = [fobj.readline().decode('utf-8', 'replace') for _ in range(PREAMBLE_LINES)]
+        block = fobj.read()
+    metadata = parse_preamble(preamble)
+
+    segments = []
+    for start, stop in split_segments(block):
+        data = pd.read_csv(io.BytesIO(block[start:stop]), sep='\t', header=None, dtype=np.float32)
+        # Rename columns based on known headers
+        data.columns = UBTS_COLUMNS[:data.shape[1]]
+        # drop nan columns
+        segments.append(data.dropna(axis=1))
+    metadata['segments'] = len(segments)
+    return segments, metadata
+
+
+def read_ubts_export(file):
+    # Returns the export as a dataframe of float32 columns and a metadata dict.
+    # Segments split by repeated header rows are joined back into one trace.
+    segments, metadata = read_ubts_segments(file)
+    if not segments:
+        print('Empty Dataframe: ' + file)
+        return pd.DataFrame(), metadata
+    if len(segments) > 1:
+        print('Joined ' + str(len(segments)) + ' segments split by repeated header rows for file: ' + file)
+        return pd.concat(segments, ignore_index=True), metadata
+    return segments[0], metadata
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Benchmark against the object-dtype path
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+def _read_ubts_export_object(file):
+    # The fallback previously used when the numeric block had header rows:
+    # read everything as text, drop the header rows and convert
+    with open(file, 'r') as fobj:
+        for _ in range(PREAMBLE_LINES):
+            fobj.readline()
+        data = pd.read_csv(fobj, sep='\t', header=0, low_memory=False)
+    first = data.iloc[:, 0].astype(str)
+    return data[first != data.columns[0]].astype(np.float32)
+
+
+def benchmark(n_samples=1000000, n_segments=10):
+    from campaign_gen import write_ubts_export
+
+    fldr = tempfile.mkdtemp()
+    filename = os.path.join(fldr, 'Cycle01.txt')
+    write_ubts_export(filename, n_samples, repeat_header_every=n_samples // n_segments)
+
+    t0 = time.time()
+    old = _read_ubts_export_object(filename)
+    t_old = time.time() - t0
+
+    t0 = time.time()
+    segments, metadata = read_ubts_segments(filename)
+    t_new = time.time() - t0
+
+    n_rows = sum(len(segment) for segment in segments)
+    same = np.array_equal(old.to_numpy(), pd.concat(segments).to_numpy(), equal_nan=True)
+    print('Samples: %d in %d segments, same values: %s' % (n_rows, metadata['segments'], same))
+    print('Object-dtype read took %0.3f s' % t_old)
+    print('Segment split took %0.3f s (%0.1fx)' % (t_new, t_old / t_new))
+    os.remove(filename)
+    os.rmdir(fldr)
+
+
+if __name__ == "__main__":
+    benchmark()